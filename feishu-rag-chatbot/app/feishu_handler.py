@@ -1,8 +1,90 @@
+import asyncio
 import json
-from typing import Dict, Any
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
 from loguru import logger
-from services.feishu_service import feishu_service
+from config.settings import settings
+from services.context_builder import format_pages
+from services.feishu_service import async_feishu_service
+from services.metrics import track
 from services.rag_service import rag_service
+from services.session_service import session_store
+from services.shared_state import shared_state
+from services.task_queue import TaskQueue
+
+
+# Message events are answered in the background so the webhook can ack at once
+feishu_task_queue = TaskQueue(
+    "feishu",
+    workers=settings.feishu_task_workers,
+    max_size=settings.feishu_task_queue_size
+)
+
+# Documents shown by the /list command
+LIST_PAGE_SIZE = 20
+
+# Recently seen event/message ids, used to drop Feishu retries
+_seen_events: "OrderedDict[str, float]" = OrderedDict()
+_duplicate_events = 0
+
+
+def _event_keys(event_data: Dict[str, Any]) -> List[str]:
+    """Identifiers that mark a redelivery of the same event"""
+    keys = []
+    event_id = event_data.get("header", {}).get("event_id")
+    if event_id:
+        keys.append(f"event:{event_id}")
+    message_id = event_data.get("event", {}).get("message", {}).get("message_id")
+    if message_id:
+        keys.append(f"message:{message_id}")
+    return keys
+
+
+def _mark_seen(keys: List[str]) -> bool:
+    """Record event keys; returns False if any of them was already seen"""
+    global _duplicate_events
+    
+    now = time.monotonic()
+    ttl = settings.feishu_event_dedup_ttl_seconds
+    while _seen_events:
+        oldest_key, seen_at = next(iter(_seen_events.items()))
+        if now - seen_at < ttl:
+            break
+        _seen_events.pop(oldest_key)
+    
+    if any(key in _seen_events for key in keys):
+        _duplicate_events += 1
+        return False
+    
+    # Feishu may redeliver to another worker process
+    if settings.multi_worker and not shared_state.add_all(_shared_keys(keys), ttl=ttl):
+        _duplicate_events += 1
+        return False
+    
+    for key in keys:
+        _seen_events[key] = now
+    return True
+
+
+def _shared_keys(keys: List[str]) -> List[str]:
+    return [f"feishu_event:{key}" for key in keys]
+
+
+def _forget(keys: List[str]):
+    for key in keys:
+        _seen_events.pop(key, None)
+    if settings.multi_worker:
+        shared_state.delete(*_shared_keys(keys))
+
+
+def get_event_stats() -> Dict[str, Any]:
+    """Background queue and deduplication counters"""
+    return {
+        "queue": feishu_task_queue.stats(),
+        "duplicates_dropped": _duplicate_events,
+        "dedup_entries": len(_seen_events)
+    }
 
 
 async def handle_feishu_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -11,7 +93,17 @@ async def handle_feishu_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
     event_type = event_data.get("header", {}).get("event_type")
     
     if event_type == "im.message.receive_v1":
-        return await handle_message_event(event_data)
+        keys = _event_keys(event_data)
+        if not _mark_seen(keys):
+            logger.info(f"Dropping duplicate Feishu event: {keys}")
+            return {"status": "ok"}
+        
+        if not feishu_task_queue.submit(lambda: _answer_message_event(event_data)):
+            # Let Feishu redeliver later instead of silently losing the message
+            _forget(keys)
+            return {"status": "busy"}
+        
+        return {"status": "ok"}
     elif event_type == "im.message.message_read_v1":
         # Handle message read event if needed
         return {"status": "ok"}
@@ -20,6 +112,12 @@ async def handle_feishu_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
         return {"status": "ok"}
 
 
+async def _answer_message_event(event_data: Dict[str, Any]):
+    """Background task: answer a message, timing it end to end"""
+    with track("feishu_message"):
+        await handle_message_event(event_data)
+
+
 async def handle_message_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
     """Handle message events from Feishu"""
     try:
@@ -46,24 +144,29 @@ async def handle_message_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
             return {"status": "ok"}
         
         logger.info(f"Received message from {user_id}: {text}")
+        session_key = f"feishu:{chat_id}:{user_id}"
         
         # Handle special commands
         if text.startswith("/"):
             response = await handle_command(text, user_id, chat_id)
+        elif settings.feishu_streaming_enabled:
+            await stream_answer(message_id, text, session_key)
+            return {"status": "ok"}
         else:
-            # Query RAG system
-            result = rag_service.query(text)
-            response = result["response"]
-            
-            # Add sources if available
-            if result.get("sources"):
-                sources_text = "\n\n📚 Sources:\n"
-                for source in result["sources"]:
-                    sources_text += f"- {source['filename']} (Page {source['page']})\n"
-                response += sources_text
+            # Query RAG system with the conversation so far, within the /scope documents.
+            # Identical questions with the same history share the whole answer; others share retrieval.
+            result = await rag_service.query(
+                text,
+                file_ids=_scope_file_ids(session_key),
+                chat_history=session_store.get_history(session_key)
+            )
+            # A failed answer is an apology; keep it out of the conversation
+            if not result.get("error"):
+                session_store.append_turn(session_key, text, result["response"])
+            response = result["response"] + _format_sources_text(result.get("sources"))
         
         # Send reply
-        feishu_service.reply_message(message_id, response)
+        await async_feishu_service.reply_message(message_id, response)
         
         return {"status": "ok"}
     
@@ -71,7 +174,7 @@ async def handle_message_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
         logger.error(f"Error handling message event: {e}")
         # Send error message to user
         try:
-            feishu_service.reply_message(
+            await async_feishu_service.reply_message(
                 message_id,
                 "Sorry, I encountered an error processing your message. Please try again later."
             )
@@ -80,6 +183,79 @@ async def handle_message_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
         return {"status": "error", "message": str(e)}
 
 
+async def stream_answer(message_id: str, text: str, session_key: str):
+    """Reply with an interactive card and patch it as answer tokens arrive"""
+    title = "🤖 Answer"
+    card = async_feishu_service.create_interactive_card(title, "Thinking...")
+    card["card"]["config"]["update_multi"] = True
+    reply = await async_feishu_service.reply_message(message_id, card, msg_type="interactive")
+    card_message_id = (reply.get("data") or {}).get("message_id")
+    
+    answer = ""
+    sources = []
+    failed = False
+    last_update = time.monotonic()
+    updated_length = 0
+    
+    async for event in rag_service.stream_query(
+        text,
+        file_ids=_scope_file_ids(session_key),
+        chat_history=session_store.get_history(session_key)
+    ):
+        if event["type"] == "sources":
+            sources = event["sources"]
+        elif event["type"] == "token":
+            answer += event["content"]
+            # Throttle card patches to stay within Feishu rate limits
+            now = time.monotonic()
+            if (
+                card_message_id
+                and now - last_update >= settings.feishu_stream_update_interval
+                and len(answer) > updated_length
+            ):
+                card = async_feishu_service.create_interactive_card(title, answer + " ▌")
+                card["card"]["config"]["update_multi"] = True
+                try:
+                    await async_feishu_service.update_card(card_message_id, card)
+                except Exception as e:
+                    # Progress patches are best effort; the final update carries the whole answer
+                    logger.warning(f"Skipping streamed card update for {message_id}: {e}")
+                last_update = now
+                updated_length = len(answer)
+        elif event["type"] == "done":
+            failed = event.get("error", False)
+    
+    if not failed:
+        session_store.append_turn(session_key, text, answer)
+    final_text = answer + _format_sources_text(sources)
+    if card_message_id:
+        card = async_feishu_service.create_interactive_card(title, final_text)
+        card["card"]["config"]["update_multi"] = True
+        await async_feishu_service.update_card(card_message_id, card)
+    else:
+        # The card could not be posted; fall back to a plain text reply
+        await async_feishu_service.reply_message(message_id, final_text)
+
+
+def _scope_file_ids(session_key: str) -> Optional[List[str]]:
+    """File ids set with /scope, or None to search every document"""
+    return [doc["file_id"] for doc in session_store.get_scope(session_key)] or None
+
+
+def _format_scope(documents: List[Dict[str, str]]) -> str:
+    return "".join(f"- {doc['filename']} (ID: {doc['file_id'][:8]}...)\n" for doc in documents)
+
+
+def _format_sources_text(sources) -> str:
+    """Render sources as a trailing text block"""
+    if not sources:
+        return ""
+    sources_text = "\n\n📚 Sources:\n"
+    for source in sources:
+        sources_text += f"- {source['filename']} ({format_pages(source)})\n"
+    return sources_text
+
+
 async def handle_command(command: str, user_id: str, chat_id: str) -> str:
     """Handle special commands"""
     command_parts = command.split()
@@ -92,36 +268,89 @@ async def handle_command(command: str, user_id: str, chat_id: str) -> str:
 /list - List all uploaded documents
 /info <filename> - Get information about a specific document
 /search <query> - Search across all documents
+/scope <filename or ID>[; ...] - Limit questions to these documents
+/scope - Show the current scope; /scope clear - search all documents again
+/reset - Start a new conversation
 
 To ask questions about the documents, just type your question naturally!
 
 For uploading PDFs, please use the web interface or API endpoint."""
     
     elif cmd == "/list":
-        documents = rag_service.list_documents()
+        documents, total = await asyncio.to_thread(
+            rag_service.list_documents, 0, LIST_PAGE_SIZE
+        )
         if not documents:
             return "📄 No documents uploaded yet."
         
         doc_list = "📄 Available documents:\n"
         for doc in documents:
             doc_list += f"- {doc['filename']} (ID: {doc['file_id'][:8]}...)\n"
+        if total > len(documents):
+            doc_list += f"...and {total - len(documents)} more\n"
         return doc_list
     
     elif cmd == "/info" and len(command_parts) > 1:
         filename = " ".join(command_parts[1:])
-        documents = rag_service.list_documents()
+        documents = await asyncio.to_thread(rag_service.find_documents, filename)
         
-        for doc in documents:
-            if doc['filename'].lower() == filename.lower():
-                # Get more info about the document
-                return f"📄 Document: {doc['filename']}\nID: {doc['file_id']}\n\nUse this document by asking questions about its content!"
+        if documents:
+            doc = documents[0]
+            info = f"📄 Document: {doc['filename']}\nID: {doc['file_id']}"
+            if doc.get("pages"):
+                info += f"\nPages: {doc['pages']}"
+            if doc.get("chunks"):
+                info += f"\nChunks: {doc['chunks']}"
+            if doc.get("summary"):
+                info += f"\n\nSummary: {doc['summary']}"
+            return info + "\n\nUse this document by asking questions about its content!"
         
         return f"Document '{filename}' not found. Use /list to see available documents."
     
     elif cmd == "/search" and len(command_parts) > 1:
         query = " ".join(command_parts[1:])
-        result = rag_service.query(query)
+        result = await rag_service.query(query)
         return result["response"]
     
+    elif cmd == "/scope":
+        return await handle_scope(command[len(command_parts[0]):].strip(), f"feishu:{chat_id}:{user_id}")
+    
+    elif cmd == "/reset":
+        session_store.clear(f"feishu:{chat_id}:{user_id}")
+        return "🧹 Conversation history cleared."
+    
     else:
-        return "Unknown command. Type /help for available commands."
\ No newline at end of file
+        return "Unknown command. Type /help for available commands."
+
+
+async def handle_scope(args: str, session_key: str) -> str:
+    """Show, set or clear the documents this conversation's questions are limited to"""
+    if not args:
+        scope = session_store.get_scope(session_key)
+        if not scope:
+            return "🔎 Questions search all documents. Use /scope <filename> to limit them."
+        return "🔎 Questions are limited to:\n" + _format_scope(scope) + "Use /scope clear to search all documents."
+    
+    if args.lower() in ("clear", "all", "off"):
+        session_store.set_scope(session_key, [])
+        return "🔎 Scope cleared. Questions search all documents."
+    
+    selected = []
+    for term in (part.strip().rstrip(".") for part in args.split(";")):
+        if not term:
+            continue
+        matches = await asyncio.to_thread(rag_service.resolve_documents, term)
+        if not matches:
+            return f"Document '{term}' not found. Use /list to see available documents."
+        if len(matches) > 1:
+            return (
+                f"'{term}' matches several documents:\n" + _format_scope(matches)
+                + "Use the full filename or ID."
+            )
+        if all(doc["file_id"] != matches[0]["file_id"] for doc in selected):
+            selected.append({"file_id": matches[0]["file_id"], "filename": matches[0]["filename"]})
+    
+    if not selected:
+        return "Usage: /scope <filename or ID>[; <filename or ID> ...]"
+    session_store.set_scope(session_key, selected)
+    return "🔎 Questions are now limited to:\n" + _format_scope(selected)
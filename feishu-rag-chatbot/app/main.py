@@ -1,30 +1,155 @@
-from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse
+import time
+
+# Taken before the application modules are imported, for the startup breakdown
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import asyncio
 import json
 import os
-from typing import Optional, Dict, Any
+import tempfile
+from typing import Optional, Dict, Any, AsyncIterator, Tuple
 from loguru import logger
 
 from config.settings import settings
-from models.chat_models import FeishuEvent, ChatRequest, ChatResponse, PDFUploadResponse
-from services.feishu_service import feishu_service
+from models.chat_models import (
+    FeishuEvent, ChatRequest, ChatResponse, IngestionJobResponse, JobStatusResponse, BulkIngestResponse
+)
+from services.feishu_service import feishu_service, async_feishu_service
+from services.pdf_service import pdf_service, FileTooLargeError
 from services.rag_service import rag_service
-from app.feishu_handler import handle_feishu_event
+from services.ingestion_service import ingestion_service
+from services.bulk_ingestion import bulk_ingestion_service
+from services.session_service import session_store
+from services.context_builder import get_encoding
+from services import metrics
+from services.shared_state import shared_state
+from app.feishu_handler import handle_feishu_event, feishu_task_queue, get_event_stats
+from app.uploads import MultipartUpload
+
+
+# Allowance for multipart boundaries and headers around the uploaded file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
 
+# How long a reader worker waits for the ingestion writer to apply a deletion
+DELETE_WAIT_SECONDS = 30
+
+# Multi-worker mode: how often each worker shares its metrics for /metrics on any worker to merge
+METRICS_PUBLISH_SECONDS = 5.0
+METRICS_KEY_PREFIX = "metrics:"
 
 # Configure logger
 logger.add("logs/app.log", rotation="500 MB", level="INFO")
 
+_import_seconds = time.perf_counter() - _import_started
+logger.info(f"Imported application modules in {_import_seconds:.2f}s")
+
+# Filled in by the background warm-up; /health/ready reports it
+startup_state: Dict[str, Any] = {
+    "status": "starting",
+    "error": None,
+    "stages": {"import": round(_import_seconds, 3)}
+}
+
+# Values read from the services' own counters when /metrics is scraped
+metrics.cache_hit_rate.set_function(lambda: rag_service.answer_cache.stats()["hit_rate"], cache="answer")
+metrics.cache_hit_rate.set_function(lambda: rag_service.vector_db.embedder.stats()["cache_hit_rate"], cache="query_embedding")
+metrics.cache_hit_rate.set_function(lambda: rag_service.reranker.stats()["cache_hit_rate"], cache="rerank")
+metrics.queue_depth.set_function(lambda: feishu_task_queue.stats()["queued"], queue="feishu")
+metrics.queue_depth.set_function(ingestion_service.queue_size, queue="ingestion")
+metrics.queue_depth.set_function(async_feishu_service.dispatcher.queue_size, queue="feishu_outbound")
+
+
+def _metrics_key() -> str:
+    return f"{METRICS_KEY_PREFIX}{os.getpid()}"
+
+
+def _publish_metrics():
+    # Expires unless refreshed, so an exited worker stops counting after a few intervals
+    shared_state.set(_metrics_key(), metrics.registry.snapshot(), ttl=3 * METRICS_PUBLISH_SECONDS)
+
+
+async def _publish_metrics_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_publish_metrics)
+        except Exception as e:
+            logger.error(f"Error publishing metrics: {e}")
+        await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+
+
+def _render_all_workers_metrics() -> str:
+    """Metrics of every live worker process, merged; this worker's are current"""
+    _publish_metrics()
+    return metrics.registry.render(list(shared_state.get_prefix(METRICS_KEY_PREFIX).values()))
+
+
+async def _timed_stage(name: str, step):
+    start = time.perf_counter()
+    await asyncio.to_thread(step)
+    startup_state["stages"][name] = round(time.perf_counter() - start, 3)
+
+
+async def warm_up():
+    """Load models and stores in the background so the server accepts connections at once
+    
+    Requests that arrive earlier still work; they load what they need on first use.
+    """
+    start = time.perf_counter()
+    try:
+        # Independent loads run side by side
+        loads = [
+            _timed_stage("chroma", rag_service.vector_db.load),
+            _timed_stage("embedding_model", rag_service.vector_db.embedder.load),
+            _timed_stage("tokenizer", lambda: get_encoding(settings.openai_model)),
+        ]
+        if rag_service.reranker.enabled:
+            loads.append(_timed_stage("rerank_model", rag_service.reranker.load))
+        await asyncio.gather(*loads)
+        # One-time migrations write to the stores; only the ingestion writer runs them
+        if ingestion_service.is_writer:
+            await _timed_stage("catalog_sync", rag_service.sync_catalog)
+            await _timed_stage("lexical_sync", rag_service.vector_db.sync_lexical_index)
+        startup_state["status"] = "ready"
+    except Exception as e:
+        logger.exception(f"Warm-up failed: {e}")
+        startup_state["status"] = "failed"
+        startup_state["error"] = str(e)
+    
+    startup_state["stages"]["warm_up"] = round(time.perf_counter() - start, 3)
+    breakdown = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in startup_state["stages"].items())
+    logger.info(f"Startup {startup_state['status']}: {breakdown}")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting Feishu RAG Chatbot...")
+    await ingestion_service.start()
+    await bulk_ingestion_service.start()
+    await feishu_task_queue.start()
+    warm_up_task = asyncio.create_task(warm_up())
+    metrics_task = asyncio.create_task(_publish_metrics_loop()) if settings.multi_worker else None
     yield
     # Shutdown
     logger.info("Shutting down Feishu RAG Chatbot...")
+    if not warm_up_task.done():
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+    if metrics_task is not None:
+        metrics_task.cancel()
+        await asyncio.gather(metrics_task, return_exceptions=True)
+        shared_state.delete(_metrics_key())
+    await feishu_task_queue.stop()
+    await bulk_ingestion_service.stop()
+    await ingestion_service.stop()
+    await async_feishu_service.aclose()
+    await rag_service.async_llm.aclose()
+    rag_service.vector_db.close()
+    pdf_service.close()
 
 
 app = FastAPI(
@@ -40,6 +165,25 @@ if os.path.exists(static_path):
     app.mount("/static", StaticFiles(directory=static_path), name="static")
 
 
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads from Content-Length before the body is read"""
+    limits_mb = {
+        "/api/upload_pdf": settings.max_file_size_mb,
+        "/api/bulk_ingest": settings.bulk_max_archive_mb
+    }
+    limit_mb = limits_mb.get(request.url.path)
+    if limit_mb is not None:
+        max_bytes = limit_mb * 1024 * 1024 + MULTIPART_OVERHEAD_BYTES
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            return JSONResponse(
+                content={"detail": f"File size exceeds {limit_mb}MB limit"},
+                status_code=413
+            )
+    return await call_next(request)
+
+
 @app.get("/")
 async def root():
     # Serve the test interface
@@ -72,9 +216,11 @@ async def feishu_webhook(request: Request):
         if event_data.get("type") == "url_verification":
             return JSONResponse(content={"challenge": event_data.get("challenge")})
         
-        # Handle event
+        # Handle event; message answers are produced in the background
         response = await handle_feishu_event(event_data)
         
+        if response.get("status") == "busy":
+            return JSONResponse(content=response, status_code=503)
         return JSONResponse(content=response)
     
     except Exception as e:
@@ -85,17 +231,30 @@ async def feishu_webhook(request: Request):
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Chat endpoint for direct API access"""
+    if request.stream:
+        return StreamingResponse(
+            _stream_chat(request),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
     try:
         # Query RAG system
-        result = rag_service.query(
+        result = await rag_service.query(
             query=request.message,
-            chat_history=request.context
+            file_ids=request.file_ids,
+            chat_history=_chat_history(request)
         )
         
+        # A failed answer is an apology; keep it out of the conversation
+        if request.session_id and not result.get("error"):
+            session_store.append_turn(_session_key(request), request.message, result["response"])
+        
         return ChatResponse(
             message=result["response"],
             sources=result["sources"],
-            session_id=request.session_id or "default"
+            session_id=request.session_id or "default",
+            usage=result.get("usage")
         )
     
     except Exception as e:
@@ -103,48 +262,210 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/upload_pdf", response_model=PDFUploadResponse)
-async def upload_pdf(
-    file: UploadFile = File(...),
-    description: Optional[str] = Form(None)
-):
-    """Upload and process PDF file"""
+def _session_key(request: ChatRequest) -> str:
+    return f"api:{request.session_id}"
+
+
+def _chat_history(request: ChatRequest):
+    """Client-sent context wins; otherwise use the server-side session history"""
+    if request.context is not None:
+        return request.context
+    if request.session_id:
+        return session_store.get_history(_session_key(request))
+    return None
+
+
+async def _stream_chat(request: ChatRequest):
+    """Server-sent events: sources, then answer tokens, then done"""
+    session_id = request.session_id or "default"
+    answer = []
+    failed = False
+    try:
+        async for event in rag_service.stream_query(
+            query=request.message,
+            file_ids=request.file_ids,
+            chat_history=_chat_history(request)
+        ):
+            if event["type"] == "token":
+                answer.append(event["content"])
+            elif event["type"] == "done":
+                failed = event.get("error", False)
+            event["session_id"] = session_id
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        
+        if request.session_id and not failed:
+            session_store.append_turn(_session_key(request), request.message, "".join(answer))
+    except Exception as e:
+        logger.error(f"Error in streaming chat endpoint: {e}")
+        yield f"data: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+
+def _multipart_body(**fields: str) -> Dict[str, Any]:
+    """OpenAPI request body for endpoints that parse their multipart form themselves"""
+    properties = {
+        name: {"type": "string", "format": "binary"} if kind == "binary" else {"type": kind}
+        for name, kind in fields.items()
+    }
+    return {"requestBody": {"content": {"multipart/form-data": {"schema": {"type": "object", "properties": properties}}}}}
+
+
+@app.post(
+    "/api/upload_pdf",
+    response_model=IngestionJobResponse,
+    status_code=202,
+    openapi_extra=_multipart_body(file="binary", description="string", replaces="string")
+)
+async def upload_pdf(request: Request):
+    """Upload a PDF file (form field "file") and queue it for background processing"""
+    max_bytes = settings.max_file_size_mb * 1024 * 1024
     try:
+        # The body is parsed as it arrives, so the file is written to disk only once
+        upload = MultipartUpload(request, max_bytes + MULTIPART_OVERHEAD_BYTES)
+        filename = await upload.open_file("file")
+        
         # Validate file
-        if not file.filename.endswith('.pdf'):
+        if filename is None:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+        if not filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
         
-        # Check file size
-        content = await file.read()
-        file_size_mb = len(content) / (1024 * 1024)
-        if file_size_mb > settings.max_file_size_mb:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File size exceeds {settings.max_file_size_mb}MB limit"
-            )
+        # Stream the file to disk in chunks, hashing as it goes
+        file_id, _ = await pdf_service.save_pdf_stream(upload.file_chunks(), filename, max_bytes)
+        fields = await upload.finish()
+        replaces = fields.get("replaces") or None
         
-        # Process PDF
-        file_id, result = rag_service.process_pdf(content, file.filename)
+        # Hand the saved PDF to the ingestion workers
+        job = ingestion_service.submit(file_id, filename, replaces=replaces)
         
-        return PDFUploadResponse(
+        return IngestionJobResponse(
+            job_id=job["job_id"],
             file_id=file_id,
-            filename=file.filename,
-            pages=result["pages"],
-            chunks=result["chunks"],
-            message=f"Successfully processed PDF: {file.filename}"
+            filename=filename,
+            status=job["status"],
+            message=f"PDF queued for processing: {filename}"
         )
     
+    except HTTPException:
+        raise
+    except FileTooLargeError:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File size exceeds {settings.max_file_size_mb}MB limit"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error uploading PDF: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _save_archive(chunks: AsyncIterator[bytes]) -> str:
+    """Stream an uploaded zip archive to a temporary file, enforcing BULK_MAX_ARCHIVE_MB"""
+    max_bytes = settings.bulk_max_archive_mb * 1024 * 1024
+    storage_dir = os.path.dirname(os.path.abspath(settings.bulk_state_path))
+    os.makedirs(storage_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".zip", dir=storage_dir)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise FileTooLargeError(f"Archive exceeds {settings.bulk_max_archive_mb}MB")
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+async def _read_bulk_form(request: Request) -> Tuple[Optional[str], Dict[str, str]]:
+    """Save the archive, if any, as it streams in; return its path and the text fields"""
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        # A directory-only request may be url-encoded; it carries no file
+        form = await request.form()
+        return None, {key: value for key, value in form.items() if isinstance(value, str)}
+    max_bytes = settings.bulk_max_archive_mb * 1024 * 1024
+    upload = MultipartUpload(request, max_bytes + MULTIPART_OVERHEAD_BYTES)
+    filename = await upload.open_file("archive")
+    if filename is None:
+        return None, await upload.finish()
+    if not filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="Only zip archives are allowed")
+    archive_path = await _save_archive(upload.file_chunks())
+    try:
+        return archive_path, await upload.finish()
+    except BaseException:
+        os.remove(archive_path)
+        raise
+
+
+@app.post(
+    "/api/bulk_ingest",
+    response_model=BulkIngestResponse,
+    status_code=202,
+    openapi_extra=_multipart_body(archive="binary", directory="string", summaries="string")
+)
+async def bulk_ingest(request: Request):
+    """Queue a zip archive of PDFs (form field "archive"), or a directory under BULK_IMPORT_ROOT, for bulk ingestion"""
+    try:
+        try:
+            archive_path, fields = await _read_bulk_form(request)
+        except FileTooLargeError:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File size exceeds {settings.bulk_max_archive_mb}MB limit"
+            )
+        directory = fields.get("directory")
+        summaries = fields.get("summaries") or None
+        if archive_path is not None:
+            try:
+                # Members are copied into PDF storage, so the archive is not kept
+                batch = await asyncio.to_thread(bulk_ingestion_service.create_from_zip, archive_path, summaries)
+            finally:
+                os.remove(archive_path)
+        elif directory:
+            root = os.path.realpath(settings.bulk_import_root)
+            path = os.path.realpath(os.path.join(root, directory))
+            if os.path.commonpath([root, path]) != root:
+                raise HTTPException(status_code=400, detail="Directory must be inside BULK_IMPORT_ROOT")
+            batch = await asyncio.to_thread(bulk_ingestion_service.create_from_directory, path, summaries)
+        else:
+            raise HTTPException(status_code=400, detail="Provide a zip archive or a directory")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # In multi-worker mode a reader leaves the batch for the ingestion writer to pick up
+    if ingestion_service.is_writer:
+        bulk_ingestion_service.submit(batch["batch_id"])
+    return BulkIngestResponse(**batch)
+
+
+@app.get("/api/bulk_ingest/{batch_id}", response_model=BulkIngestResponse)
+async def get_bulk_batch(batch_id: str):
+    """Get the progress of a bulk ingestion batch"""
+    batch = await asyncio.to_thread(bulk_ingestion_service.status, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return BulkIngestResponse(**batch)
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Get ingestion job status and per-stage progress"""
+    job = ingestion_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JobStatusResponse(**job)
+
+
 @app.get("/api/documents")
-async def list_documents():
-    """List all documents in the system"""
+async def list_documents(offset: int = 0, limit: int = 100):
+    """List documents in the system, newest first"""
     try:
-        documents = rag_service.list_documents()
-        return {"documents": documents}
+        limit = min(max(limit, 1), 1000)
+        documents, total = await asyncio.to_thread(rag_service.list_documents, offset, limit)
+        return {"documents": documents, "total": total, "offset": offset, "limit": limit}
     except Exception as e:
         logger.error(f"Error listing documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -154,14 +475,76 @@ async def list_documents():
 async def delete_document(file_id: str):
     """Delete a document from the system"""
     try:
-        rag_service.delete_document(file_id)
+        if ingestion_service.is_writer:
+            await asyncio.to_thread(rag_service.delete_document, file_id)
+            return {"message": f"Document {file_id} deleted successfully"}
+        
+        # Multi-worker reader: the ingestion writer owns the stores
+        job = ingestion_service.submit_delete(file_id)
+        job = await ingestion_service.wait_for(job["job_id"], timeout=DELETE_WAIT_SECONDS)
+        if job["status"] == "failed":
+            raise HTTPException(status_code=500, detail=job["error"])
+        if job["status"] != "completed":
+            return JSONResponse(
+                content={"message": f"Deletion of {file_id} queued", "job_id": job["job_id"]},
+                status_code=202
+            )
         return {"message": f"Document {file_id} deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error deleting document: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/stats")
+async def stats():
+    """Background queue and backpressure statistics"""
+    return {
+        "feishu_events": get_event_stats(),
+        "ingestion": {"queued": ingestion_service.queue_size()},
+        "answer_cache": rag_service.answer_cache.stats(),
+        "embedding": rag_service.vector_db.embedder.stats(),
+        "rerank": rag_service.reranker.stats(),
+        "filtered_search": rag_service.vector_db.filter_stats(),
+        "coalescing": rag_service.coalesce_stats(),
+        "feishu_outbound": async_feishu_service.dispatcher.stats(),
+        "sessions": session_store.stats(),
+        "worker": {
+            "pid": os.getpid(),
+            "role": "writer" if ingestion_service.is_writer else "reader",
+            "corpus_version": rag_service.corpus_version
+        }
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-stage latency histograms, in-flight gauges, token counts and cache hit rates
+    
+    In multi-worker mode the values of all workers are merged, whichever one serves the scrape.
+    """
+    if settings.multi_worker:
+        body = await asyncio.to_thread(_render_all_workers_metrics)
+    else:
+        body = metrics.registry.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "feishu-rag-chatbot"}
\ No newline at end of file
+    return {"status": "healthy", "service": "feishu-rag-chatbot"}
+
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """Models and stores are loaded; 503 while warming up or after a failed warm-up"""
+    status_code = 200 if startup_state["status"] == "ready" else 503
+    return JSONResponse(content=startup_state, status_code=status_code)
\ No newline at end of file
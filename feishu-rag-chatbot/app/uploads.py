@@ -0,0 +1,140 @@
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+from fastapi import Request
+from multipart.multipart import MultipartParser, parse_options_header
+from services.pdf_service import FileTooLargeError
+
+
+class MultipartUpload:
+    """Parses a multipart/form-data request body as it arrives
+
+    Unlike UploadFile, nothing is spooled before the handler runs: the file
+    part is handed over chunk by chunk while the body is still being received,
+    and the body is cut off with FileTooLargeError once it exceeds max_bytes,
+    whether or not the client sent a Content-Length. Text fields are collected
+    in `fields`; those sent after the file are available after finish().
+
+        filename = await upload.open_file("file")
+        await save(upload.file_chunks())
+        fields = await upload.finish()
+    """
+
+    def __init__(self, request: Request, max_bytes: int):
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise ValueError("Expected a multipart/form-data body")
+        self.fields: Dict[str, str] = {}
+        self._request = request
+        self._max_bytes = max_bytes
+        self._file_field: Optional[str] = None
+        self._events: Deque[Tuple[str, object]] = deque()
+        self._reader = self._read()
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end
+        })
+        # State of the part being parsed
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._part_name: Optional[str] = None
+        self._part_kind = "skip"  # "field", "file" (the one being streamed) or "skip"
+        self._part_data: List[bytes] = []
+
+    # Parser callbacks, called synchronously from MultipartParser.write
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._part_name = None
+        self._part_kind = "skip"
+        self._part_data = []
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if b"name" not in options:
+            return
+        self._part_name = options[b"name"].decode("utf-8", errors="replace")
+        if b"filename" not in options:
+            self._part_kind = "field"
+        elif self._part_name == self._file_field:
+            # Only the first file sent under the expected name is streamed; others are discarded
+            self._file_field = None
+            self._part_kind = "file"
+            self._events.append(("file", options[b"filename"].decode("utf-8", errors="replace")))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._part_kind == "file":
+            self._events.append(("data", data[start:end]))
+        elif self._part_kind == "field":
+            self._part_data.append(data[start:end])
+
+    def _on_part_end(self):
+        if self._part_kind == "file":
+            self._events.append(("end", None))
+        elif self._part_kind == "field":
+            self.fields[self._part_name] = b"".join(self._part_data).decode("utf-8", errors="replace")
+
+    async def _read(self) -> AsyncIterator[Tuple[str, object]]:
+        received = 0
+        async for chunk in self._request.stream():
+            received += len(chunk)
+            if received > self._max_bytes:
+                raise FileTooLargeError(f"Request body exceeds {self._max_bytes} bytes")
+            self._parser.write(chunk)
+            while self._events:
+                yield self._events.popleft()
+        self._parser.finalize()
+        while self._events:
+            yield self._events.popleft()
+
+    async def _next_event(self) -> Optional[Tuple[str, object]]:
+        try:
+            return await self._reader.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def open_file(self, name: str) -> Optional[str]:
+        """Read up to the headers of the file part `name` and return its filename, or None if there is none
+
+        Fields sent before the file are already in `fields` when this returns.
+        """
+        self._file_field = name
+        while True:
+            event = await self._next_event()
+            if event is None:
+                return None
+            if event[0] == "file":
+                return event[1]
+
+    async def file_chunks(self) -> AsyncIterator[bytes]:
+        """Yield the content of the file opened by open_file() as it is received"""
+        while True:
+            event = await self._next_event()
+            if event is None:
+                raise ValueError("Request body ended before the uploaded file was complete")
+            if event[0] == "end":
+                return
+            if event[1]:
+                yield event[1]
+
+    async def finish(self) -> Dict[str, str]:
+        """Read the rest of the body and return every text field"""
+        while await self._next_event() is not None:
+            pass
+        return self.fields
@@ -0,0 +1,157 @@
+"""
+Synthetic PDF corpus with labelled queries for the benchmarks
+"""
+import json
+import os
+import random
+from typing import List, Dict, Any, Tuple
+
+
+FILLER_WORDS = (
+    "system process report quarterly review budget policy customer service network "
+    "storage security update release schedule training manual operation maintenance "
+    "inventory supplier contract audit compliance metric target region office project "
+    "team capacity forecast request approval document version deployment incident"
+).split()
+
+SUBJECTS = (
+    "turbine pump valve compressor generator conveyor boiler chiller router switch "
+    "firewall gateway scanner printer forklift elevator crane drone sensor battery"
+).split()
+
+ATTRIBUTES = [
+    ("maintenance code", "What is the maintenance code for the {subject} {name}?"),
+    ("warranty period", "How long is the warranty period of the {subject} {name}?"),
+    ("responsible engineer", "Who is the responsible engineer for the {subject} {name}?"),
+    ("installation site", "Where is the {subject} {name} installed?"),
+]
+
+LINES_PER_PAGE = 45
+CHARS_PER_LINE = 90
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Write a minimal PDF (Helvetica, one text stream per page)"""
+    objects: List[bytes] = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for page_id, lines in zip(page_ids, pages):
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL\n"
+        stream += "".join(f"({_escape(line)}) '\n" for line in lines)
+        stream += "ET"
+        content = stream.encode("latin-1", errors="replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref_offset
+    )
+
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def _filler_sentence(rng: random.Random) -> str:
+    words = rng.sample(FILLER_WORDS, rng.randint(8, 14))
+    return " ".join(words).capitalize() + "."
+
+
+def _fact(rng: random.Random, subject: str, name: str) -> Tuple[str, str, str]:
+    attribute, question = rng.choice(ATTRIBUTES)
+    value = f"{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}{rng.randint(100, 999)}-{rng.randint(10, 99)}"
+    sentence = f"The {attribute} of the {subject} {name} is {value}."
+    return sentence, question.format(subject=subject, name=name), value
+
+
+def _wrap(paragraphs: List[str]) -> List[str]:
+    lines = []
+    for paragraph in paragraphs:
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) + 1 > CHARS_PER_LINE:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        if line:
+            lines.append(line)
+        lines.append("")
+    return lines
+
+
+def generate_corpus(
+    directory: str,
+    num_docs: int,
+    pages_per_doc: int,
+    facts_per_doc: int = 4,
+    seed: int = 42
+) -> Dict[str, Any]:
+    """Write num_docs PDFs plus queries.json; returns the manifest"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    documents = []
+    queries = []
+    for doc_index in range(num_docs):
+        filename = f"doc_{doc_index:04d}.pdf"
+        fact_pages = {rng.randint(1, pages_per_doc) for _ in range(facts_per_doc)}
+
+        pages = []
+        for page_num in range(1, pages_per_doc + 1):
+            paragraphs = []
+            # Leave room on the page for an inserted fact paragraph
+            while len(_wrap(paragraphs)) < LINES_PER_PAGE - 12:
+                paragraphs.append(" ".join(_filler_sentence(rng) for _ in range(rng.randint(3, 6))))
+            if page_num in fact_pages:
+                subject = rng.choice(SUBJECTS)
+                name = f"{subject[:2].upper()}-{doc_index:04d}-{page_num:03d}"
+                sentence, question, value = _fact(rng, subject, name)
+                position = rng.randint(0, len(paragraphs))
+                paragraphs.insert(position, f"{_filler_sentence(rng)} {sentence} {_filler_sentence(rng)}")
+                queries.append({
+                    "query": question,
+                    "filename": filename,
+                    "page": page_num,
+                    "answer": value
+                })
+            pages.append(_wrap(paragraphs))
+
+        write_pdf(os.path.join(directory, filename), pages)
+        documents.append({"filename": filename, "pages": pages_per_doc})
+
+    manifest = {"documents": documents, "queries": queries, "seed": seed}
+    with open(os.path.join(directory, "queries.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_corpus(directory: str) -> Dict[str, Any]:
+    """Load a corpus directory; queries.json is optional for unlabelled corpora"""
+    manifest_path = os.path.join(directory, "queries.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    documents = sorted(name for name in os.listdir(directory) if name.lower().endswith(".pdf"))
+    return {"documents": [{"filename": name} for name in documents], "queries": []}
@@ -0,0 +1,162 @@
+"""
+Local fake of the Feishu open API, for offline benchmarks
+
+Kept free of application imports so it can start before settings are loaded.
+"""
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional
+
+
+class FakeFeishuServer:
+    """Local HTTP server implementing the Feishu endpoints the bot calls
+
+    rate_limit (message calls per second, fixed one-second windows) answers
+    excess calls like Feishu's gateway: HTTP 429, code 99991400 and an
+    x-ogw-ratelimit-reset header. error_rate fails that fraction of message
+    calls with HTTP 500.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        rate_limit: Optional[int] = None,
+        error_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.replies = 0
+        self.sent = 0
+        self.patches = 0
+        self.token_requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._window = 0
+        self._window_calls = 0
+        self._lock = threading.Lock()
+        self._reply_times: List[float] = []
+        # Bodies of the message calls served, in the order they arrived
+        self.delivered: List[Dict[str, Any]] = []
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/open-apis"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.replies = self.sent = self.patches = 0
+            self.throttled = self.errors = 0
+            self._reply_times = []
+            self.delivered = []
+
+    async def wait_for_replies(self, count: int, timeout: float) -> bool:
+        """Wait until at least count replies have been received"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.replies >= count:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    def _record(self, kind: str, body: bytes = b""):
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+            if kind != "token_requests":
+                self.delivered.append(json.loads(body) if body else {})
+            if kind == "replies":
+                self._reply_times.append(time.monotonic())
+
+    def _admit(self) -> Optional[Dict[str, Any]]:
+        """None to serve a message call, else the failure to answer it with"""
+        with self._lock:
+            if self.rate_limit:
+                now = time.time()
+                window = math.floor(now)
+                if window != self._window:
+                    self._window, self._window_calls = window, 0
+                self._window_calls += 1
+                if self._window_calls > self.rate_limit:
+                    self.throttled += 1
+                    return {
+                        "status": 429,
+                        "headers": {
+                            "x-ogw-ratelimit-limit": str(self.rate_limit),
+                            "x-ogw-ratelimit-reset": f"{window + 1 - now:.3f}"
+                        },
+                        "body": {"code": 99991400, "msg": "request trigger frequency limit"}
+                    }
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return {"status": 500, "headers": {}, "body": {"code": 1, "msg": "internal error"}}
+        return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, body: Dict[str, Any], status: int = 200, headers: Optional[Dict[str, str]] = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return self.rfile.read(length) if length else b""
+
+            def do_POST(self):
+                body = self._read_body()
+                if self.path.endswith("/auth/v3/tenant_access_token/internal"):
+                    server._record("token_requests")
+                    self._respond({"code": 0, "tenant_access_token": "t-benchmark", "expire": 7200})
+                elif self._fail():
+                    pass
+                elif self.path.endswith("/reply"):
+                    server._record("replies", body)
+                    self._respond({"code": 0, "data": {"message_id": f"om_{time.monotonic_ns()}"}})
+                else:
+                    server._record("sent", body)
+                    self._respond({"code": 0, "data": {"message_id": f"om_{time.monotonic_ns()}"}})
+
+            def do_PATCH(self):
+                body = self._read_body()
+                if self._fail():
+                    return
+                server._record("patches", body)
+                self._respond({"code": 0})
+
+            def _fail(self) -> bool:
+                failure = server._admit()
+                if failure is None:
+                    return False
+                self._respond(failure["body"], failure["status"], failure["headers"])
+                return True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
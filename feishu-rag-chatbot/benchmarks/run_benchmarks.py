@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for Feishu RAG Chatbot
+
+Runs against a synthetic (or supplied) PDF corpus with a deterministic stub
+LLM and a local fake Feishu server, and writes the results as JSON:
+
+    python -m benchmarks.run_benchmarks --docs 40 --pages 10 --sizes 10,20,40
+    python -m benchmarks.run_benchmarks --baseline benchmarks/results/previous.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import generate_corpus, load_corpus
+
+
+RECALL_KS = (1, 3, 5, 10)
+
+# Ingestion stages read from the stage_duration histogram
+INGEST_STAGES = ("extract", "embed", "index")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Feishu RAG Chatbot offline benchmarks")
+    parser.add_argument("--corpus-dir", help="Use PDFs (and optional queries.json) from this directory")
+    parser.add_argument("--docs", type=int, default=40, help="Synthetic documents to generate")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per synthetic document")
+    parser.add_argument("--sizes", default="10,20,40", help="Corpus sizes (documents) to measure search at")
+    parser.add_argument("--search-queries", type=int, default=200, help="Queries per search latency run")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per API throughput run")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="Simulated LLM latency")
+    parser.add_argument("--feishu-rate-limit", type=int, help="Fake Feishu message calls allowed per second (429 beyond)")
+    parser.add_argument("--feishu-error-rate", type=float, default=0.0, help="Fraction of fake Feishu message calls failing with 500")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="Previous result file to compare against")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the temporary storage directory")
+    return parser.parse_args()
+
+
+def configure_environment(workdir: str, feishu_api_base: str):
+    """Point every store at a scratch directory and the Feishu client at the fake server"""
+    storage = os.path.join(workdir, "storage")
+    os.environ.update({
+        "CHROMA_PERSIST_DIRECTORY": os.path.join(storage, "vectordb"),
+        "PDF_STORAGE_PATH": os.path.join(storage, "pdfs"),
+        "CATALOG_PATH": os.path.join(storage, "catalog.db"),
+        "LEXICAL_INDEX_PATH": os.path.join(storage, "lexical.db"),
+        "SESSION_STORAGE_PATH": os.path.join(storage, "sessions"),
+        "INGESTION_JOBS_PATH": os.path.join(storage, "jobs"),
+        "COMPACT_STORE_PATH": os.path.join(storage, "compact"),
+        "BULK_STATE_PATH": os.path.join(storage, "bulk.db"),
+        "BULK_IMPORT_ROOT": os.path.join(storage, "import"),
+        "SHARED_STATE_PATH": os.path.join(storage, "shared_state.db"),
+        "FEISHU_API_BASE": feishu_api_base,
+    })
+    for name, value in {
+        "FEISHU_APP_ID": "benchmark",
+        "FEISHU_APP_SECRET": "benchmark",
+        "FEISHU_VERIFICATION_TOKEN": "benchmark",
+        "OPENAI_API_KEY": "sk-benchmark",
+        # Measure end-to-end answers, not the answer cache
+        "ANSWER_CACHE_ENABLED": "false",
+        # One reply per event, so webhook throughput can be measured from replies
+        "FEISHU_STREAMING_ENABLED": "false",
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds"""
+    import numpy as np
+    if not samples:
+        return {}
+    values = np.array(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3)
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+class BenchmarkRunner:
+    def __init__(self, args: argparse.Namespace, workdir: str, fake_feishu):
+        from config.settings import settings
+        from services.rag_service import rag_service
+        from services.session_service import session_store
+        from benchmarks.stubs import StubLLMService
+
+        self.args = args
+        self.workdir = workdir
+        self.settings = settings
+        self.fake_feishu = fake_feishu
+        self.rag = rag_service
+
+        # Swap the LLM for the deterministic stub everywhere it is used
+        self.stub_llm = StubLLMService(latency_ms=args.llm_latency_ms)
+        rag_service.llm = self.stub_llm
+        rag_service.async_llm = self.stub_llm
+        session_store.llm = self.stub_llm
+
+        self.file_ids: Dict[str, str] = {}
+        self.ingestion = {"documents": 0, "pages": 0, "chunks": 0, "total_seconds": 0.0,
+                          "extract_seconds": 0.0, "embed_seconds": 0.0, "index_seconds": 0.0}
+
+    def ingest(self, corpus_dir: str, filename: str):
+        """Ingest one PDF through RAGService.ingest_pdf, as the upload workers do
+        
+        Extraction, embedding and indexing overlap there, so stage times are
+        read from the per-stage latency histogram rather than the wall clock.
+        """
+        from services import metrics
+        with open(os.path.join(corpus_dir, filename), "rb") as f:
+            file_id = self.rag.pdf.save_pdf(f.read(), filename)
+
+        before = {stage: metrics.stage_duration.total(stage=f"ingest_{stage}")[0] for stage in INGEST_STAGES}
+        start = time.perf_counter()
+        _, result = self.rag.ingest_pdf(file_id, filename)
+        self.ingestion["total_seconds"] += time.perf_counter() - start
+        for stage in INGEST_STAGES:
+            spent = metrics.stage_duration.total(stage=f"ingest_{stage}")[0] - before[stage]
+            self.ingestion[f"{stage}_seconds"] += spent
+
+        self.file_ids[filename] = file_id
+        self.ingestion["documents"] += 1
+        self.ingestion["pages"] += result["pages"]
+        self.ingestion["chunks"] += result["chunks"]
+
+    def ingestion_summary(self) -> Dict[str, Any]:
+        stats = dict(self.ingestion)
+        stats["pages_per_sec"] = stats["pages"] / stats["total_seconds"] if stats["total_seconds"] else 0.0
+        stats["extract_pages_per_sec"] = stats["pages"] / stats["extract_seconds"] if stats["extract_seconds"] else 0.0
+        stats["embed_chunks_per_sec"] = stats["chunks"] / stats["embed_seconds"] if stats["embed_seconds"] else 0.0
+        stats["index_chunks_per_sec"] = stats["chunks"] / stats["index_seconds"] if stats["index_seconds"] else 0.0
+        return stats
+
+    def search_latency(self, queries: List[str]) -> Dict[str, Any]:
+        """VectorDBService.search latency per mode, with query embeddings precomputed"""
+        vector_db = self.rag.vector_db
+        embeddings = [vector_db.embed_query(query) for query in queries]
+        result = {"documents": len(self.file_ids), "chunks": vector_db.collection.count()}
+        for mode in ("vector", "hybrid"):
+            samples = []
+            for query, embedding in zip(queries, embeddings):
+                start = time.perf_counter()
+                vector_db.search(query, self.args.top_k, None, embedding, mode=mode)
+                samples.append(time.perf_counter() - start)
+            result[mode] = percentiles(samples)
+        return result
+
+    def recall(self, labelled: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """recall@k: the chunk holding the labelled page is among the top k"""
+        labelled = [q for q in labelled if q["filename"] in self.file_ids]
+        if not labelled:
+            return {}
+
+        vector_db = self.rag.vector_db
+        retrievers = {
+            "vector": lambda q, k, e: vector_db.search(q, k, None, e, mode="vector"),
+            "hybrid": lambda q, k, e: vector_db.search(q, k, None, e, mode="hybrid"),
+        }
+        if self.rag.reranker.enabled:
+            retrievers["rerank"] = lambda q, k, e: self.rag.retrieve(q, k, None, e)
+
+        max_k = max(RECALL_KS)
+        results = {"queries": len(labelled)}
+        for name, retrieve in retrievers.items():
+            hits = {k: 0 for k in RECALL_KS}
+            for item in labelled:
+                embedding = vector_db.embed_query(item["query"])
+                ranked = retrieve(item["query"], max_k, embedding)
+                rank = self._first_hit(ranked, self.file_ids[item["filename"]], item["page"])
+                for k in RECALL_KS:
+                    if rank is not None and rank < k:
+                        hits[k] += 1
+            results[name] = {f"recall@{k}": round(hits[k] / len(labelled), 4) for k in RECALL_KS}
+        return results
+
+    @staticmethod
+    def _first_hit(results: List[Dict[str, Any]], file_id: str, page: int) -> Optional[int]:
+        for rank, result in enumerate(results):
+            metadata = result.get("metadata", {})
+            first = metadata.get("page")
+            last = metadata.get("page_end", first)
+            if metadata.get("file_id") == file_id and first is not None and first <= page <= last:
+                return rank
+        return None
+
+    async def api_throughput(self, queries: List[str]) -> Dict[str, Any]:
+        """Concurrent /api/chat and /webhook/feishu load through the ASGI app"""
+        import httpx
+        from app.main import app, lifespan
+
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+                # Keep the background warm-up out of the measured window
+                while (await client.get("/health/ready")).status_code != 200:
+                    await asyncio.sleep(0.1)
+                chat = await self._chat_load(client, queries)
+                webhook = await self._webhook_load(client, queries)
+        return {"chat": chat, "webhook": webhook}
+
+    async def _chat_load(self, client, queries: List[str]) -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        samples = []
+        errors = 0
+
+        async def one(i: int):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/api/chat", json={
+                    "message": queries[i % len(queries)],
+                    "user_id": f"bench-{i % self.args.concurrency}"
+                })
+                samples.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(self.args.requests)))
+        elapsed = time.perf_counter() - start
+        return {
+            "requests": self.args.requests,
+            "concurrency": self.args.concurrency,
+            "errors": errors,
+            "requests_per_sec": round(self.args.requests / elapsed, 3),
+            "latency": percentiles(samples)
+        }
+
+    async def _webhook_load(self, client, queries: List[str]) -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        ack_samples = []
+        statuses: Dict[int, int] = {}
+        run_id = random.getrandbits(32)
+        self.fake_feishu.reset()
+
+        async def one(i: int):
+            event = {
+                "schema": "2.0",
+                "header": {"event_id": f"ev_{run_id}_{i}", "event_type": "im.message.receive_v1"},
+                "event": {
+                    "sender": {"sender_id": {"open_id": f"ou_bench_{i % self.args.concurrency}"}},
+                    "message": {
+                        "message_id": f"om_{run_id}_{i}",
+                        "chat_id": "oc_benchmark",
+                        "message_type": "text",
+                        "content": json.dumps({"text": queries[i % len(queries)]})
+                    }
+                }
+            }
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/webhook/feishu", json=event)
+                ack_samples.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(self.args.requests)))
+        accepted = statuses.get(200, 0)
+        completed = await self.fake_feishu.wait_for_replies(accepted, timeout=300)
+        elapsed = time.perf_counter() - start
+        return {
+            "events": self.args.requests,
+            "accepted": accepted,
+            "rejected_busy": statuses.get(503, 0),
+            "replies": self.fake_feishu.replies,
+            "completed": completed,
+            "events_per_sec": round(self.fake_feishu.replies / elapsed, 3),
+            "ack_latency": percentiles(ack_samples),
+            "feishu_throttled": self.fake_feishu.throttled,
+            "feishu_errors": self.fake_feishu.errors,
+            "outbound": self._outbound_stats()
+        }
+
+    @staticmethod
+    def _outbound_stats() -> Dict[str, Any]:
+        from services.feishu_service import async_feishu_service
+        stats = async_feishu_service.dispatcher.stats()
+        return {key: stats[key] for key in ("sent", "failed", "retries", "rejected")}
+
+
+def flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    values = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            values.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            values.update(flatten(value, f"{prefix}{i}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        values[prefix.rstrip(".")] = data
+    return values
+
+
+def compare(results: Dict[str, Any], baseline_path: str):
+    """Print relative change of every numeric metric against a previous run"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = flatten(json.load(f))
+    current = flatten(results)
+    print(f"\n📊 Compared with {baseline_path}:")
+    for key in sorted(current):
+        if key.startswith("meta.") or key not in baseline or not baseline[key]:
+            continue
+        change = (current[key] - baseline[key]) / abs(baseline[key]) * 100
+        if abs(change) >= 1:
+            print(f"  {key}: {baseline[key]:.4g} -> {current[key]:.4g} ({change:+.1f}%)")
+
+
+async def run(args: argparse.Namespace, workdir: str, fake_feishu) -> Dict[str, Any]:
+    if args.corpus_dir:
+        corpus_dir = args.corpus_dir
+        manifest = load_corpus(corpus_dir)
+    else:
+        corpus_dir = os.path.join(workdir, "corpus")
+        print(f"📄 Generating {args.docs} synthetic documents of {args.pages} pages...")
+        manifest = generate_corpus(corpus_dir, args.docs, args.pages)
+
+    runner = BenchmarkRunner(args, workdir, fake_feishu)
+    filenames = [doc["filename"] for doc in manifest["documents"]]
+    sizes = sorted({min(int(size), len(filenames)) for size in args.sizes.split(",") if size.strip()})
+    if not sizes or sizes[-1] < len(filenames):
+        sizes.append(len(filenames))
+
+    labelled = manifest.get("queries", [])
+    query_texts = [q["query"] for q in labelled] or [
+        f"What does {name} say about the schedule?" for name in filenames
+    ]
+    rng = random.Random(7)
+    search_queries = [rng.choice(query_texts) for _ in range(args.search_queries)]
+
+    search = []
+    for size in sizes:
+        print(f"⚙️  Ingesting up to {size} documents...")
+        for filename in filenames[len(runner.file_ids):size]:
+            runner.ingest(corpus_dir, filename)
+        print(f"🔎 Measuring search latency at {size} documents...")
+        search.append(runner.search_latency(search_queries))
+
+    print("🎯 Measuring recall...")
+    recall = runner.recall(labelled)
+
+    print(f"🌐 Measuring API throughput ({args.requests} requests, concurrency {args.concurrency})...")
+    api = await runner.api_throughput(query_texts)
+
+    settings = runner.settings
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embedding_model": settings.embedding_model,
+            "chunker": settings.chunker,
+            "search_mode": settings.search_mode,
+            "rerank_enabled": settings.rerank_enabled,
+            "llm_latency_ms": args.llm_latency_ms,
+            "top_k": args.top_k
+        },
+        "corpus": {"documents": len(filenames), "labelled_queries": len(labelled)},
+        "ingestion": runner.ingestion_summary(),
+        "search": search,
+        "recall": recall,
+        "api": api
+    }
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="rag-benchmark-")
+
+    from benchmarks.fake_feishu import FakeFeishuServer
+    fake_feishu = FakeFeishuServer(rate_limit=args.feishu_rate_limit, error_rate=args.feishu_error_rate)
+    fake_feishu.start()
+    configure_environment(workdir, fake_feishu.base_url)
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    try:
+        results = asyncio.run(run(args, workdir, fake_feishu))
+    finally:
+        fake_feishu.stop()
+        if not args.keep_workdir:
+            import shutil
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", time.strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
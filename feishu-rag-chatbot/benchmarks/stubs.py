@@ -0,0 +1,49 @@
+"""
+Deterministic stand-in for the OpenAI-backed LLM service used by the benchmarks
+"""
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator
+from services.llm_service import AsyncLLMService
+
+
+class StubLLMService(AsyncLLMService):
+    """Deterministic LLM: real prompt packing, canned answers after a fixed delay"""
+
+    def __init__(self, latency_ms: float = 0.0, tokens: int = 20):
+        super().__init__()
+        self.latency = latency_ms / 1000
+        self.tokens = tokens
+        self.calls = 0
+
+    def _answer(self, prompt: Dict[str, Any]) -> List[str]:
+        sources = ", ".join(
+            item.get("metadata", {}).get("chunk_id", "?") for item in prompt["context"][:3]
+        )
+        words = [f"Answer based on {sources}."] + ["lorem"] * (self.tokens - 1)
+        return [word + " " for word in words]
+
+    async def generate(self, prompt: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        usage = dict(prompt["usage"], completion_tokens=self.tokens)
+        return {"response": "".join(self._answer(prompt)).strip(), "usage": usage}
+
+    async def stream_response(
+        self,
+        query: str,
+        context: List[Dict[str, Any]],
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        prompt: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        self.calls += 1
+        prompt = prompt or self.prepare_prompt(query, context, chat_history)
+        words = self._answer(prompt)
+        for word in words:
+            await asyncio.sleep(self.latency / len(words))
+            yield word
+
+    async def summarize_conversation(self, previous_summary: str, messages: List[Dict[str, str]]) -> str:
+        return (previous_summary + " " + " ".join(m["content"][:40] for m in messages)).strip()[:500]
+
+    def summarize_document(self, chunks: List[str], filename: str) -> str:
+        return f"Synthetic document {filename}"
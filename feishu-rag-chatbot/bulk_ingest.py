@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Ingest a directory tree or zip archive of PDFs in one resumable batch
+
+    python bulk_ingest.py <directory-or-zip> [--summaries inline|deferred|skip] [--workers N]
+    python bulk_ingest.py --resume BATCH_ID
+    python bulk_ingest.py --summarize-missing
+
+Stop the server first (or run this on the ingestion writer's host while it is
+down): the script takes the same writer lock and refuses to start while the
+lock is held. An interrupted run continues with --resume, skipping every file
+already indexed.
+"""
+import argparse
+import sys
+import time
+
+from config.settings import settings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", nargs="?", help="Directory (searched recursively) or zip archive of PDFs")
+    parser.add_argument("--summaries", choices=["inline", "deferred", "skip"], default=settings.bulk_summaries)
+    parser.add_argument("--workers", type=int, default=settings.bulk_extract_workers, help="Documents extracted concurrently")
+    parser.add_argument("--batch-size", type=int, default=settings.bulk_write_batch_size, help="Chunks per embedding/write batch")
+    parser.add_argument("--resume", metavar="BATCH_ID", help="Continue an interrupted batch")
+    parser.add_argument("--summarize-missing", action="store_true", help="Summarize every cataloged document without a summary")
+    args = parser.parse_args()
+    if not (args.source or args.resume or args.summarize_missing):
+        parser.error("give a directory or zip archive, --resume or --summarize-missing")
+    return args
+
+
+def main():
+    args = parse_args()
+    settings.bulk_extract_workers = args.workers
+    settings.bulk_write_batch_size = args.batch_size
+
+    # Imported after the overrides; loads the stores and models
+    from services.bulk_ingestion import bulk_ingestion_service
+    from services.shared_state import worker_role
+
+    if not worker_role.claim():
+        print("❌ Another process (the server or another bulk run) holds the ingestion writer lock")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    try:
+        if args.summarize_missing and not (args.source or args.resume):
+            count = bulk_ingestion_service.summarize_missing()
+            print(f"✓ Summarized {count} documents in {time.perf_counter() - start:.1f}s")
+            return
+
+        if args.resume:
+            batch_id = args.resume
+            if bulk_ingestion_service.status(batch_id) is None:
+                print(f"❌ Batch {batch_id} not found")
+                sys.exit(1)
+        else:
+            try:
+                if args.source.lower().endswith(".zip"):
+                    batch = bulk_ingestion_service.create_from_zip(args.source, args.summaries)
+                else:
+                    batch = bulk_ingestion_service.create_from_directory(args.source, args.summaries)
+            except ValueError as e:
+                print(f"❌ {e}")
+                sys.exit(1)
+            batch_id = batch["batch_id"]
+            print(f"Batch {batch_id}: {batch['total']} PDFs (resume with --resume {batch_id})")
+
+        try:
+            batch = bulk_ingestion_service.run(batch_id)
+        except KeyboardInterrupt:
+            print(f"\nInterrupted; resume with --resume {batch_id}")
+            sys.exit(130)
+        if args.summarize_missing:
+            bulk_ingestion_service.summarize_missing()
+
+        files = batch["files"]
+        elapsed = time.perf_counter() - start
+        print(
+            f"✓ {batch['status']} in {elapsed:.1f}s: {files['done']} indexed, "
+            f"{files['skipped']} already indexed, {files['failed']} failed"
+        )
+        for failure in batch["failures"]:
+            print(f"  ✗ {failure['filename']}: {failure['error']}")
+    finally:
+        worker_role.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,32 @@ class Settings(BaseSettings):
     feishu_app_secret: str
     feishu_verification_token: str
     feishu_encrypt_key: Optional[str] = None
+    feishu_api_base: str = "https://open.feishu.cn/open-apis"
+    feishu_task_workers: int = 100
+    feishu_max_connections: int = 100
+    feishu_timeout_seconds: float = 10.0
+    feishu_task_queue_size: int = 200
+    feishu_event_dedup_ttl_seconds: int = 600
+    feishu_streaming_enabled: bool = False
+    feishu_stream_update_interval: float = 0.8
+    feishu_rate_limit_per_second: float = 50.0  # app-wide message API quota (0 disables)
+    feishu_rate_limit_burst: int = 50
+    feishu_outbound_workers: int = 20  # concurrent outbound calls
+    feishu_outbound_queue_size: int = 1000
+    feishu_enqueue_timeout_seconds: float = 5.0  # callers then get OutboundQueueFull
+    feishu_max_retries: int = 3
+    feishu_retry_base_seconds: float = 0.5
+    feishu_retry_max_seconds: float = 10.0
     
     # OpenAI Configuration
     openai_api_key: str
     openai_model: str = "gpt-3.5-turbo"
+    openai_max_connections: int = 200
+    openai_timeout_seconds: float = 60.0
+    llm_context_token_budget: int = 3000
+    llm_history_token_budget: int = 1000
+    llm_max_completion_tokens: int = 1000
+    context_dedup_threshold: float = 0.8
     
     # Server Configuration
     server_host: str = "0.0.0.0"
@@ -22,10 +44,89 @@ class Settings(BaseSettings):
     # Vector Database Configuration
     chroma_persist_directory: str = "./storage/vectordb"
     embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_batch_size: int = 64
+    embedding_workers: int = 0  # >1 spreads ingestion encoding over a process pool
+    chroma_write_batch_size: int = 500
+    query_embedding_cache_size: int = 10000
+    embedding_batch_window_ms: float = 5.0
+    embedding_max_batch_size: int = 32
+    embedding_executor_workers: int = 1
+    vector_store: str = "chroma"  # "chroma" (HNSW) or "compact" (memory-mapped int8/float16, exact search)
+    compact_store_path: str = "./storage/compact"
+    compact_store_dtype: str = "int8"  # "int8" or "float16"
+    compact_store_rescore: bool = False  # float32 copies on disk (as large as the Chroma vectors) to rescore the shortlist
+    compact_store_rescore_candidates: int = 100
+    
+    # Retrieval Configuration
+    search_mode: str = "vector"  # "vector" or "hybrid" (BM25 + vector, fused by RRF)
+    lexical_index_path: str = "./storage/lexical.db"
+    hybrid_candidates: int = 20
+    rrf_k: int = 60
+    filter_exact_max_chunks: int = 2000  # file_ids scopes up to this size are scanned exactly
+    filter_overfetch_factor: float = 1.5  # ANN candidates = top_k / selectivity * factor
+    filter_max_candidates: int = 1000  # ANN budget before falling back to Chroma's where filter
+    filter_scope_cache_size: int = 64  # per-file embedding matrices kept for exact scans
+    rerank_enabled: bool = False
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_candidates: int = 20
+    rerank_batch_size: int = 16
+    rerank_cache_size: int = 10000
+    rerank_latency_budget_ms: float = 300.0
+    
+    # Answer Cache Configuration
+    answer_cache_enabled: bool = True
+    answer_cache_max_entries: int = 1000
+    answer_cache_ttl_seconds: int = 3600
+    answer_cache_semantic_threshold: float = 0.95  # 0 disables semantic lookup
+    
+    # Request Coalescing Configuration
+    coalesce_enabled: bool = True  # identical in-flight questions share one execution
+    coalesce_timeout_seconds: float = 60.0  # a waiting request then runs on its own
+    
+    # Session Configuration
+    session_max_sessions: int = 10000
+    session_idle_ttl_seconds: int = 86400
+    session_max_recent_messages: int = 10  # older turns are folded into a summary
+    session_summary_max_tokens: int = 300
+    session_persist: bool = True
+    session_storage_path: str = "./storage/sessions"
     
     # Storage Configuration
     pdf_storage_path: str = "./storage/pdfs"
+    catalog_path: str = "./storage/catalog.db"
     max_file_size_mb: int = 50
+    upload_chunk_size_kb: int = 1024
+    pdf_extract_workers: int = 4
+    pdf_pages_per_task: int = 16
+    
+    # Chunking Configuration
+    chunker: str = "sentence"  # "sentence" or "fixed"
+    chunk_max_tokens: int = 256
+    chunk_overlap_tokens: int = 32
+    chunk_size_chars: int = 1000  # used by the fixed chunker
+    
+    # Ingestion Configuration
+    ingestion_jobs_path: str = "./storage/jobs"
+    ingestion_workers: int = 2
+    ingestion_job_retention_seconds: int = 86400  # finished jobs are deleted after this; 0 keeps them
+    ingest_stream_batch_size: int = 256  # chunks embedded/indexed per streamed slice
+    
+    # Bulk Ingestion Configuration
+    bulk_state_path: str = "./storage/bulk.db"
+    bulk_import_root: str = "./storage/import"  # directories /api/bulk_ingest may read
+    bulk_extract_workers: int = 4  # documents extracted concurrently
+    bulk_write_batch_size: int = 512  # chunks per embedding/write batch, across documents
+    bulk_queue_batches: int = 16  # extracted batches buffered ahead of the writer
+    bulk_summaries: str = "deferred"  # "inline", "deferred" (after indexing) or "skip"
+    bulk_summary_workers: int = 4
+    bulk_max_archive_mb: int = 4096
+    
+    # Multi-worker Configuration
+    multi_worker: bool = False  # set by gunicorn.conf.py; shares state between worker processes
+    web_concurrency: int = 4  # gunicorn worker processes; per-process shares of app-wide quotas use it
+    shared_state_path: str = "./storage/shared_state.db"
+    ingestion_role: str = "auto"  # "auto" elects one writer process; "writer" or "reader" pins it
+    shared_state_poll_seconds: float = 1.0
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,38 @@
+"""
+Multi-worker deployment: gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported once in the master (preload_app) and the embedding model
+loaded there, so forked workers share its weights copy-on-write. Nothing that
+holds file handles or threads (Chroma, SQLite connections, HTTP clients) is
+opened before the fork; each worker opens its own in the lifespan hook.
+"""
+import gc
+import os
+
+# Read by config.settings when the app is preloaded below
+os.environ.setdefault("MULTI_WORKER", "true")
+os.environ.setdefault("WEB_CONCURRENCY", "4")
+
+bind = f"{os.environ.get('SERVER_HOST', '0.0.0.0')}:{os.environ.get('SERVER_PORT', '8000')}"
+workers = int(os.environ["WEB_CONCURRENCY"])
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Workers still open Chroma and the tokenizer in their own warm-up after the fork
+timeout = 120
+
+
+def when_ready(server):
+    """Runs in the master after the app is imported and before workers fork"""
+    from services.embedding_service import embedding_service
+    embedding_service.load()
+    # Keep the loaded objects out of later collections so the GC does not
+    # touch (and un-share) their pages in the workers
+    gc.freeze()
+    server.log.info("Embedding model loaded in the master; forking workers")
+
+
+def post_fork(server, worker):
+    # Each worker runs its own torch thread pool; size it to the worker's share of the cores
+    threads = max(1, (os.cpu_count() or 1) // server.cfg.workers)
+    import torch
+    torch.set_num_threads(threads)
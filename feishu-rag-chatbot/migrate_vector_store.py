@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Copy the Chroma collection into the compact vector store
+
+    python migrate_vector_store.py [--dtype int8|float16] [--rescore]
+
+Then set VECTOR_STORE=compact. The Chroma directory is left untouched, so
+switching back only needs VECTOR_STORE=chroma.
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from config.settings import settings
+from services.compact_vector_store import CompactVectorStore
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="pdf_documents", help="Chroma collection to copy")
+    parser.add_argument("--output", default=settings.compact_store_path, help="Compact store directory")
+    parser.add_argument("--dtype", default=settings.compact_store_dtype, choices=["int8", "float16"])
+    parser.add_argument(
+        "--rescore", action=argparse.BooleanOptionalAction, default=settings.compact_store_rescore,
+        help="Keep float32 copies for rescoring (as large as the float32 vectors)"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000, help="Chunks read from Chroma per request")
+    parser.add_argument("--verify", type=int, default=20, help="Chunks whose nearest neighbour is checked afterwards")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    import chromadb
+    from chromadb.config import Settings as ChromaSettings
+
+    client = chromadb.PersistentClient(
+        path=settings.chroma_persist_directory,
+        settings=ChromaSettings(anonymized_telemetry=False)
+    )
+    collection = client.get_collection(name=args.collection)
+    total = collection.count()
+
+    store = CompactVectorStore(
+        args.output,
+        dtype=args.dtype,
+        rescore=args.rescore,
+        rescore_candidates=settings.compact_store_rescore_candidates
+    )
+    if store.count():
+        print(f"❌ {args.output} already holds {store.count()} chunks; remove it to migrate again")
+        sys.exit(1)
+
+    # Group chunk ids by file first so each file is written as one contiguous row range
+    ids_by_file = defaultdict(list)
+    for offset in range(0, total, args.batch_size):
+        page = collection.get(include=["metadatas"], limit=args.batch_size, offset=offset)
+        for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+            ids_by_file[metadata.get("file_id", "")].append(chunk_id)
+
+    start = time.perf_counter()
+    copied = 0
+    for file_id, chunk_ids in ids_by_file.items():
+        for i in range(0, len(chunk_ids), args.batch_size):
+            page = collection.get(
+                ids=chunk_ids[i:i + args.batch_size],
+                include=["embeddings", "documents", "metadatas"]
+            )
+            store.upsert(
+                ids=page["ids"],
+                embeddings=page["embeddings"],
+                metadatas=page["metadatas"],
+                documents=page["documents"]
+            )
+            copied += len(page["ids"])
+        print(f"  {copied}/{total} chunks", end="\r")
+    elapsed = time.perf_counter() - start
+    print(f"✓ Copied {copied} chunks from {len(ids_by_file)} files in {elapsed:.1f}s")
+
+    stats = store.stats()
+    float32_bytes = copied * (stats["dim"] or 0) * 4
+    print(f"✓ {args.dtype} vectors: {stats['vector_bytes'] / 2**20:.1f} MiB (float32: {float32_bytes / 2**20:.1f} MiB)")
+
+    # Each sampled chunk should find itself first
+    if args.verify and copied:
+        sample = collection.get(limit=args.verify, include=["embeddings"])
+        hits = 0
+        for chunk_id, embedding in zip(sample["ids"], sample["embeddings"]):
+            result = store.query(query_embeddings=[np.asarray(embedding).tolist()], n_results=1)
+            hits += bool(result["ids"][0]) and result["ids"][0][0] == chunk_id
+        print(f"✓ Self-retrieval check: {hits}/{len(sample['ids'])}")
+
+
+if __name__ == "__main__":
+    main()
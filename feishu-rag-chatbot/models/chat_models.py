@@ -25,6 +25,8 @@ class ChatRequest(BaseModel):
     user_id: str
     session_id: Optional[str] = None
     context: Optional[List[Dict[str, str]]] = None
+    file_ids: Optional[List[str]] = None  # limit retrieval to these documents
+    stream: bool = False
 
 
 class ChatResponse(BaseModel):
@@ -32,6 +34,7 @@ class ChatResponse(BaseModel):
     message: str
     sources: Optional[List[Dict[str, Any]]] = None
     session_id: str
+    usage: Optional[Dict[str, Any]] = None
 
 
 class PDFUploadResponse(BaseModel):
@@ -40,4 +43,42 @@ class PDFUploadResponse(BaseModel):
     filename: str
     pages: int
     chunks: int
-    message: str
\ No newline at end of file
+    message: str
+
+
+class IngestionJobResponse(BaseModel):
+    """Ingestion job submission response model"""
+    job_id: str
+    file_id: str
+    filename: str
+    status: str
+    message: str
+
+
+class JobStatusResponse(BaseModel):
+    """Ingestion job status model"""
+    job_id: str
+    kind: str = "ingest"
+    file_id: str
+    filename: str
+    replaces: Optional[str] = None
+    status: str
+    stages: Dict[str, Dict[str, Any]]
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+
+class BulkIngestResponse(BaseModel):
+    """Bulk ingestion batch status model"""
+    batch_id: str
+    source: str
+    summaries: str
+    status: str
+    total: int
+    files: Dict[str, int]  # file counts by status: pending, done, skipped, failed
+    failures: List[Dict[str, Any]] = []
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
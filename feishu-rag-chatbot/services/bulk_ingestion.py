@@ -0,0 +1,449 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+from loguru import logger
+from config.settings import settings
+from services.metrics import track
+from services.pdf_service import FileTooLargeError
+from services.rag_service import rag_service
+from services.shared_state import worker_role
+
+
+SUMMARY_MODES = ("inline", "deferred", "skip")
+
+# Leading chunks passed to summarize_document, as in single-file ingestion
+SUMMARY_CHUNKS = 5
+
+
+class BulkIngestionStopped(Exception):
+    """Raised inside a run when the service is shutting down; the batch resumes on next start"""
+
+
+class BulkIngestionService:
+    """Resumable multi-document ingestion
+
+    Documents are extracted in parallel (bounded by bulk_extract_workers) into
+    a bounded queue; a single writer embeds and indexes their chunks in
+    batches that span documents, and catalogs each document once all of its
+    chunks are written. Per-file progress lives in SQLite, so an interrupted
+    batch picks up where it stopped. Summaries run inline, after indexing
+    (deferred) or not at all.
+    """
+
+    def __init__(self):
+        self.db_path = settings.bulk_state_path
+        self.rag = rag_service
+        self.pdf = rag_service.pdf
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS batches (
+                    batch_id TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    summaries TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    batch_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    source TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    file_id TEXT,
+                    status TEXT NOT NULL,
+                    chunks INTEGER,
+                    error TEXT,
+                    PRIMARY KEY (batch_id, seq)
+                );
+                """
+            )
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._poller: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    # Creating batches
+
+    def create_from_directory(self, directory: str, summaries: Optional[str] = None) -> Dict[str, Any]:
+        """Queue every PDF under a directory (recursively)"""
+        if not os.path.isdir(directory):
+            raise ValueError(f"Not a directory: {directory}")
+        files = []
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for name in sorted(names):
+                if name.lower().endswith(".pdf"):
+                    path = os.path.join(root, name)
+                    files.append({"source": os.path.abspath(path), "filename": os.path.relpath(path, directory)})
+        return self._create(os.path.abspath(directory), summaries, files)
+
+    def create_from_zip(self, zip_path: str, summaries: Optional[str] = None) -> Dict[str, Any]:
+        """Copy every PDF in a zip archive into PDF storage and queue it
+
+        Members are stored under their content hash right away, so the
+        archive itself is not needed to resume the batch.
+        """
+        max_bytes = settings.max_file_size_mb * 1024 * 1024
+        files = []
+        try:
+            with zipfile.ZipFile(zip_path) as archive:
+                for member in archive.infolist():
+                    name = member.filename
+                    if member.is_dir() or not name.lower().endswith(".pdf") or name.startswith("__MACOSX/"):
+                        continue
+                    entry = {"source": f"zip:{name}", "filename": name}
+                    try:
+                        if member.file_size > max_bytes:
+                            raise FileTooLargeError(f"{name} exceeds {settings.max_file_size_mb}MB")
+                        entry["file_id"], _ = self.pdf.import_pdf(archive.open(member), name, max_bytes)
+                    except (FileTooLargeError, zipfile.BadZipFile, OSError) as e:
+                        entry["status"] = "failed"
+                        entry["error"] = str(e)
+                    files.append(entry)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"Not a valid zip archive: {e}")
+        return self._create(os.path.basename(zip_path), summaries, files)
+
+    def _create(self, source: str, summaries: Optional[str], files: List[Dict[str, Any]]) -> Dict[str, Any]:
+        summaries = summaries or settings.bulk_summaries
+        if summaries not in SUMMARY_MODES:
+            raise ValueError(f"summaries must be one of {', '.join(SUMMARY_MODES)}")
+        if not files:
+            raise ValueError(f"No PDF files found in {source}")
+
+        batch_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO batches (batch_id, source, summaries, status, total, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (batch_id, source, summaries, len(files), now, now)
+            )
+            conn.executemany(
+                "INSERT INTO files (batch_id, seq, source, filename, file_id, status, error) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (batch_id, seq, f["source"], f["filename"], f.get("file_id"), f.get("status", "pending"), f.get("error"))
+                    for seq, f in enumerate(files)
+                ]
+            )
+        logger.info(f"Created bulk ingestion batch {batch_id} with {len(files)} PDFs from {source}")
+        return self.status(batch_id)
+
+    # Status
+
+    def status(self, batch_id: str, max_errors: int = 20) -> Optional[Dict[str, Any]]:
+        """Batch state with per-status file counts and the first failures"""
+        with self._connect() as conn:
+            batch = conn.execute("SELECT * FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+            if batch is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM files WHERE batch_id = ? GROUP BY status", (batch_id,)
+            ).fetchall())
+            failures = conn.execute(
+                "SELECT filename, error FROM files WHERE batch_id = ? AND status = 'failed' ORDER BY seq LIMIT ?",
+                (batch_id, max_errors)
+            ).fetchall()
+        result = dict(batch)
+        result["files"] = {status: counts.get(status, 0) for status in ("pending", "done", "skipped", "failed")}
+        result["failures"] = [dict(row) for row in failures]
+        return result
+
+    def _set_batch(self, batch_id: str, status: str, error: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE batches SET status = ?, error = ?, updated_at = ? WHERE batch_id = ?",
+                (status, error, time.time(), batch_id)
+            )
+
+    def _set_file(self, batch_id: str, seq: int, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE files SET {assignments} WHERE batch_id = ? AND seq = ?",
+                (*fields.values(), batch_id, seq)
+            )
+
+    def _files(self, batch_id: str, statuses: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM files WHERE batch_id = ? AND status IN ({','.join('?' * len(statuses))}) ORDER BY seq",
+                (batch_id, *statuses)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def unfinished_batches(self) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT batch_id FROM batches WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    # Running
+
+    def run(self, batch_id: str) -> Dict[str, Any]:
+        """Ingest the batch's remaining files (pending, and failed ones again); blocking"""
+        with self._lock:
+            if batch_id in self._running:
+                raise RuntimeError(f"Bulk ingestion batch {batch_id} is already running")
+            self._running.add(batch_id)
+        try:
+            batch = self.status(batch_id)
+            if batch is None:
+                raise KeyError(f"Bulk ingestion batch {batch_id} not found")
+            self._set_batch(batch_id, "running")
+            start = time.perf_counter()
+            # Zip members rejected at creation were never stored, so there is nothing to retry
+            files = [
+                row for row in self._files(batch_id, ("pending", "failed"))
+                if row["file_id"] or not row["source"].startswith("zip:")
+            ]
+            self._ingest(batch_id, files, batch["summaries"])
+            # Inline summaries cut short by an earlier stop are filled in here too
+            if batch["summaries"] != "skip":
+                done = [row["file_id"] for row in self._files(batch_id, ("done",))]
+                self.summarize_missing(done)
+            self._set_batch(batch_id, "completed")
+            logger.info(f"Bulk ingestion batch {batch_id} finished in {time.perf_counter() - start:.1f}s")
+        except BulkIngestionStopped:
+            logger.info(f"Bulk ingestion batch {batch_id} interrupted; it resumes on next start")
+        except Exception as e:
+            logger.error(f"Bulk ingestion batch {batch_id} failed: {e}")
+            self._set_batch(batch_id, "failed", error=str(e))
+            raise
+        finally:
+            with self._lock:
+                self._running.discard(batch_id)
+        return self.status(batch_id)
+
+    def _ingest(self, batch_id: str, files: List[Dict[str, Any]], summaries: str):
+        if not files:
+            return
+        items: "queue.Queue[Tuple[str, Dict[str, Any], Optional[str], Any]]" = queue.Queue(
+            maxsize=max(1, settings.bulk_queue_batches)
+        )
+        max_bytes = settings.max_file_size_mb * 1024 * 1024
+        # Set when the writer loop exits early, so extractors stop waiting on the queue
+        abandoned = threading.Event()
+
+        def put(item):
+            # Blocks while the writer is behind; gives up when the service stops
+            while True:
+                if self._stopping.is_set() or abandoned.is_set():
+                    raise BulkIngestionStopped()
+                try:
+                    items.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def extract(row: Dict[str, Any]):
+            file_id = row["file_id"]
+            try:
+                if not file_id:
+                    file_id, _ = self.pdf.import_pdf(row["source"], row["filename"], max_bytes)
+                    self._set_file(batch_id, row["seq"], file_id=file_id)
+                if self.rag.catalog.get(file_id):
+                    put(("skipped", row, file_id, None))
+                    return
+                chunks = 0
+                texts = []
+                pending = []
+                for chunk in self.pdf.iter_chunks(file_id):
+                    chunk["filename"] = row["filename"]
+                    chunks += 1
+                    if len(texts) < SUMMARY_CHUNKS:
+                        texts.append(chunk["text"])
+                    pending.append(chunk)
+                    if len(pending) >= settings.ingest_stream_batch_size:
+                        put(("chunks", row, file_id, pending))
+                        pending = []
+                if pending:
+                    put(("chunks", row, file_id, pending))
+                put(("end", row, file_id, {"chunks": chunks, "texts": texts}))
+            except BulkIngestionStopped:
+                pass
+            except Exception as e:
+                try:
+                    put(("failed", row, file_id, str(e)))
+                except BulkIngestionStopped:
+                    pass
+
+        extractors = ThreadPoolExecutor(
+            max_workers=max(1, settings.bulk_extract_workers), thread_name_prefix="bulk-extract"
+        )
+        summarizers = ThreadPoolExecutor(
+            max_workers=max(1, settings.bulk_summary_workers), thread_name_prefix="bulk-summary"
+        ) if summaries == "inline" else None
+        summary_futures = []
+        pending: List[Dict[str, Any]] = []
+        ended: List[Tuple[Dict[str, Any], str, Dict[str, Any]]] = []
+
+        def flush():
+            nonlocal pending, ended
+            if pending:
+                self.rag.vector_db.add_documents(pending)
+                pending = []
+            # Every chunk of an ended document was queued before its end marker
+            self.rag.register_documents([(file_id, row["filename"], info["chunks"]) for row, file_id, info in ended])
+            for row, file_id, info in ended:
+                self._set_file(batch_id, row["seq"], status="done", chunks=info["chunks"], error=None)
+                if summarizers is not None and not self._stopping.is_set():
+                    summary_futures.append(
+                        summarizers.submit(self._summarize, file_id, row["filename"], info["texts"])
+                    )
+            ended = []
+
+        try:
+            for row in files:
+                extractors.submit(extract, row)
+
+            remaining = len(files)
+            while remaining:
+                if self._stopping.is_set():
+                    # Write what is buffered so ended documents are marked done; the rest resume as pending
+                    flush()
+                    raise BulkIngestionStopped()
+                try:
+                    kind, row, file_id, payload = items.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if kind == "chunks":
+                    pending.extend(payload)
+                    if len(pending) >= settings.bulk_write_batch_size:
+                        flush()
+                    continue
+
+                remaining -= 1
+                if kind == "end":
+                    ended.append((row, file_id, payload))
+                elif kind == "skipped":
+                    self._set_file(batch_id, row["seq"], status="skipped", error=None)
+                else:
+                    logger.error(f"Bulk ingestion of {row['filename']} failed: {payload}")
+                    pending = [chunk for chunk in pending if chunk["file_id"] != file_id]
+                    if file_id:
+                        # Drop chunks of this document already written by earlier flushes
+                        self.rag.vector_db.delete_by_file_id(file_id)
+                    self._set_file(batch_id, row["seq"], status="failed", error=payload)
+            flush()
+            # A stop drops the queued summaries; the resumed run writes the missing ones
+            while summary_futures and wait(summary_futures, timeout=0.5).not_done:
+                if self._stopping.is_set():
+                    raise BulkIngestionStopped()
+        finally:
+            abandoned.set()
+            extractors.shutdown(wait=False, cancel_futures=True)
+            if summarizers is not None:
+                summarizers.shutdown(wait=False, cancel_futures=True)
+
+    def _summarize(self, file_id: str, filename: str, texts: List[str]):
+        try:
+            with track("ingest_summarize"):
+                summary = self.rag.llm.summarize_document(texts, filename)
+            self.rag.catalog.set_summary(file_id, summary)
+        except Exception as e:
+            logger.error(f"Error summarizing {filename}: {e}")
+
+    def summarize_missing(self, file_ids: Optional[List[str]] = None) -> int:
+        """Generate summaries for cataloged documents that have none; returns how many were attempted"""
+        documents = self.rag.catalog.missing_summaries(file_ids)
+        if not documents:
+            return 0
+
+        def summarize(document: Dict[str, Any]):
+            if self._stopping.is_set():
+                return
+            texts = self.rag.vector_db.get_file_texts(document["file_id"], SUMMARY_CHUNKS)
+            self._summarize(document["file_id"], document["filename"], texts)
+
+        logger.info(f"Summarizing {len(documents)} documents")
+        with ThreadPoolExecutor(
+            max_workers=max(1, settings.bulk_summary_workers), thread_name_prefix="bulk-summary"
+        ) as pool:
+            list(pool.map(summarize, documents))
+        if self._stopping.is_set():
+            raise BulkIngestionStopped()
+        return len(documents)
+
+    # Background runs inside the server
+
+    def submit(self, batch_id: str):
+        """Run a batch on a background thread; stop() waits for it to write what it has buffered"""
+        thread = threading.Thread(
+            target=self._run_quietly, args=(batch_id,), name=f"bulk-{batch_id[:8]}"
+        )
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def _run_quietly(self, batch_id: str):
+        try:
+            self.run(batch_id)
+        except Exception:
+            pass  # already logged and recorded on the batch
+
+    async def start(self):
+        """Resume unfinished batches in the writer and poll for queued ones
+
+        Polling runs in multi-worker mode, and in a single server until it
+        gets the writer lock back from bulk_ingest.py.
+        """
+        self._stopping.clear()
+        if worker_role.is_writer:
+            for batch_id in await asyncio.to_thread(self.unfinished_batches):
+                self.submit(batch_id)
+        if settings.multi_worker or not worker_role.is_writer:
+            self._poller = asyncio.create_task(self._poll_batches())
+
+    async def stop(self):
+        """Stop runs after they flush their buffered chunks; interrupted batches resume on next start"""
+        self._stopping.set()
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            await asyncio.to_thread(thread.join)
+
+    async def _poll_batches(self):
+        """Batches created by other worker processes run in the ingestion writer"""
+        while True:
+            await asyncio.sleep(settings.shared_state_poll_seconds)
+            if not worker_role.is_writer:
+                continue
+            try:
+                for batch_id in await asyncio.to_thread(self.unfinished_batches):
+                    if batch_id not in self._running:
+                        self.submit(batch_id)
+            except Exception as e:
+                logger.error(f"Error polling bulk ingestion batches: {e}")
+
+
+bulk_ingestion_service = BulkIngestionService()
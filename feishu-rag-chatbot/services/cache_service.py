@@ -0,0 +1,192 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from loguru import logger
+from config.settings import settings
+from services.shared_state import shared_state
+
+
+# Shared-state key prefix of answers visible to every worker process
+SHARED_KEY_PREFIX = "answer:"
+
+
+class AnswerCache:
+    """LRU/TTL cache of RAG answers with optional semantic (cosine) lookup
+    
+    In multi-worker mode answers are also written to the shared state, so a
+    question answered by one worker is an exact hit in the others; semantic
+    lookup only searches the worker's own entries. The shared copies expire
+    with the TTL and are keyed on the corpus version, so they need no
+    invalidation.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, semantic_threshold: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._exact_hits = 0
+        self._semantic_hits = 0
+        self._shared_hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold > 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Case-fold, collapse whitespace and drop trailing punctuation"""
+        normalized = re.sub(r"\s+", " ", query.strip().lower())
+        return normalized.rstrip(" ?？!！.。")
+
+    def _scope(self, file_ids: Optional[List[str]], corpus_version: int, history: str) -> Tuple:
+        return (tuple(sorted(file_ids)) if file_ids else (), corpus_version, history)
+
+    def get(
+        self,
+        query: str,
+        file_ids: Optional[List[str]],
+        corpus_version: int,
+        query_embedding: Optional[List[float]] = None,
+        history: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        """Return a cached answer for the query, or None
+        
+        `history` identifies the conversation the question was asked in (a
+        digest of its chat history, "" for none); answers are only reused
+        within the same history, semantic matches included.
+        """
+        scope = self._scope(file_ids, corpus_version, history)
+        key = (self.normalize_query(query),) + scope
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_expired(now)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._exact_hits += 1
+                return entry["value"]
+
+        if settings.multi_worker:
+            value = shared_state.get(self._shared_key(key))
+            if value is not None:
+                self._store(key, scope, value, query_embedding)
+                with self._lock:
+                    self._shared_hits += 1
+                return value
+
+        with self._lock:
+            if self.semantic_enabled and query_embedding is not None:
+                best_key, best_score = self._nearest(scope, query_embedding)
+                if best_key is not None and best_score >= self.semantic_threshold:
+                    self._entries.move_to_end(best_key)
+                    self._semantic_hits += 1
+                    logger.debug(f"Semantic answer cache hit (cosine {best_score:.3f})")
+                    return self._entries[best_key]["value"]
+
+            self._misses += 1
+            return None
+
+    def set(
+        self,
+        query: str,
+        file_ids: Optional[List[str]],
+        corpus_version: int,
+        value: Dict[str, Any],
+        query_embedding: Optional[List[float]] = None,
+        history: str = ""
+    ):
+        """Store an answer, evicting the least recently used entry when full"""
+        scope = self._scope(file_ids, corpus_version, history)
+        key = (self.normalize_query(query),) + scope
+        self._store(key, scope, value, query_embedding)
+        if settings.multi_worker:
+            shared_state.set(self._shared_key(key), value, ttl=self.ttl_seconds or None)
+
+    def _store(self, key: Tuple, scope: Tuple, value: Dict[str, Any], query_embedding: Optional[List[float]]):
+        vector = None
+        if self.semantic_enabled and query_embedding is not None:
+            vector = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm > 0 else None
+
+        with self._lock:
+            self._entries[key] = {
+                "value": value,
+                "scope": scope,
+                "vector": vector,
+                "created_at": time.monotonic()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drop every cached answer (the corpus changed)"""
+        with self._lock:
+            self._entries.clear()
+            self._invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate counters"""
+        with self._lock:
+            hits = self._exact_hits + self._semantic_hits + self._shared_hits
+            lookups = hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self._exact_hits,
+                "semantic_hits": self._semantic_hits,
+                "shared_hits": self._shared_hits,
+                "misses": self._misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "invalidations": self._invalidations
+            }
+
+    @staticmethod
+    def _shared_key(key: Tuple) -> str:
+        return SHARED_KEY_PREFIX + hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+
+    def _evict_expired(self, now: float):
+        if self.ttl_seconds <= 0:
+            return
+        expired = [
+            key for key, entry in self._entries.items()
+            if now - entry["created_at"] > self.ttl_seconds
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    def _nearest(self, scope: Tuple, query_embedding: List[float]) -> Tuple[Optional[Tuple], float]:
+        candidates = [
+            (key, entry["vector"]) for key, entry in self._entries.items()
+            if entry["scope"] == scope and entry["vector"] is not None
+        ]
+        if not candidates:
+            return None, 0.0
+
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return None, 0.0
+
+        matrix = np.stack([vector for _, vector in candidates])
+        scores = matrix @ (query_vector / norm)
+        best = int(np.argmax(scores))
+        return candidates[best][0], float(scores[best])
+
+
+answer_cache = AnswerCache(
+    max_entries=settings.answer_cache_max_entries,
+    ttl_seconds=settings.answer_cache_ttl_seconds,
+    semantic_threshold=settings.answer_cache_semantic_threshold
+)
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+from loguru import logger
+from config.settings import settings
+
+
+class DocumentCatalog:
+    """Persistent SQLite catalog of ingested documents"""
+
+    def __init__(self):
+        self.db_path = settings.catalog_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    file_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    pages INTEGER,
+                    chunks INTEGER,
+                    summary TEXT,
+                    size_bytes INTEGER,
+                    ingested_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents (filename COLLATE NOCASE)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_documents_ingested_at ON documents (ingested_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def upsert(
+        self,
+        file_id: str,
+        filename: str,
+        pages: Optional[int] = None,
+        chunks: Optional[int] = None,
+        summary: Optional[str] = None,
+        size_bytes: Optional[int] = None
+    ):
+        """Insert or replace a document entry"""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO documents
+                    (file_id, filename, pages, chunks, summary, size_bytes, ingested_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (file_id, filename, pages, chunks, summary, size_bytes, time.time())
+            )
+
+    def set_summary(self, file_id: str, summary: str):
+        """Fill in a summary generated after the document was indexed"""
+        with self._connect() as conn:
+            conn.execute("UPDATE documents SET summary = ? WHERE file_id = ?", (summary, file_id))
+
+    def missing_summaries(self, file_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Documents without a summary, optionally among file_ids"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM documents WHERE summary IS NULL OR summary = '' ORDER BY ingested_at"
+            ).fetchall()
+        documents = [dict(row) for row in rows]
+        if file_ids is not None:
+            wanted = set(file_ids)
+            documents = [doc for doc in documents if doc["file_id"] in wanted]
+        return documents
+
+    def delete(self, file_id: str):
+        """Remove a document entry"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents WHERE file_id = ?", (file_id,))
+
+    def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a document by file id"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM documents WHERE file_id = ?", (file_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_filename(self, filename: str) -> List[Dict[str, Any]]:
+        """Look up documents by filename (case-insensitive)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM documents WHERE filename = ? COLLATE NOCASE ORDER BY ingested_at DESC",
+                (filename,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def resolve(self, term: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Documents a user means by term: exact filename (newest), file id prefix, then filename fragment"""
+        exact = self.find_by_filename(term)
+        if exact:
+            return exact[:1]
+        pattern = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._connect() as conn:
+            rows = []
+            if len(term) >= 4:
+                rows = conn.execute(
+                    "SELECT * FROM documents WHERE file_id LIKE ? ESCAPE '\\' LIMIT ?",
+                    (pattern + "%", limit)
+                ).fetchall()
+            if not rows:
+                rows = conn.execute(
+                    "SELECT * FROM documents WHERE filename LIKE ? ESCAPE '\\' "
+                    "ORDER BY ingested_at DESC LIMIT ?",
+                    ("%" + pattern + "%", limit)
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list(self, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Page through documents, newest first; returns (documents, total)"""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            rows = conn.execute(
+                "SELECT * FROM documents ORDER BY ingested_at DESC, file_id LIMIT ? OFFSET ?",
+                (limit if limit is not None else -1, max(0, offset))
+            ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def count(self) -> int:
+        """Number of documents in the catalog"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def backfill(self, files: List[Dict[str, Any]]):
+        """Seed the catalog from an existing vector collection"""
+        for file in files:
+            if not self.get(file["file_id"]):
+                self.upsert(**file)
+        logger.info(f"Backfilled document catalog with {len(files)} documents")
+
+
+document_catalog = DocumentCatalog()
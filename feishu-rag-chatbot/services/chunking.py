@@ -0,0 +1,221 @@
+import re
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+from loguru import logger
+from config.settings import settings
+from services.context_builder import count_tokens, get_encoding
+from services.cjk import CJK_CHARS
+
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_LINE_BREAK_RE = re.compile(r"\s*\n\s*")
+_CJK_SPACE_RE = re.compile(rf"(?<=[{CJK_CHARS}])\s+(?=[{CJK_CHARS}])")
+# Full-width terminators are not handled by punkt
+_CJK_SENTENCE_RE = re.compile(r"(?<=[。！？；])")
+_CJK_END_RE = re.compile(rf"[{CJK_CHARS}。！？；，]$")
+_CJK_START_RE = re.compile(rf"^[{CJK_CHARS}]")
+_FALLBACK_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+# (sentence, page, tokens)
+Unit = Tuple[str, int, int]
+
+
+def split_paragraphs(text: str) -> List[str]:
+    """Split page text on blank lines and unwrap hard line breaks"""
+    paragraphs = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = _LINE_BREAK_RE.sub(" ", paragraph).strip()
+        # Line wrapping inside CJK text must not introduce spaces
+        paragraph = _CJK_SPACE_RE.sub("", paragraph)
+        if paragraph:
+            paragraphs.append(paragraph)
+    return paragraphs
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a paragraph into sentences (CJK terminators, then NLTK punkt)"""
+    sentences = []
+    for piece in _CJK_SENTENCE_RE.split(text):
+        piece = piece.strip()
+        if piece:
+            sentences.extend(_punkt(piece))
+    return sentences
+
+
+def _punkt(text: str) -> List[str]:
+    try:
+        import nltk
+        sentences = nltk.sent_tokenize(text)
+    except LookupError:
+        # punkt data not downloaded; fall back to a simple rule
+        sentences = _FALLBACK_SENTENCE_RE.split(text)
+    return [s.strip() for s in sentences if s.strip()]
+
+
+def _whole_characters(data: bytes) -> bool:
+    """Whether the bytes are valid UTF-8, i.e. cut on character boundaries"""
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def join_sentences(sentences: List[str]) -> str:
+    """Join sentences with spaces, except between CJK sentences"""
+    text = ""
+    for sentence in sentences:
+        if text and not (_CJK_END_RE.search(text) and _CJK_START_RE.match(sentence)):
+            text += " "
+        text += sentence
+    return text
+
+
+class Chunker(ABC):
+    """Turns a stream of (page number, text) into chunk dicts"""
+
+    @abstractmethod
+    def chunk(self, pages: Iterable[Tuple[int, str]], file_id: str) -> Iterator[Dict[str, Any]]:
+        ...
+
+    @staticmethod
+    def _make_chunk(
+        file_id: str,
+        index: int,
+        text: str,
+        page: int,
+        page_end: int,
+        chunk_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return {
+            "text": text,
+            "page": page,
+            "page_end": page_end,
+            "file_id": file_id,
+            "chunk_index": index,
+            "chunk_id": chunk_id or f"{file_id}_p{page}_c{index}"
+        }
+
+
+class FixedSizeChunker(Chunker):
+    """Fixed character slices within each page (the original behaviour)"""
+
+    def __init__(self, chunk_size: int = 1000):
+        self.chunk_size = max(1, chunk_size)
+
+    def chunk(self, pages: Iterable[Tuple[int, str]], file_id: str) -> Iterator[Dict[str, Any]]:
+        index = 0
+        for page_num, text in pages:
+            for i in range(0, len(text), self.chunk_size):
+                # Keep the original per-page chunk ids
+                chunk_id = f"{file_id}_p{page_num}_c{i // self.chunk_size}"
+                yield self._make_chunk(file_id, index, text[i:i + self.chunk_size], page_num, page_num, chunk_id)
+                index += 1
+
+
+class SentenceChunker(Chunker):
+    """Token-sized chunks cut on sentence and paragraph boundaries, spanning pages"""
+
+    def __init__(self, max_tokens: int, overlap_tokens: int):
+        self.max_tokens = max(16, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+        # Close a chunk at a paragraph end once it is this full
+        self.paragraph_break_tokens = int(self.max_tokens * 0.75)
+
+    def chunk(self, pages: Iterable[Tuple[int, str]], file_id: str) -> Iterator[Dict[str, Any]]:
+        # Only the chunk being built is held in memory
+        buffer: List[Unit] = []
+        carried = 0
+        index = 0
+
+        for sentence, page, paragraph_end in self._sentences(pages):
+            tokens = count_tokens(sentence)
+            if tokens > self.max_tokens:
+                logger.debug(f"Splitting oversized sentence on page {page} of {file_id}")
+                pieces = self._split_oversized(sentence)
+            else:
+                pieces = [(sentence, tokens)]
+
+            for piece, piece_tokens in pieces:
+                if self._tokens(buffer) + piece_tokens > self.max_tokens:
+                    if len(buffer) > carried:
+                        yield self._emit(file_id, index, buffer)
+                        index += 1
+                        buffer = self._overlap(buffer)
+                    if self._tokens(buffer) + piece_tokens > self.max_tokens:
+                        # No room for the overlap next to this piece
+                        buffer = []
+                    carried = len(buffer)
+                buffer.append((piece, page, piece_tokens))
+
+            if paragraph_end and self._tokens(buffer) >= self.paragraph_break_tokens:
+                yield self._emit(file_id, index, buffer)
+                index += 1
+                buffer = self._overlap(buffer)
+                carried = len(buffer)
+
+        # A tail that is only carried overlap adds nothing new
+        if len(buffer) > carried:
+            yield self._emit(file_id, index, buffer)
+
+    @staticmethod
+    def _tokens(buffer: List[Unit]) -> int:
+        return sum(unit[2] for unit in buffer)
+
+    @staticmethod
+    def _sentences(pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, int, bool]]:
+        """Yield (sentence, page, is last sentence of its paragraph)"""
+        for page_num, text in pages:
+            for paragraph in split_paragraphs(text):
+                sentences = split_sentences(paragraph)
+                for i, sentence in enumerate(sentences):
+                    yield sentence, page_num, i == len(sentences) - 1
+
+    def _split_oversized(self, sentence: str) -> List[Tuple[str, int]]:
+        """Cut a sentence longer than max_tokens into pieces of at most max_tokens
+        
+        A CJK character can span several byte-level tokens, so each cut backs
+        off to the nearest token boundary that is also a character boundary.
+        """
+        encoding = get_encoding(settings.openai_model)
+        tokens = encoding.encode(sentence)
+        pieces = []
+        start = 0
+        while start < len(tokens):
+            limit = min(start + self.max_tokens, len(tokens))
+            end = limit
+            while end > start and not _whole_characters(encoding.decode_bytes(tokens[start:end])):
+                end -= 1
+            if end == start:
+                # No character ends inside the window; let this piece run a few tokens over
+                end = limit
+                while end < len(tokens) and not _whole_characters(encoding.decode_bytes(tokens[start:end])):
+                    end += 1
+            pieces.append((encoding.decode(tokens[start:end]), end - start))
+            start = end
+        return pieces
+
+    def _overlap(self, buffer: List[Unit]) -> List[Unit]:
+        """Trailing sentences of the finished chunk that fit the overlap budget"""
+        carried: List[Unit] = []
+        total = 0
+        for unit in reversed(buffer):
+            if total + unit[2] > self.overlap_tokens:
+                break
+            carried.insert(0, unit)
+            total += unit[2]
+        return carried
+
+    def _emit(self, file_id: str, index: int, buffer: List[Unit]) -> Dict[str, Any]:
+        text = join_sentences([unit[0] for unit in buffer])
+        return self._make_chunk(file_id, index, text, buffer[0][1], buffer[-1][1])
+
+
+def get_chunker() -> Chunker:
+    """Chunker selected by settings.chunker"""
+    if settings.chunker == "fixed":
+        return FixedSizeChunker(settings.chunk_size_chars)
+    return SentenceChunker(
+        max_tokens=settings.chunk_max_tokens,
+        overlap_tokens=settings.chunk_overlap_tokens
+    )
@@ -0,0 +1,2 @@
+# CJK ideographs, kana and hangul, for use inside a regex character class
+CJK_CHARS = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
@@ -0,0 +1,559 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+
+# Rows scored per NumPy block; small enough for the float32 scratch copy to stay in cache
+SEARCH_BLOCK_ROWS = 4096
+
+# Initial array capacity in rows; the arrays at least double when they fill up
+MIN_GROWTH_ROWS = 4096
+
+# A delete compacts the store once tombstones outnumber live rows and there are at least this many
+COMPACT_MIN_DEAD_ROWS = 4096
+
+# Rows copied per step while compacting
+COMPACT_BLOCK_ROWS = 65536
+
+DTYPES = {"int8": np.int8, "float16": np.float16}
+
+# Membership in a list bound as one JSON parameter, so id lists of any size stay under SQLite's parameter limit
+IN_JSON_LIST = "(SELECT value FROM json_each(?))"
+
+
+class CompactVectorStore:
+    """Memory-mapped int8/float16 embedding store with exact (brute-force) cosine search
+
+    Drop-in for the subset of the Chroma collection API the vector DB service
+    uses (upsert, get, query, delete, count), with the same result shapes.
+
+    Layout under the store directory:
+      vectors.bin  - (capacity, dim) int8 or float16, unit-normalized
+      scales.bin   - (capacity,) float32 per-row dequantization scale (int8 only)
+      full.bin     - (capacity, dim) float32 copies used to rescore the top candidates
+                     (only with rescore; as large as the float32 index it replaces)
+      alive.bin    - (capacity,) uint8, 0 for deleted rows
+      rows.db      - chunk id -> row offset table, texts, metadata and per-file row ranges
+
+    Deleted rows stay as tombstones until compact() rewrites the live rows
+    contiguously; delete() does so once tombstones outnumber live rows.
+    Compaction bumps a generation number in rows.db, and a process that
+    sees a newer generation than it mapped reopens the arrays.
+    """
+
+    def __init__(self, path: str, dtype: str = "int8", rescore: bool = False, rescore_candidates: int = 100):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported compact store dtype: {dtype}")
+        self.path = path
+        self.rescore = rescore
+        self.rescore_candidates = max(1, rescore_candidates)
+        self.db_path = os.path.join(path, "rows.db")
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS rows (
+                    row INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    file_id TEXT NOT NULL,
+                    document TEXT,
+                    metadata TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS file_ranges (
+                    file_id TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    PRIMARY KEY (file_id, start)
+                );
+                CREATE TABLE IF NOT EXISTS info (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                """
+            )
+            info = dict(conn.execute("SELECT key, value FROM info").fetchall())
+
+        stored_dtype = info.get("dtype", dtype)
+        if stored_dtype != dtype:
+            raise ValueError(f"Compact store at {path} holds {stored_dtype} vectors, not {dtype}")
+        self.dtype = dtype
+        self._capacity = 0
+        self._vectors = self._scales = self._full = self._alive = None
+        self._load()
+
+    def _load(self):
+        """Read the row table state and map the arrays"""
+        self._finish_compaction()
+        with self._connect() as conn:
+            info = dict(conn.execute("SELECT key, value FROM info").fetchall())
+            ranges = conn.execute("SELECT file_id, start, end FROM file_ranges ORDER BY start").fetchall()
+
+        self.dim: Optional[int] = int(info["dim"]) if "dim" in info else None
+        self._rows = int(info.get("rows", 0))  # high-water mark; deleted rows stay as tombstones until compact()
+        self._generation = int(info.get("generation", 0))
+        self._has_full = info.get("full", "1" if self.rescore else "0") == "1"
+
+        self._file_ranges: Dict[str, List[Tuple[int, int]]] = {}
+        for file_id, start, end in ranges:
+            self._file_ranges.setdefault(file_id, []).append((start, end))
+
+        self._flush()
+        self._capacity = 0
+        self._vectors = self._scales = self._full = self._alive = None
+        if self.dim is not None:
+            self._open_arrays(max(self._file_capacity(), MIN_GROWTH_ROWS))
+
+    # Storage
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _file_capacity(self) -> int:
+        path = self._file("vectors.bin")
+        if not os.path.exists(path):
+            return 0
+        itemsize = np.dtype(DTYPES[self.dtype]).itemsize
+        return os.path.getsize(path) // (self.dim * itemsize)
+
+    def _array_files(self, capacity: int) -> List[Tuple[str, Any, Tuple[int, ...]]]:
+        """(file name, dtype, shape) of each array file at capacity rows"""
+        files = [("vectors.bin", DTYPES[self.dtype], (capacity, self.dim)), ("alive.bin", np.uint8, (capacity,))]
+        if self.dtype == "int8":
+            files.append(("scales.bin", np.float32, (capacity,)))
+        if self._has_full:
+            files.append(("full.bin", np.float32, (capacity, self.dim)))
+        return files
+
+    @staticmethod
+    def _map(path: str, dtype, shape: Tuple[int, ...]) -> np.memmap:
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _open_arrays(self, capacity: int):
+        """(Re)map the array files, growing them to capacity rows"""
+        self._flush()
+        arrays = {
+            name: self._map(self._file(name), dtype, shape)
+            for name, dtype, shape in self._array_files(capacity)
+        }
+
+        self._vectors = arrays["vectors.bin"]
+        self._alive = arrays["alive.bin"]
+        self._scales = arrays.get("scales.bin")
+        self._full = arrays.get("full.bin")
+        self._capacity = capacity
+
+    def _flush(self):
+        for array in (self._vectors, self._scales, self._full, self._alive):
+            if array is not None:
+                array.flush()
+
+    def _ensure_capacity(self, rows: int):
+        if rows > self._capacity:
+            self._open_arrays(max(rows, self._capacity * 2, MIN_GROWTH_ROWS))
+
+    # Quantization
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def _write_rows(self, rows: np.ndarray, vectors: np.ndarray):
+        vectors = self._normalize(vectors)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._vectors[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._scales[rows] = scales
+        else:
+            self._vectors[rows] = vectors.astype(np.float16)
+        if self._full is not None:
+            self._full[rows] = vectors
+        self._alive[rows] = 1
+
+    def _read_rows(self, rows: np.ndarray) -> np.ndarray:
+        if self._full is not None:
+            return np.asarray(self._full[rows])
+        vectors = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self._scales is not None:
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    # Chroma-compatible API
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+        documents: List[str]
+    ):
+        """Overwrite existing chunk ids in place and append new ones
+
+        An id repeated within one call is written once, with its last values.
+        """
+        if not ids:
+            return
+        last = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        if len(last) < len(ids):
+            keep = sorted(last.values())
+            ids = [ids[i] for i in keep]
+            embeddings = [embeddings[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+            documents = [documents[i] for i in keep]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            self._ensure_current()
+            if self.dim is None:
+                self._init_dim(vectors.shape[1])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dim}")
+
+            with self._connect() as conn:
+                existing = self._rows_for_ids(conn, ids)
+                rows = []
+                appended: List[Tuple[str, int]] = []
+                for chunk_id, metadata in zip(ids, metadatas):
+                    row = existing.get(chunk_id)
+                    if row is None:
+                        row = self._rows
+                        self._rows += 1
+                        appended.append((metadata["file_id"], row))
+                    rows.append(row)
+
+                self._ensure_capacity(self._rows)
+                self._write_rows(np.asarray(rows), vectors)
+                self._flush()
+
+                # Rows are committed only after their vectors are on disk
+                conn.executemany(
+                    "INSERT OR REPLACE INTO rows (row, chunk_id, file_id, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (row, chunk_id, metadata["file_id"], document, json.dumps(metadata, ensure_ascii=False))
+                        for row, chunk_id, metadata, document in zip(rows, ids, metadatas, documents)
+                    ]
+                )
+                for file_id, row in appended:
+                    self._extend_range(conn, file_id, row)
+                conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('rows', ?)", (str(self._rows),))
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None
+    ) -> Dict[str, Any]:
+        include = include or ["documents", "metadatas"]
+        if ids is not None and not ids:
+            return {"ids": [], **{key: [] for key in include}}
+        clauses, params = [], []
+        if ids is not None:
+            clauses.append(f"chunk_id IN {IN_JSON_LIST}")
+            params.append(json.dumps(list(ids)))
+        file_ids = self._where_file_ids(where)
+        if file_ids is not None:
+            clauses.append(f"file_id IN {IN_JSON_LIST}")
+            params.append(json.dumps(file_ids))
+        sql = "SELECT row, chunk_id, document, metadata FROM rows"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY row"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset or 0])
+
+        result: Dict[str, Any] = {}
+        if "embeddings" in include:
+            with self._lock, self._connect() as conn:
+                self._begin_snapshot(conn)
+                records = conn.execute(sql, params).fetchall()
+                rows = np.asarray([record[0] for record in records], dtype=np.int64)
+                result["embeddings"] = self._read_rows(rows).tolist() if len(rows) else []
+        else:
+            with self._connect() as conn:
+                records = conn.execute(sql, params).fetchall()
+
+        result["ids"] = [record[1] for record in records]
+        if "documents" in include:
+            result["documents"] = [record[2] for record in records]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(record[3]) for record in records]
+        return result
+
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Exact cosine search, optionally rescoring the quantized top candidates in float32"""
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for embedding in query_embeddings:
+            with self._lock, self._connect() as conn:
+                self._begin_snapshot(conn)
+                rows, scores = self._search(np.asarray(embedding, dtype=np.float32), n_results, where)
+                records = {
+                    record[0]: record for record in conn.execute(
+                        f"SELECT row, chunk_id, document, metadata FROM rows WHERE row IN {IN_JSON_LIST}",
+                        (json.dumps([int(row) for row in rows]),)
+                    )
+                } if len(rows) else {}
+            hits = [(records[int(row)], float(score)) for row, score in zip(rows, scores) if int(row) in records]
+            result["ids"].append([record[1] for record, _ in hits])
+            result["documents"].append([record[2] for record, _ in hits])
+            result["metadatas"].append([json.loads(record[3]) for record, _ in hits])
+            result["distances"].append([1.0 - score for _, score in hits])
+        return result
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """Tombstone rows by chunk id or file id"""
+        file_ids = self._where_file_ids(where)
+        if ids is not None and not ids:
+            return
+        with self._lock:
+            self._ensure_current()
+            self._tombstone(ids, file_ids)
+            with self._connect() as conn:
+                live = conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+            dead = self._rows - live
+            if dead >= COMPACT_MIN_DEAD_ROWS and dead > live:
+                self.compact()
+
+    def _tombstone(self, ids: Optional[List[str]], file_ids: Optional[List[str]]):
+        with self._connect() as conn:
+            if ids is not None:
+                rows = list(self._rows_for_ids(conn, ids).values())
+                conn.executemany("DELETE FROM rows WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+            elif file_ids is not None:
+                param = (json.dumps(file_ids),)
+                rows = [r[0] for r in conn.execute(f"SELECT row FROM rows WHERE file_id IN {IN_JSON_LIST}", param)]
+                conn.execute(f"DELETE FROM rows WHERE file_id IN {IN_JSON_LIST}", param)
+                conn.execute(f"DELETE FROM file_ranges WHERE file_id IN {IN_JSON_LIST}", param)
+                for file_id in file_ids:
+                    self._file_ranges.pop(file_id, None)
+            else:
+                raise ValueError("delete needs ids or a file_id where clause")
+            if rows and self._alive is not None:
+                self._alive[np.asarray(rows)] = 0
+                self._alive.flush()
+
+    def compact(self) -> int:
+        """Rewrite the live rows contiguously, file by file, dropping tombstones; returns rows reclaimed
+
+        The new arrays are written beside the old ones, the row table is
+        renumbered in one transaction that also marks the swap as pending, and
+        then the files are moved into place. A crash after the commit is
+        finished by the next open.
+        """
+        with self._lock:
+            self._ensure_current()
+            if self.dim is None:
+                return 0
+            with self._connect() as conn:
+                live = [row for row, in conn.execute("SELECT row FROM rows ORDER BY file_id, row")]
+            reclaimed = self._rows - len(live)
+            if reclaimed <= 0:
+                return 0
+
+            capacity = max(len(live), MIN_GROWTH_ROWS)
+            old_arrays = {"vectors.bin": self._vectors, "alive.bin": self._alive,
+                          "scales.bin": self._scales, "full.bin": self._full}
+            order = np.asarray(live, dtype=np.int64)
+            for name, dtype, shape in self._array_files(capacity):
+                path = self._file(name) + ".compact"
+                if os.path.exists(path):
+                    os.remove(path)  # left by a compaction that never committed
+                target = self._map(path, dtype, shape)
+                for start in range(0, len(order), COMPACT_BLOCK_ROWS):
+                    block = order[start:start + COMPACT_BLOCK_ROWS]
+                    target[start:start + len(block)] = old_arrays[name][block]
+                target.flush()
+                del target
+
+            ranges: Dict[str, List[int]] = {}
+            with self._connect() as conn:
+                file_ids = [file_id for file_id, in conn.execute("SELECT file_id FROM rows ORDER BY file_id, row")]
+                for new_row, file_id in enumerate(file_ids):
+                    span = ranges.setdefault(file_id, [new_row, new_row])
+                    span[1] = new_row + 1
+                # Negate first so the renumbering never collides on the primary key
+                conn.execute("UPDATE rows SET row = -row - 1")
+                conn.executemany(
+                    "UPDATE rows SET row = ? WHERE row = ?",
+                    [(new_row, -old_row - 1) for new_row, old_row in enumerate(live)]
+                )
+                conn.execute("DELETE FROM file_ranges")
+                conn.executemany(
+                    "INSERT INTO file_ranges (file_id, start, end) VALUES (?, ?, ?)",
+                    [(file_id, start, end) for file_id, (start, end) in ranges.items()]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                    [("rows", str(len(live))), ("generation", str(self._generation + 1)), ("compact_pending", "1")]
+                )
+
+            self._load()
+            return reclaimed
+
+    # Internals
+
+    def _finish_compaction(self):
+        """Move the arrays of a committed compaction into place (idempotent, so any process may do it)"""
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM info WHERE key = 'compact_pending'").fetchone() is None:
+                return
+            for name in ("vectors.bin", "alive.bin", "scales.bin", "full.bin"):
+                try:
+                    os.replace(self._file(name) + ".compact", self._file(name))
+                except FileNotFoundError:
+                    pass  # not used by this store, or already moved
+            conn.execute("DELETE FROM info WHERE key = 'compact_pending'")
+
+    @staticmethod
+    def _stored_generation(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM info WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _ensure_current(self):
+        """Remap the arrays if another process compacted the store (call with the lock held)"""
+        with self._connect() as conn:
+            generation = self._stored_generation(conn)
+        if generation != self._generation:
+            self._load()
+
+    def _begin_snapshot(self, conn: sqlite3.Connection):
+        """Open a read transaction whose row numbers match the mapped arrays (call with the lock held)"""
+        while True:
+            conn.execute("BEGIN")
+            if self._stored_generation(conn) == self._generation:
+                return
+            conn.execute("ROLLBACK")
+            self._load()
+
+    def _init_dim(self, dim: int):
+        self.dim = dim
+        self._has_full = self.rescore
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                [("dim", str(dim)), ("dtype", self.dtype), ("full", "1" if self._has_full else "0")]
+            )
+        self._open_arrays(MIN_GROWTH_ROWS)
+
+    @staticmethod
+    def _rows_for_ids(conn: sqlite3.Connection, ids: List[str]) -> Dict[str, int]:
+        return dict(conn.execute(
+            f"SELECT chunk_id, row FROM rows WHERE chunk_id IN {IN_JSON_LIST}", (json.dumps(list(ids)),)
+        ))
+
+    def _extend_range(self, conn: sqlite3.Connection, file_id: str, row: int):
+        """Record row in the file's row ranges, growing the last range when contiguous"""
+        ranges = self._file_ranges.setdefault(file_id, [])
+        if ranges and ranges[-1][1] == row:
+            start = ranges[-1][0]
+            ranges[-1] = (start, row + 1)
+            conn.execute("UPDATE file_ranges SET end = ? WHERE file_id = ? AND start = ?", (row + 1, file_id, start))
+        else:
+            ranges.append((row, row + 1))
+            conn.execute("INSERT INTO file_ranges (file_id, start, end) VALUES (?, ?, ?)", (file_id, row, row + 1))
+
+    @staticmethod
+    def _where_file_ids(where: Optional[Dict[str, Any]]) -> Optional[List[str]]:
+        if not where:
+            return None
+        if set(where) != {"file_id"}:
+            raise ValueError(f"Compact store only filters on file_id, got {where}")
+        condition = where["file_id"]
+        if isinstance(condition, dict):
+            if set(condition) != {"$in"}:
+                raise ValueError(f"Unsupported file_id filter: {condition}")
+            return list(condition["$in"])
+        return [condition]
+
+    def _candidate_rows(self, file_ids: Optional[List[str]]) -> Optional[np.ndarray]:
+        """Row indices for a file_id filter from the per-file ranges; None means all rows"""
+        if file_ids is None:
+            return None
+        spans = [span for file_id in file_ids for span in self._file_ranges.get(file_id, [])]
+        if not spans:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in spans])
+
+    def _score_block(self, rows, query: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(self._vectors[rows], dtype=np.float32)
+        scores = vectors @ query
+        if self._scales is not None:
+            scores *= self._scales[rows]
+        scores[self._alive[rows] == 0] = -np.inf
+        return scores
+
+    def _search(
+        self,
+        query: np.ndarray,
+        n_results: int,
+        where: Optional[Dict[str, Any]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            if self.dim is None or self._rows == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            query = self._normalize(query)
+            candidates = self._candidate_rows(self._where_file_ids(where))
+            total = self._rows if candidates is None else len(candidates)
+
+            # Quantized scores for every candidate row, scanned block by block
+            scores = np.empty(total, dtype=np.float32)
+            for start in range(0, total, SEARCH_BLOCK_ROWS):
+                end = min(start + SEARCH_BLOCK_ROWS, total)
+                rows = slice(start, end) if candidates is None else candidates[start:end]
+                scores[start:end] = self._score_block(rows, query)
+
+            keep = min(total, max(n_results, self.rescore_candidates) if self._full is not None else n_results)
+            top = np.argpartition(-scores, keep - 1)[:keep] if keep < total else np.arange(total)
+            top = top[np.isfinite(scores[top])]
+            rows = top if candidates is None else candidates[top]
+            top_scores = scores[top]
+
+            if self._full is not None and len(rows):
+                # Exact float32 scores for the shortlist
+                order = np.argsort(rows)
+                rows, top_scores = rows[order], np.asarray(self._full[rows[order]]) @ query
+
+        order = np.argsort(-top_scores)[:n_results]
+        return rows[order], top_scores[order]
+
+    def stats(self) -> Dict[str, Any]:
+        itemsize = np.dtype(DTYPES[self.dtype]).itemsize
+        return {
+            "dtype": self.dtype,
+            "dim": self.dim,
+            "rows": self._rows,
+            "generation": self._generation,
+            "rescore": self._full is not None,
+            "vector_bytes": self._rows * (self.dim or 0) * itemsize
+        }
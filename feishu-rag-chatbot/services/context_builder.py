@@ -0,0 +1,227 @@
+import re
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+import tiktoken
+from config.settings import settings
+from services.lexical_index import tokenize
+
+
+# Approximate per-message overhead of the chat completion format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CHUNK_ID_RE = re.compile(r"_p(\d+)_c(\d+)$")
+
+
+@lru_cache(maxsize=8)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """tiktoken encoding for a model, falling back to cl100k_base"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Number of tokens in text for the configured model"""
+    return len(get_encoding(model or settings.openai_model).encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Cut text down to at most max_tokens tokens"""
+    encoding = get_encoding(model or settings.openai_model)
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def format_pages(metadata: Dict[str, Any]) -> str:
+    """Page label for a chunk: Page 3, or Pages 3-4 when it spans pages"""
+    page = metadata.get("page", "Unknown")
+    page_end = metadata.get("page_end", page)
+    if page_end != page:
+        return f"Pages {page}-{page_end}"
+    return f"Page {page}"
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: Optional[str] = None) -> int:
+    """Approximate prompt tokens for a list of chat messages"""
+    return sum(count_tokens(m.get("content", ""), model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+class ContextBuilder:
+    """Packs retrieved chunks and chat history into a token budget"""
+
+    def __init__(
+        self,
+        context_budget: int,
+        history_budget: int,
+        dedup_threshold: float,
+        min_trim_tokens: int = 64
+    ):
+        self.context_budget = context_budget
+        self.history_budget = history_budget
+        self.dedup_threshold = dedup_threshold
+        self.min_trim_tokens = min_trim_tokens
+
+    def pack_context(self, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """Merge, deduplicate and pack search results (best first) into the context budget"""
+        merged, merged_count = self._merge_adjacent(results)
+        unique, duplicate_count = self._drop_near_duplicates(merged)
+
+        packed = []
+        used = 0
+        trimmed = 0
+        for item in unique:
+            header_tokens = count_tokens(self.format_header(len(packed) + 1, item))
+            text_tokens = count_tokens(item.get("text", ""))
+            remaining = self.context_budget - used - header_tokens
+
+            if text_tokens <= remaining:
+                packed.append(item)
+                used += header_tokens + text_tokens
+            elif remaining >= self.min_trim_tokens:
+                # Trim the last chunk that partly fits, then stop
+                packed.append(dict(item, text=truncate_tokens(item["text"], remaining)))
+                used += header_tokens + remaining
+                trimmed += 1
+                break
+            else:
+                break
+
+        stats = {
+            "context_tokens": used,
+            "chunks_retrieved": len(results),
+            "chunks_used": len(packed),
+            "chunks_merged": merged_count,
+            "chunks_deduplicated": duplicate_count,
+            "chunks_trimmed": trimmed
+        }
+        return packed, stats
+
+    def pack_history(self, history: Optional[List[Dict[str, str]]]) -> Tuple[List[Dict[str, str]], int]:
+        """Keep the most recent history messages that fit the history budget"""
+        if not history:
+            return [], 0
+
+        kept = []
+        used = 0
+        for message in reversed(history):
+            tokens = count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+            if used + tokens > self.history_budget:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+        return kept, used
+
+    @staticmethod
+    def format_header(index: int, item: Dict[str, Any]) -> str:
+        metadata = item.get("metadata", {})
+        filename = metadata.get("filename", "Unknown")
+        return f"[Source {index}: {filename}, {format_pages(metadata)}]\n"
+
+    def _merge_adjacent(self, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Join consecutive chunks of a document into one passage at the better rank"""
+        position = {}
+        for i, item in enumerate(results):
+            key = self._chunk_position(item)
+            if key:
+                position[key] = i
+
+        consumed = set()
+        merged = []
+        merged_count = 0
+        for i, item in enumerate(results):
+            if i in consumed:
+                continue
+            consumed.add(i)
+            key = self._chunk_position(item)
+            if key:
+                file_id, page, index = key
+                text = item.get("text", "")
+                
+                # Absorb lower-ranked neighbours on both sides
+                previous_index = index - 1
+                while True:
+                    j = position.get((file_id, page, previous_index))
+                    if j is None or j in consumed:
+                        break
+                    text = self._join_overlapping(results[j].get("text", ""), text)
+                    consumed.add(j)
+                    merged_count += 1
+                    previous_index -= 1
+                next_index = index + 1
+                while True:
+                    j = position.get((file_id, page, next_index))
+                    if j is None or j in consumed:
+                        break
+                    text = self._join_overlapping(text, results[j].get("text", ""))
+                    consumed.add(j)
+                    merged_count += 1
+                    next_index += 1
+                
+                if previous_index != index - 1 or next_index != index + 1:
+                    # The passage spans from the earliest to the latest absorbed chunk
+                    first = results[position[(file_id, page, previous_index + 1)]].get("metadata", {})
+                    last = results[position[(file_id, page, next_index - 1)]].get("metadata", {})
+                    metadata = dict(first)
+                    if "page_end" in last:
+                        metadata["page_end"] = last["page_end"]
+                    item = dict(item, metadata=metadata)
+                item = dict(item, text=text)
+            merged.append(item)
+        return merged, merged_count
+
+    def _drop_near_duplicates(self, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        kept = []
+        kept_tokens = []
+        for item in results:
+            tokens = set(tokenize(item.get("text", "")))
+            duplicate = False
+            for other in kept_tokens:
+                if not tokens or not other:
+                    continue
+                overlap = len(tokens & other)
+                # Jaccard similarity, or one passage mostly contained in the other
+                if (
+                    overlap / len(tokens | other) >= self.dedup_threshold
+                    or overlap / min(len(tokens), len(other)) >= 0.95
+                ):
+                    duplicate = True
+                    break
+            if not duplicate:
+                kept.append(item)
+                kept_tokens.append(tokens)
+        return kept, len(results) - len(kept)
+
+    @staticmethod
+    def _chunk_position(item: Dict[str, Any]) -> Optional[Tuple[str, Any, int]]:
+        metadata = item.get("metadata", {})
+        if "chunk_index" in metadata:
+            # Sequence number across the whole document; chunks may span pages
+            return metadata.get("file_id"), None, metadata["chunk_index"]
+        # Older chunks are numbered per page in the chunk id
+        match = _CHUNK_ID_RE.search(metadata.get("chunk_id", "") or "")
+        if not match:
+            return None
+        return metadata.get("file_id"), metadata.get("page"), int(match.group(2))
+
+    @staticmethod
+    def _join_overlapping(first: str, second: str, min_overlap: int = 20, max_overlap: int = 500) -> str:
+        """Concatenate two passages, dropping text the second repeats from the first
+
+        Without an overlap the passages are joined on a new line, so words at
+        the seam stay apart.
+        """
+        for size in range(min(len(first), len(second), max_overlap), min_overlap - 1, -1):
+            if first.endswith(second[:size]):
+                return first + second[size:]
+        return first + "\n" + second
+
+
+context_builder = ContextBuilder(
+    context_budget=settings.llm_context_token_budget,
+    history_budget=settings.llm_history_token_budget,
+    dedup_threshold=settings.context_dedup_threshold
+)
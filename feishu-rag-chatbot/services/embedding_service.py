@@ -0,0 +1,200 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from loguru import logger
+from config.settings import settings
+
+
+class EmbeddingService:
+    """Shared encoder for ingestion and search: batching, query cache and micro-batching"""
+
+    def __init__(self):
+        self.model_name = settings.embedding_model
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._encode_pool = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.embedding_executor_workers),
+            thread_name_prefix="embed"
+        )
+
+        # Query embedding LRU cache
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._cache_size = settings.query_embedding_cache_size
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # Micro-batcher state (owned by the event loop)
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batches = 0
+        self._batched_queries = 0
+
+    @property
+    def model(self):
+        """Load the model on first use (or during the startup warm-up)"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    start = time.perf_counter()
+                    self._model = SentenceTransformer(self.model_name)
+                    logger.info(f"Loaded embedding model {self.model_name} in {time.perf_counter() - start:.2f}s")
+        return self._model
+
+    def load(self):
+        """Load the model now instead of on the first request"""
+        self.model
+
+    def encode_documents(
+        self,
+        texts: List[str],
+        progress: Optional[Callable[[str, float], None]] = None
+    ) -> List[List[float]]:
+        """Encode texts in configurable batches, optionally across a process pool"""
+        batch_size = max(1, settings.embedding_batch_size)
+        use_pool = settings.embedding_workers > 1 and len(texts) > batch_size
+
+        # Encode in slices so long documents can report progress
+        slice_size = batch_size * max(1, settings.embedding_workers) * 4
+        embeddings = []
+        for i in range(0, len(texts), slice_size):
+            batch = texts[i:i + slice_size]
+            if use_pool:
+                encoded = self.model.encode_multi_process(
+                    batch, self._get_encode_pool(), batch_size=batch_size
+                )
+            else:
+                encoded = self.model.encode(
+                    batch, batch_size=batch_size, show_progress_bar=False
+                )
+            embeddings.extend(encoded.tolist())
+            if progress:
+                progress("embed", len(embeddings) / len(texts))
+
+        return embeddings
+
+    def embed_query(self, query: str) -> List[float]:
+        """Encode a single query, using the LRU cache"""
+        cached = self._cache_get(query)
+        if cached is not None:
+            return cached
+        embedding = self.model.encode(query, show_progress_bar=False).tolist()
+        self._cache_put(query, embedding)
+        return embedding
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """Encode a query without blocking the event loop
+
+        Concurrent calls arriving within the batching window are encoded
+        together in a single forward pass on the executor.
+        """
+        cached = self._cache_get(query)
+        if cached is not None:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, future))
+
+        if len(self._pending) >= settings.embedding_max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(
+                settings.embedding_batch_window_ms / 1000, self._flush
+            )
+
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        """Query cache and micro-batching counters"""
+        lookups = self._cache_hits + self._cache_misses
+        return {
+            "model_loaded": self._model is not None,
+            "cache_entries": len(self._cache),
+            "cache_hits": self._cache_hits,
+            "cache_misses": self._cache_misses,
+            "cache_hit_rate": self._cache_hits / lookups if lookups else 0.0,
+            "batches": self._batches,
+            "avg_batch_size": self._batched_queries / self._batches if self._batches else 0.0
+        }
+
+    def close(self):
+        """Release the encoding process pool and executor"""
+        if self._encode_pool is not None:
+            self._model.stop_multi_process_pool(self._encode_pool)
+            self._encode_pool = None
+        self._executor.shutdown(wait=False)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        # Identical queries in the same window share one encoding
+        unique_queries = list(dict.fromkeys(query for query, _ in batch))
+        self._batches += 1
+        self._batched_queries += len(unique_queries)
+
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(self._executor, self._encode_batch, unique_queries)
+        task.add_done_callback(lambda done: self._resolve(batch, unique_queries, done))
+
+    def _encode_batch(self, queries: List[str]) -> List[List[float]]:
+        return self.model.encode(
+            queries, batch_size=len(queries), show_progress_bar=False
+        ).tolist()
+
+    def _resolve(self, batch, unique_queries: List[str], done: asyncio.Future):
+        error = done.exception()
+        if error is not None:
+            logger.error(f"Error encoding query batch: {error}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        embeddings = dict(zip(unique_queries, done.result()))
+        for query, embedding in embeddings.items():
+            self._cache_put(query, embedding)
+        for query, future in batch:
+            if not future.done():
+                future.set_result(embeddings[query])
+
+    def _cache_get(self, query: str) -> Optional[List[float]]:
+        with self._cache_lock:
+            embedding = self._cache.get(query)
+            if embedding is None:
+                self._cache_misses += 1
+                return None
+            self._cache.move_to_end(query)
+            self._cache_hits += 1
+            return embedding
+
+    def _cache_put(self, query: str, embedding: List[float]):
+        if self._cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[query] = embedding
+            self._cache.move_to_end(query)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _get_encode_pool(self):
+        """Start the multi-process encoding pool on first use"""
+        if self._encode_pool is None:
+            devices = ["cpu"] * settings.embedding_workers
+            self._encode_pool = self.model.start_multi_process_pool(target_devices=devices)
+            logger.info(f"Started embedding pool with {settings.embedding_workers} workers")
+        return self._encode_pool
+
+
+embedding_service = EmbeddingService()
@@ -0,0 +1,247 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+from loguru import logger
+from config.settings import settings
+from services import metrics
+from services.metrics import track
+
+
+# Feishu business codes: app rate limit hit, and tenant token invalid or expired
+RATE_LIMIT_CODES = {99991400}
+TOKEN_INVALID_CODES = {99991661, 99991663, 99991668}
+
+# Seconds until the rate-limit window resets: Feishu's gateway header, then the standard one
+RESET_HEADERS = ("x-ogw-ratelimit-reset", "retry-after")
+
+
+class OutboundQueueFull(Exception):
+    """Raised when the outbound queue stays full for longer than FEISHU_ENQUEUE_TIMEOUT_SECONDS"""
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by the senders of one event loop"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for a token; waiters are served in arrival order"""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hold every sender back until the server's rate-limit window resets"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # Empty, and refilling only from the end of the pause: the window earns no credit
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+
+def _reset_seconds(response: httpx.Response) -> Optional[float]:
+    for header in RESET_HEADERS:
+        value = response.headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            continue  # Retry-After may also be an HTTP date
+    return None
+
+
+def _json(response: httpx.Response) -> Dict[str, Any]:
+    try:
+        body = response.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+class FeishuDispatcher:
+    """Bounded outbound queue for Feishu API calls, drained by a fixed set of senders
+
+    Senders share one token bucket sized to this process's share of the app's
+    Feishu quota (split between gunicorn workers in multi-worker mode). Throttled
+    calls (HTTP 429 or code 99991400), 5xx responses and connection errors
+    are retried with jittered exponential backoff, never sooner than the
+    server's rate-limit reset header asks. An invalid tenant token is
+    refreshed once. Callers await the JSON result of their own call.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, str, Dict[str, Any]], Awaitable[httpx.Response]],
+        on_token_invalid: Callable[[], None]
+    ):
+        self._send = send
+        self._on_token_invalid = on_token_invalid
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._bucket: Optional[TokenBucket] = None
+        self._workers: List[asyncio.Task] = []
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._rejected = 0
+
+    def _ensure_started(self):
+        # Queue, bucket and senders belong to the loop that first uses them
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=max(1, settings.feishu_outbound_queue_size))
+        self._bucket = TokenBucket(*self._quota_share())
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(max(1, settings.feishu_outbound_workers))
+        ]
+
+    @staticmethod
+    def _quota_share() -> Tuple[float, int]:
+        """(rate, burst) for this process: the app-wide quota split evenly between gunicorn workers"""
+        rate = settings.feishu_rate_limit_per_second
+        burst = settings.feishu_rate_limit_burst
+        if settings.multi_worker:
+            workers = max(1, settings.web_concurrency)
+            rate, burst = rate / workers, max(1, burst // workers)
+        return rate, burst
+
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, method: str, url: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a call and wait for its JSON result"""
+        self._ensure_started()
+        future = self._loop.create_future()
+        try:
+            await asyncio.wait_for(
+                self._queue.put((method, url, data, future, time.perf_counter())),
+                settings.feishu_enqueue_timeout_seconds
+            )
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            raise OutboundQueueFull(f"Feishu outbound queue is full ({self._queue.maxsize} calls)")
+        return await future
+
+    async def _worker(self):
+        while True:
+            method, url, data, future, queued_at = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue  # the caller gave up while the call was queued
+                metrics.stage_duration.observe(time.perf_counter() - queued_at, stage="feishu_queue_wait")
+                try:
+                    result = await self._deliver(method, url, data)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    self._failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self._sent += 1
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, method: str, url: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        attempt = 0
+        token_refreshed = False
+        while True:
+            await self._bucket.acquire()
+            response = None
+            error: Optional[Exception] = None
+            reset = None
+            try:
+                with track("feishu_http"):
+                    response = await self._send(method, url, data)
+            except httpx.TransportError as e:
+                reason, error = "connection", e
+            else:
+                body = _json(response)
+                if response.status_code == 429 or body.get("code") in RATE_LIMIT_CODES:
+                    reason = "rate_limited"
+                    reset = _reset_seconds(response)
+                    if reset:
+                        self._bucket.pause(reset)
+                elif response.status_code >= 500:
+                    reason = "server_error"
+                elif body.get("code") in TOKEN_INVALID_CODES and not token_refreshed:
+                    # Not counted as an attempt: the next call fetches a fresh token
+                    token_refreshed = True
+                    self._on_token_invalid()
+                    continue
+                else:
+                    response.raise_for_status()
+                    return body
+
+            if attempt >= settings.feishu_max_retries:
+                if error is not None:
+                    raise error
+                response.raise_for_status()
+                return _json(response)  # 200 with a throttling code: the caller logs it
+
+            backoff = min(settings.feishu_retry_max_seconds, settings.feishu_retry_base_seconds * 2 ** attempt)
+            delay = random.uniform(0, backoff)
+            if reset is not None:
+                delay = max(delay, reset + random.uniform(0, settings.feishu_retry_base_seconds))
+            attempt += 1
+            self._retries += 1
+            metrics.feishu_retries.inc(reason=reason)
+            logger.warning(f"Feishu {method} {url} {reason}; retry {attempt}/{settings.feishu_max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def stop(self, timeout: float = 5.0):
+        """Let queued calls drain for up to timeout seconds, then stop the senders"""
+        if not self._workers or self._loop is not asyncio.get_running_loop():
+            self._workers = []
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self._queue.qsize()} queued Feishu calls on shutdown")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while not self._queue.empty():
+            future = self._queue.get_nowait()[3]
+            if not future.done():
+                future.set_exception(RuntimeError("Feishu dispatcher stopped"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue_size(),
+            "workers": len(self._workers),
+            "sent": self._sent,
+            "failed": self._failed,
+            "retries": self._retries,
+            "rejected": self._rejected,
+            "paused_seconds": round(self._bucket.paused_for, 3) if self._bucket else 0.0
+        }
@@ -1,10 +1,149 @@
+import asyncio
 import json
 import hashlib
 import base64
+import time
+import uuid
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, Any, Optional
 from loguru import logger
 from config.settings import settings
+from services.feishu_dispatcher import FeishuDispatcher
+from services.metrics import track
+from services.shared_state import shared_state
+
+
+FEISHU_API_BASE = settings.feishu_api_base.rstrip("/")
+
+# Shared-state key for the tenant token in multi-worker mode
+TOKEN_STATE_KEY = "feishu:tenant_access_token"
+
+
+class TenantToken:
+    """Cached tenant access token, shared with other worker processes in multi-worker mode
+    
+    Holds no client, so the sync and async services each own one and make
+    the token request with their own transport.
+    """
+    
+    def __init__(self):
+        self.value: Optional[str] = None
+        self.expiry = 0
+        self.rejected: Optional[str] = None
+    
+    def valid(self) -> bool:
+        return bool(self.value) and time.time() < self.expiry
+    
+    def load_shared(self) -> bool:
+        """Adopt a token another worker process stored; True if it is still valid"""
+        shared = shared_state.get(TOKEN_STATE_KEY)
+        if shared and shared["token"] != self.rejected:
+            self.value = shared["token"]
+            self.expiry = shared["expiry"]
+        return self.valid()
+    
+    def store(self, result: Dict[str, Any]) -> str:
+        if result.get("code") == 0:
+            self.value = result["tenant_access_token"]
+            self.expiry = time.time() + result["expire"] - 60  # Refresh 1 min early
+            if settings.multi_worker:
+                shared_state.set(
+                    TOKEN_STATE_KEY,
+                    {"token": self.value, "expiry": self.expiry},
+                    ttl=result["expire"]
+                )
+            return self.value
+        else:
+            logger.error(f"Failed to get access token: {result}")
+            raise Exception("Failed to get access token")
+    
+    def invalidate(self):
+        """Drop the cached token so the next call fetches a new one
+        
+        In multi-worker mode the shared copy goes too, unless another worker
+        has already replaced it; the rejected token is never adopted again.
+        """
+        rejected, self.value = self.value, None
+        self.expiry = 0
+        if rejected:
+            self.rejected = rejected
+        if settings.multi_worker and rejected:
+            shared = shared_state.get(TOKEN_STATE_KEY)
+            if shared and shared["token"] == rejected:
+                shared_state.delete(TOKEN_STATE_KEY)
+
+
+def token_request() -> Dict[str, str]:
+    return {
+        "app_id": settings.feishu_app_id,
+        "app_secret": settings.feishu_app_secret
+    }
+
+
+def dedup_id() -> str:
+    """Idempotency key: Feishu delivers a message once per uuid, so retries cannot duplicate it"""
+    return uuid.uuid4().hex
+
+
+def encode_content(content: Any, msg_type: str) -> str:
+    """Serialize message content for the Feishu messages API"""
+    if msg_type == "text":
+        return json.dumps({"text": content})
+    elif msg_type == "interactive" and isinstance(content, dict) and "card" in content:
+        # Flatten the create_interactive_card() shape into a card body
+        return json.dumps({**content["card"], "header": content["header"]})
+    elif not isinstance(content, str):
+        return json.dumps(content)
+    return content
+
+
+def create_interactive_card(title: str, content: str, buttons: Optional[list] = None) -> Dict[str, Any]:
+    """Create an interactive card message"""
+    card = {
+        "config": {
+            "wide_screen_mode": True
+        },
+        "elements": [
+            {
+                "tag": "div",
+                "text": {
+                    "tag": "lark_md",
+                    "content": content
+                }
+            }
+        ]
+    }
+    
+    if buttons:
+        button_elements = []
+        for button in buttons:
+            button_elements.append({
+                "tag": "button",
+                "text": {
+                    "tag": "plain_text",
+                    "content": button["text"]
+                },
+                "type": button.get("type", "default"),
+                "value": button.get("value", {})
+            })
+        
+        card["elements"].append({
+            "tag": "action",
+            "actions": button_elements
+        })
+    
+    return {
+        "header": {
+            "title": {
+                "tag": "plain_text",
+                "content": title
+            }
+        },
+        "card": card
+    }
 
 
 class FeishuService:
@@ -13,8 +152,40 @@ class FeishuService:
         self.app_secret = settings.feishu_app_secret
         self.verification_token = settings.feishu_verification_token
         self.encrypt_key = settings.feishu_encrypt_key
-        self._access_token = None
-        self._token_expiry = 0
+        self.token = TenantToken()
+        self._session: Optional[requests.Session] = None
+    
+    @property
+    def session(self) -> requests.Session:
+        """Keep-alive session; failed connections and idempotent requests are retried
+        
+        Only urllib3's default idempotent methods are retried on 429/5xx, so
+        POSTs (token, send, reply) are made once here. Retrying message calls
+        is the job of the FeishuDispatcher behind AsyncFeishuService, which
+        the app uses; a second retry layer would multiply attempts.
+        """
+        if self._session is None:
+            retry = Retry(
+                total=settings.feishu_max_retries,
+                backoff_factor=settings.feishu_retry_base_seconds,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.feishu_max_connections,
+                max_retries=retry
+            )
+            self._session = requests.Session()
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+    
+    def invalidate_token(self):
+        """Drop the cached tenant token so the next call fetches a new one"""
+        self.token.invalidate()
     
     def verify_request(self, timestamp: str, nonce: str, signature: str, body: bytes) -> bool:
         """Verify Feishu webhook request"""
@@ -35,61 +206,51 @@ class FeishuService:
     
     def get_access_token(self) -> str:
         """Get Feishu access token"""
-        import time
-        
         # Check if token is still valid
-        if self._access_token and time.time() < self._token_expiry:
-            return self._access_token
+        if self.token.valid():
+            return self.token.value
         
-        # Request new token
-        url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
-        headers = {"Content-Type": "application/json"}
-        data = {
-            "app_id": self.app_id,
-            "app_secret": self.app_secret
-        }
+        if not settings.multi_worker:
+            return self._request_token()
         
+        # One worker process refreshes; the others pick up its token
+        with shared_state.lock("feishu_token"):
+            if self.token.load_shared():
+                return self.token.value
+            return self._request_token()
+    
+    def _request_token(self) -> str:
         try:
-            response = requests.post(url, headers=headers, json=data)
+            response = self.session.post(
+                f"{FEISHU_API_BASE}/auth/v3/tenant_access_token/internal",
+                headers={"Content-Type": "application/json"},
+                json=token_request()
+            )
             response.raise_for_status()
-            result = response.json()
-            
-            if result.get("code") == 0:
-                self._access_token = result["tenant_access_token"]
-                self._token_expiry = time.time() + result["expire"] - 60  # Refresh 1 min early
-                return self._access_token
-            else:
-                logger.error(f"Failed to get access token: {result}")
-                raise Exception("Failed to get access token")
+            return self.token.store(response.json())
         except Exception as e:
             logger.error(f"Error getting access token: {e}")
             raise
     
     def send_message(self, receive_id: str, content: str, msg_type: str = "text", receive_id_type: str = "open_id"):
         """Send message to Feishu user or chat"""
-        url = f"https://open.feishu.cn/open-apis/im/v1/messages?receive_id_type={receive_id_type}"
+        url = f"{FEISHU_API_BASE}/im/v1/messages?receive_id_type={receive_id_type}"
         
         headers = {
             "Authorization": f"Bearer {self.get_access_token()}",
             "Content-Type": "application/json"
         }
         
-        # Prepare message content based on type
-        if msg_type == "text":
-            content_data = json.dumps({"text": content})
-        elif msg_type == "interactive":
-            content_data = json.dumps(content)
-        else:
-            content_data = content
-        
         data = {
             "receive_id": receive_id,
             "msg_type": msg_type,
-            "content": content_data
+            "content": encode_content(content, msg_type),
+            "uuid": dedup_id()
         }
         
         try:
-            response = requests.post(url, headers=headers, json=data)
+            with track("feishu_send"):
+                response = self.session.post(url, headers=headers, json=data)
             response.raise_for_status()
             result = response.json()
             
@@ -105,26 +266,22 @@ class FeishuService:
     
     def reply_message(self, message_id: str, content: str, msg_type: str = "text"):
         """Reply to a specific message"""
-        url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/reply"
+        url = f"{FEISHU_API_BASE}/im/v1/messages/{message_id}/reply"
         
         headers = {
             "Authorization": f"Bearer {self.get_access_token()}",
             "Content-Type": "application/json"
         }
         
-        # Prepare message content
-        if msg_type == "text":
-            content_data = json.dumps({"text": content})
-        else:
-            content_data = content
-        
         data = {
             "msg_type": msg_type,
-            "content": content_data
+            "content": encode_content(content, msg_type),
+            "uuid": dedup_id()
         }
         
         try:
-            response = requests.post(url, headers=headers, json=data)
+            with track("feishu_reply"):
+                response = self.session.post(url, headers=headers, json=data)
             response.raise_for_status()
             result = response.json()
             
@@ -140,48 +297,163 @@ class FeishuService:
     
     def create_interactive_card(self, title: str, content: str, buttons: Optional[list] = None) -> Dict[str, Any]:
         """Create an interactive card message"""
-        card = {
-            "config": {
-                "wide_screen_mode": True
-            },
-            "elements": [
-                {
-                    "tag": "div",
-                    "text": {
-                        "tag": "lark_md",
-                        "content": content
-                    }
-                }
-            ]
-        }
+        return create_interactive_card(title, content, buttons)
+
+
+class AsyncFeishuService:
+    """Non-blocking Feishu client on a pooled keep-alive httpx.AsyncClient
+    
+    Message calls go through a FeishuDispatcher: a bounded queue drained at
+    the app's rate limit, with retries. Independent of FeishuService, so
+    every API call here is a coroutine; both share TenantToken and the
+    message helpers above.
+    """
+    
+    def __init__(self):
+        self.token = TenantToken()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._token_lock: Optional[asyncio.Lock] = None
+        self.dispatcher = FeishuDispatcher(self._send, self.invalidate_token)
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=settings.feishu_timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=settings.feishu_max_connections,
+                    max_keepalive_connections=settings.feishu_max_connections
+                )
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Drain queued calls, then close pooled connections"""
+        await self.dispatcher.stop()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def invalidate_token(self):
+        """Drop the cached tenant token so the next call fetches a new one"""
+        self.token.invalidate()
+    
+    def create_interactive_card(self, title: str, content: str, buttons: Optional[list] = None) -> Dict[str, Any]:
+        """Create an interactive card message"""
+        return create_interactive_card(title, content, buttons)
+    
+    async def get_access_token(self) -> str:
+        """Get Feishu access token"""
+        if self.token.valid():
+            return self.token.value
+        
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
         
-        if buttons:
-            button_elements = []
-            for button in buttons:
-                button_elements.append({
-                    "tag": "button",
-                    "text": {
-                        "tag": "plain_text",
-                        "content": button["text"]
-                    },
-                    "type": button.get("type", "default"),
-                    "value": button.get("value", {})
-                })
+        # Only one coroutine refreshes; the rest reuse its token
+        async with self._token_lock:
+            if self.token.valid():
+                return self.token.value
+            if not settings.multi_worker:
+                return await self._arequest_token()
             
-            card["elements"].append({
-                "tag": "action",
-                "actions": button_elements
-            })
+            # ...and only one worker process, holding the host-wide lock
+            lock = shared_state.lock("feishu_token")
+            await asyncio.to_thread(lock.acquire)
+            try:
+                if await asyncio.to_thread(self.token.load_shared):
+                    return self.token.value
+                return await self._arequest_token()
+            finally:
+                lock.release()
+    
+    async def _arequest_token(self) -> str:
+        try:
+            with track("feishu_token"):
+                response = await self.client.post(
+                    f"{FEISHU_API_BASE}/auth/v3/tenant_access_token/internal",
+                    json=token_request()
+                )
+            response.raise_for_status()
+            return self.token.store(response.json())
+        except Exception as e:
+            logger.error(f"Error getting access token: {e}")
+            raise
+    
+    async def send_message(self, receive_id: str, content: str, msg_type: str = "text", receive_id_type: str = "open_id"):
+        """Send message to Feishu user or chat"""
+        data = {
+            "receive_id": receive_id,
+            "msg_type": msg_type,
+            "content": encode_content(content, msg_type),
+            "uuid": dedup_id()
+        }
         
-        return {
-            "header": {
-                "title": {
-                    "tag": "plain_text",
-                    "content": title
-                }
-            },
-            "card": card
+        try:
+            with track("feishu_send"):
+                result = await self._post(
+                    f"{FEISHU_API_BASE}/im/v1/messages?receive_id_type={receive_id_type}", data
+                )
+            
+            if result.get("code") != 0:
+                logger.error(f"Failed to send message: {result}")
+            else:
+                logger.info(f"Message sent successfully to {receive_id}")
+            
+            return result
+        except Exception as e:
+            logger.error(f"Error sending message: {e}")
+            raise
+    
+    async def reply_message(self, message_id: str, content: str, msg_type: str = "text"):
+        """Reply to a specific message"""
+        data = {
+            "msg_type": msg_type,
+            "content": encode_content(content, msg_type),
+            "uuid": dedup_id()
         }
+        
+        try:
+            with track("feishu_reply"):
+                result = await self._post(f"{FEISHU_API_BASE}/im/v1/messages/{message_id}/reply", data)
+            
+            if result.get("code") != 0:
+                logger.error(f"Failed to reply message: {result}")
+            else:
+                logger.info(f"Reply sent successfully to message {message_id}")
+            
+            return result
+        except Exception as e:
+            logger.error(f"Error replying to message: {e}")
+            raise
+    
+    async def update_card(self, message_id: str, card: Dict[str, Any]):
+        """Replace the content of an interactive card message already sent"""
+        data = {"content": encode_content(card, "interactive")}
+        
+        try:
+            with track("feishu_update_card"):
+                result = await self._request("PATCH", f"{FEISHU_API_BASE}/im/v1/messages/{message_id}", data)
+            
+            if result.get("code") != 0:
+                logger.error(f"Failed to update card: {result}")
+            
+            return result
+        except Exception as e:
+            logger.error(f"Error updating card: {e}")
+            raise
+    
+    async def _post(self, url: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._request("POST", url, data)
+    
+    async def _request(self, method: str, url: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.dispatcher.submit(method, url, data)
+    
+    async def _send(self, method: str, url: str, data: Dict[str, Any]) -> httpx.Response:
+        """One HTTP attempt, made by a dispatcher sender"""
+        headers = {"Authorization": f"Bearer {await self.get_access_token()}"}
+        return await self.client.request(method, url, headers=headers, json=data)
 
 
-feishu_service = FeishuService()
\ No newline at end of file
+feishu_service = FeishuService()
+async_feishu_service = AsyncFeishuService()
\ No newline at end of file
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List
+from loguru import logger
+from config.settings import settings
+from services.rag_service import rag_service
+from services.shared_state import worker_role
+
+
+INGESTION_STAGES = ["extract", "embed", "index", "summarize"]
+
+# How often the writer deletes finished jobs past INGESTION_JOB_RETENTION_SECONDS
+PRUNE_INTERVAL_SECONDS = 600
+
+
+class IngestionService:
+    """Background PDF ingestion with an on-disk job queue"""
+
+    def __init__(self):
+        self.jobs_path = settings.ingestion_jobs_path
+        self.num_workers = max(1, settings.ingestion_workers)
+        os.makedirs(self.jobs_path, exist_ok=True)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._known_job_files = set()
+        self._last_prune = 0.0
+
+    @property
+    def is_writer(self) -> bool:
+        """Whether this process runs ingestion jobs (always, unless in multi-worker mode)"""
+        return worker_role.is_writer
+
+    async def start(self):
+        """Start worker pool and re-enqueue unfinished jobs from disk
+
+        Only the process holding the writer role runs jobs; the others
+        write queued jobs to disk for it to pick up, and take over the
+        role if the writer exits (a single server waits this way while
+        bulk_ingest.py holds it).
+        """
+        if worker_role.try_acquire():
+            self._start_workers()
+        if settings.multi_worker or not self._workers:
+            self._poller = asyncio.create_task(self._poll_jobs())
+
+    def _start_workers(self):
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.num_workers, thread_name_prefix="ingest"
+        )
+
+        for job in self._load_unfinished_jobs():
+            self._queue.put_nowait(job["job_id"])
+            logger.info(f"Resuming ingestion job {job['job_id']} for {job['filename']}")
+
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+        logger.info(f"Started {self.num_workers} ingestion workers")
+
+    async def stop(self):
+        """Stop workers; unfinished jobs stay on disk and resume on next start"""
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        worker_role.release()
+
+    def submit(self, file_id: str, filename: str, replaces: Optional[str] = None) -> Dict[str, Any]:
+        """Create a job for an already saved PDF and queue it"""
+        return self._submit("ingest", file_id, filename, replaces=replaces)
+
+    def submit_delete(self, file_id: str) -> Dict[str, Any]:
+        """Queue a document deletion for the writer process"""
+        return self._submit("delete", file_id, "")
+
+    def _submit(self, kind: str, file_id: str, filename: str, replaces: Optional[str] = None) -> Dict[str, Any]:
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "file_id": file_id,
+            "filename": filename,
+            "replaces": replaces,
+            "status": "queued",
+            "stages": self._initial_stages(kind),
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+
+        if not self.is_writer:
+            # The writer process picks the job up from disk
+            self._persist(job)
+            logger.info(f"Queued {kind} job {job['job_id']} for the ingestion writer")
+            return dict(job)
+
+        with self._lock:
+            self._jobs[job["job_id"]] = job
+            self._persist(job)
+            self._known_job_files.add(f"{job['job_id']}.json")
+
+        if self._queue is None:
+            raise RuntimeError("Ingestion service is not running")
+        self._queue.put_nowait(job["job_id"])
+
+        logger.info(f"Queued {kind} job {job['job_id']} for {filename or file_id}")
+        return dict(job)
+
+    async def wait_for(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Poll a job until it completes or fails; returns its last state"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get_job(job_id)
+            if job is None or job["status"] in ("completed", "failed") or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(min(0.2, settings.shared_state_poll_seconds))
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the current state of a job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._read(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def queue_size(self) -> int:
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize() if self._queue else 0
+
+    async def _poll_jobs(self):
+        """Take over the writer role when it frees, or pick up jobs other workers queued"""
+        while True:
+            await asyncio.sleep(settings.shared_state_poll_seconds)
+            try:
+                if not self._workers:
+                    if worker_role.try_acquire():
+                        self._start_workers()
+                    continue
+                for job in await asyncio.to_thread(self._load_new_jobs):
+                    self._queue.put_nowait(job["job_id"])
+            except Exception as e:
+                logger.error(f"Error polling ingestion jobs: {e}")
+
+    async def _worker(self, worker_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await loop.run_in_executor(self._executor, self._run_job, job_id)
+            except Exception as e:
+                logger.error(f"Ingestion worker {worker_id} failed on job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+            if time.monotonic() - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+                self._last_prune = time.monotonic()
+                await asyncio.to_thread(self.prune_finished_jobs)
+
+    def prune_finished_jobs(self) -> int:
+        """Forget completed and failed jobs older than the retention period and delete their files"""
+        retention = settings.ingestion_job_retention_seconds
+        if retention <= 0:
+            return 0
+        cutoff = time.time() - retention
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["status"] in ("completed", "failed") and job["updated_at"] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+                self._remove_job_file(job_id)
+        if expired:
+            logger.info(f"Removed {len(expired)} finished ingestion jobs")
+        return len(expired)
+
+    def _run_job(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = "running"
+            job["stages"] = self._initial_stages(job.get("kind", "ingest"))
+            self._touch(job)
+
+        if job.get("kind") == "delete":
+            self._run_delete(job)
+            return
+
+        def progress(stage: str, fraction: float):
+            # Stages overlap: embedding starts while extraction is still running
+            with self._lock:
+                state = job["stages"][stage]
+                state["progress"] = round(min(max(fraction, 0.0), 1.0), 4)
+                state["status"] = "done" if fraction >= 1.0 else "running"
+                self._touch(job)
+
+        try:
+            _, result = rag_service.ingest_pdf(
+                job["file_id"], job["filename"], progress=progress, replaces=job.get("replaces")
+            )
+            with self._lock:
+                job["status"] = "completed"
+                job["result"] = result
+                for state in job["stages"].values():
+                    state["status"] = "done"
+                    state["progress"] = 1.0
+                self._touch(job)
+            logger.info(f"Ingestion job {job_id} completed")
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}")
+            with self._lock:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                self._touch(job)
+
+    def _run_delete(self, job: Dict[str, Any]):
+        try:
+            rag_service.delete_document(job["file_id"])
+            with self._lock:
+                job["status"] = "completed"
+                self._touch(job)
+            logger.info(f"Delete job {job['job_id']} completed")
+        except Exception as e:
+            logger.error(f"Delete job {job['job_id']} failed: {e}")
+            with self._lock:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                self._touch(job)
+
+    def _initial_stages(self, kind: str = "ingest") -> Dict[str, Dict[str, Any]]:
+        if kind != "ingest":
+            return {}
+        return {name: {"status": "pending", "progress": 0.0} for name in INGESTION_STAGES}
+
+    def _touch(self, job: Dict[str, Any]):
+        job["updated_at"] = time.time()
+        self._persist(job)
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_path, f"{job_id}.json")
+
+    def _persist(self, job: Dict[str, Any]):
+        """Atomically write job state to disk"""
+        path = self._job_path(job["job_id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _remove_job_file(self, job_id: str):
+        self._known_job_files.discard(f"{job_id}.json")
+        try:
+            os.remove(self._job_path(job_id))
+        except OSError:
+            pass
+
+    def _read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        path = self._job_path(job_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading ingestion job {job_id}: {e}")
+            return None
+
+    def _load_unfinished_jobs(self) -> List[Dict[str, Any]]:
+        """Jobs to resume; finished jobs past the retention period are deleted on the way
+
+        Recent finished jobs, e.g. left by an earlier writer process, are
+        loaded too so prune_finished_jobs() deletes them when they expire.
+        """
+        retention = settings.ingestion_job_retention_seconds
+        cutoff = time.time() - retention
+        jobs = []
+        finished = []
+        for name in os.listdir(self.jobs_path):
+            if not name.endswith(".json"):
+                continue
+            self._known_job_files.add(name)
+            job = self._read(name[:-len(".json")])
+            if job and job.get("status") in ("queued", "running"):
+                job["status"] = "queued"
+                job["stages"] = self._initial_stages(job.get("kind", "ingest"))
+                jobs.append(job)
+            elif job and retention > 0 and job.get("updated_at", 0) < cutoff:
+                self._remove_job_file(job["job_id"])
+            elif job:
+                finished.append(job)
+
+        jobs.sort(key=lambda j: j.get("created_at", 0))
+        with self._lock:
+            for job in finished:
+                self._jobs.setdefault(job["job_id"], job)
+            for job in jobs:
+                self._jobs[job["job_id"]] = job
+                self._persist(job)
+        return jobs
+
+    def _load_new_jobs(self) -> List[Dict[str, Any]]:
+        """Queued jobs that other worker processes wrote since the last scan"""
+        jobs = []
+        for name in os.listdir(self.jobs_path):
+            if not name.endswith(".json") or name in self._known_job_files:
+                continue
+            self._known_job_files.add(name)
+            job = self._read(name[:-len(".json")])
+            if job and job.get("status") == "queued":
+                jobs.append(job)
+
+        jobs.sort(key=lambda j: j.get("created_at", 0))
+        with self._lock:
+            for job in jobs:
+                self._jobs[job["job_id"]] = job
+        return jobs
+
+
+ingestion_service = IngestionService()
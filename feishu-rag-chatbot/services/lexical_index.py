@@ -0,0 +1,219 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+from loguru import logger
+from config.settings import settings
+from services.cjk import CJK_CHARS
+
+
+# Membership in a list bound as one JSON parameter, so scopes of any size stay under SQLite's parameter limit
+IN_JSON_LIST = "(SELECT value FROM json_each(?))"
+
+# Latin words/identifiers (keeping "ERR-1042", "v2.1", "SKU_778" whole) and CJK runs
+_TOKEN_RE = re.compile(rf"[A-Za-z0-9]+(?:[-_./][A-Za-z0-9]+)*|[{CJK_CHARS}]+")
+_CJK_RE = re.compile(rf"[{CJK_CHARS}]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; CJK runs become overlapping character bigrams"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group(0)
+        if _CJK_RE.match(token):
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            token = token.lower()
+            tokens.append(token)
+            # Also index the parts of compound identifiers
+            parts = re.split(r"[-_./]", token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class LexicalIndex:
+    """On-disk BM25 inverted index stored in SQLite next to the vector collection"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.db_path = settings.lexical_index_path
+        self.k1 = k1
+        self.b = b
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS docs (
+                    doc_id INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    file_id TEXT NOT NULL,
+                    length INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_docs_file_id ON docs (file_id);
+                CREATE TABLE IF NOT EXISTS terms (
+                    term_id INTEGER PRIMARY KEY,
+                    term TEXT NOT NULL UNIQUE,
+                    df INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term_id INTEGER NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term_id, doc_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_postings_doc_id ON postings (doc_id);
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def add(self, chunks: Iterable[Tuple[str, str, str]]):
+        """Index (chunk_id, file_id, text) triples, replacing existing chunk ids"""
+        with self._write_lock, self._connect() as conn:
+            for chunk_id, file_id, text in chunks:
+                self._remove_docs(conn, "SELECT doc_id FROM docs WHERE chunk_id = ?", (chunk_id,))
+
+                term_freqs = Counter(tokenize(text))
+                cursor = conn.execute(
+                    "INSERT INTO docs (chunk_id, file_id, length) VALUES (?, ?, ?)",
+                    (chunk_id, file_id, sum(term_freqs.values()))
+                )
+                doc_id = cursor.lastrowid
+                if not term_freqs:
+                    continue
+
+                conn.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, 1) "
+                    "ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in term_freqs]
+                )
+                term_ids = self._term_ids(conn, list(term_freqs))
+                conn.executemany(
+                    "INSERT INTO postings (term_id, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term_ids[term], doc_id, tf) for term, tf in term_freqs.items()]
+                )
+
+    def delete_file(self, file_id: str):
+        """Remove every chunk of a file from the index"""
+        with self._write_lock, self._connect() as conn:
+            self._remove_docs(conn, "SELECT doc_id FROM docs WHERE file_id = ?", (file_id,))
+
+    def count(self) -> int:
+        """Number of indexed chunks"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def chunk_ids(self, file_ids: List[str]) -> List[str]:
+        """Chunk ids of the given files, via the file_id index"""
+        if not file_ids:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT chunk_id FROM docs WHERE file_id IN {IN_JSON_LIST}", (json.dumps(list(file_ids)),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count_files(self, file_ids: List[str]) -> int:
+        """Number of indexed chunks belonging to the given files"""
+        if not file_ids:
+            return 0
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT COUNT(*) FROM docs WHERE file_id IN {IN_JSON_LIST}", (json.dumps(list(file_ids)),)
+            ).fetchone()[0]
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        file_ids: Optional[List[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """BM25 search; returns (chunk_id, score) best first"""
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms:
+            return []
+
+        with self._connect() as conn:
+            num_docs, total_length = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs"
+            ).fetchone()
+            if num_docs == 0:
+                return []
+            avg_length = total_length / num_docs
+
+            placeholders = ",".join("?" * len(query_terms))
+            terms = conn.execute(
+                f"SELECT term_id, df FROM terms WHERE term IN ({placeholders}) AND df > 0",
+                query_terms
+            ).fetchall()
+
+            file_filter = ""
+            file_params: List[str] = []
+            if file_ids:
+                file_filter = f" AND d.file_id IN {IN_JSON_LIST}"
+                file_params = [json.dumps(list(file_ids))]
+
+            scores: Dict[str, float] = {}
+            for term_id, df in terms:
+                idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+                rows = conn.execute(
+                    "SELECT d.chunk_id, p.tf, d.length FROM postings p "
+                    "JOIN docs d ON d.doc_id = p.doc_id "
+                    f"WHERE p.term_id = ?{file_filter}",
+                    [term_id] + file_params
+                )
+                for chunk_id, tf, length in rows:
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
+
+    def _term_ids(self, conn: sqlite3.Connection, terms: List[str]) -> Dict[str, int]:
+        term_ids = {}
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(terms), 500):
+            batch = terms[i:i + 500]
+            rows = conn.execute(
+                f"SELECT term, term_id FROM terms WHERE term IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            term_ids.update(rows)
+        return term_ids
+
+    def _remove_docs(self, conn: sqlite3.Connection, doc_query: str, params: Tuple):
+        doc_ids = [row[0] for row in conn.execute(doc_query, params)]
+        if not doc_ids:
+            return
+        for i in range(0, len(doc_ids), 500):
+            batch = doc_ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            conn.execute(
+                "UPDATE terms SET df = df - ("
+                f"  SELECT COUNT(*) FROM postings p WHERE p.term_id = terms.term_id AND p.doc_id IN ({placeholders})"
+                f") WHERE term_id IN (SELECT term_id FROM postings WHERE doc_id IN ({placeholders}))",
+                batch + batch
+            )
+            conn.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", batch)
+            conn.execute(f"DELETE FROM docs WHERE doc_id IN ({placeholders})", batch)
+        logger.debug(f"Removed {len(doc_ids)} chunks from lexical index")
+
+
+lexical_index = LexicalIndex()
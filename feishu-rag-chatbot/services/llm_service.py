@@ -1,7 +1,71 @@
+import time
+import httpx
 import openai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 from loguru import logger
 from config.settings import settings
+from services.context_builder import context_builder, count_message_tokens
+from services.metrics import track, record_usage, stage_duration, llm_tokens
+
+
+# Shown instead of an answer when the LLM call fails; never cached
+ERROR_RESPONSE = "I'm sorry, I encountered an error while processing your request. Please try again."
+
+
+def prepare_prompt(
+    query: str,
+    context: List[Dict[str, Any]],
+    chat_history: Optional[List[Dict[str, str]]],
+    model: str
+) -> Dict[str, Any]:
+    """Build the chat messages for a RAG answer within the token budget
+    
+    Returns the messages, the context items actually packed into the
+    prompt and a usage dict with token counts. Shared by the sync and
+    async LLM services.
+    """
+    packed_context, usage = context_builder.pack_context(context)
+    history, history_tokens = context_builder.pack_history(chat_history)
+    
+    # Prepare messages
+    messages = [
+        {
+            "role": "system",
+            "content": """You are a helpful assistant that answers questions based on the provided context.
+            If the context contains relevant information, use it to answer the question.
+            If the context doesn't contain enough information, say so.
+            Always cite the source (filename and page number) when using information from the context."""
+        }
+    ]
+    
+    # Add chat history that fits the history budget
+    messages.extend(history)
+    
+    # Add current query with context
+    context_text = _prepare_context(packed_context)
+    user_message = f"Context:\n{context_text}\n\nQuestion: {query}"
+    messages.append({"role": "user", "content": user_message})
+    
+    usage["history_tokens"] = history_tokens
+    usage["history_messages"] = len(history)
+    usage["prompt_tokens"] = count_message_tokens(messages, model)
+    
+    return {"messages": messages, "context": packed_context, "usage": usage}
+
+
+def _prepare_context(context: List[Dict[str, Any]]) -> str:
+    """Prepare context text from search results"""
+    if not context:
+        return "No relevant context found."
+    
+    context_parts = []
+    for i, item in enumerate(context):
+        text = item.get("text", "")
+        context_parts.append(
+            f"{context_builder.format_header(i + 1, item)}{text}\n"
+        )
+    
+    return "\n".join(context_parts)
 
 
 class LLMService:
@@ -16,60 +80,30 @@ class LLMService:
         chat_history: Optional[List[Dict[str, str]]] = None
     ) -> str:
         """Generate response using LLM with context"""
-        
-        # Prepare context from search results
-        context_text = self._prepare_context(context)
-        
-        # Prepare messages
-        messages = [
-            {
-                "role": "system",
-                "content": """You are a helpful assistant that answers questions based on the provided context.
-                If the context contains relevant information, use it to answer the question.
-                If the context doesn't contain enough information, say so.
-                Always cite the source (filename and page number) when using information from the context."""
-            }
-        ]
-        
-        # Add chat history if available
-        if chat_history:
-            for msg in chat_history[-5:]:  # Last 5 messages for context
-                messages.append(msg)
-        
-        # Add current query with context
-        user_message = f"Context:\n{context_text}\n\nQuestion: {query}"
-        messages.append({"role": "user", "content": user_message})
+        prompt = self.prepare_prompt(query, context, chat_history)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
-            )
+            with track("llm"):
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=prompt["messages"],
+                    temperature=0.7,
+                    max_tokens=settings.llm_max_completion_tokens
+                )
             
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"Error generating LLM response: {e}")
-            return "I'm sorry, I encountered an error while processing your request. Please try again."
+            return ERROR_RESPONSE
     
-    def _prepare_context(self, context: List[Dict[str, Any]]) -> str:
-        """Prepare context text from search results"""
-        if not context:
-            return "No relevant context found."
-        
-        context_parts = []
-        for i, item in enumerate(context):
-            metadata = item.get("metadata", {})
-            text = item.get("text", "")
-            filename = metadata.get("filename", "Unknown")
-            page = metadata.get("page", "Unknown")
-            
-            context_parts.append(
-                f"[Source {i+1}: {filename}, Page {page}]\n{text}\n"
-            )
-        
-        return "\n".join(context_parts)
+    def prepare_prompt(
+        self,
+        query: str,
+        context: List[Dict[str, Any]],
+        chat_history: Optional[List[Dict[str, str]]] = None
+    ) -> Dict[str, Any]:
+        """Build the chat messages for a RAG answer within the token budget"""
+        return prepare_prompt(query, context, chat_history, self.model)
     
     def summarize_document(self, chunks: List[str], filename: str) -> str:
         """Generate a summary of the document"""
@@ -88,12 +122,13 @@ class LLMService:
         ]
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.5,
-                max_tokens=200
-            )
+            with track("llm_summarize"):
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.5,
+                    max_tokens=200
+                )
             
             return response.choices[0].message.content
         except Exception as e:
@@ -101,4 +136,133 @@ class LLMService:
             return "Unable to generate summary."
 
 
-llm_service = LLMService()
\ No newline at end of file
+class AsyncLLMService:
+    """Non-blocking LLM client on openai.AsyncOpenAI with a pooled keep-alive connection
+    
+    Independent of LLMService, so every method here is a coroutine; the
+    prompt is built by the same prepare_prompt().
+    """
+    
+    def __init__(self):
+        self.model = settings.openai_model
+        self.async_client = openai.AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            http_client=httpx.AsyncClient(
+                timeout=settings.openai_timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=settings.openai_max_connections,
+                    max_keepalive_connections=settings.openai_max_connections
+                )
+            )
+        )
+    
+    async def aclose(self):
+        """Close pooled connections"""
+        await self.async_client.close()
+    
+    def prepare_prompt(
+        self,
+        query: str,
+        context: List[Dict[str, Any]],
+        chat_history: Optional[List[Dict[str, str]]] = None
+    ) -> Dict[str, Any]:
+        """Build the chat messages for a RAG answer within the token budget"""
+        return prepare_prompt(query, context, chat_history, self.model)
+    
+    async def generate(self, prompt: Dict[str, Any]) -> Dict[str, Any]:
+        """Complete a prompt from prepare_prompt(); returns the answer and token usage"""
+        usage = dict(prompt["usage"])
+        
+        try:
+            with track("llm"):
+                response = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=prompt["messages"],
+                    temperature=0.7,
+                    max_tokens=settings.llm_max_completion_tokens
+                )
+            
+            if response.usage:
+                usage["prompt_tokens"] = response.usage.prompt_tokens
+                usage["completion_tokens"] = response.usage.completion_tokens
+            record_usage(usage)
+            return {"response": response.choices[0].message.content, "usage": usage, "error": False}
+        except Exception as e:
+            logger.error(f"Error generating LLM response: {e}")
+            return {"response": ERROR_RESPONSE, "usage": usage, "error": True}
+    
+    async def generate_response(
+        self,
+        query: str,
+        context: List[Dict[str, Any]],
+        chat_history: Optional[List[Dict[str, str]]] = None
+    ) -> str:
+        """Generate response using LLM with context"""
+        result = await self.generate(self.prepare_prompt(query, context, chat_history))
+        return result["response"]
+    
+    async def stream_response(
+        self,
+        query: str,
+        context: List[Dict[str, Any]],
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        prompt: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """Generate response using LLM with context, yielding text as it arrives"""
+        if prompt is None:
+            prompt = self.prepare_prompt(query, context, chat_history)
+        
+        record_usage(prompt["usage"])
+        try:
+            with track("llm_stream"):
+                start = time.perf_counter()
+                stream = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=prompt["messages"],
+                    temperature=0.7,
+                    max_tokens=settings.llm_max_completion_tokens,
+                    stream=True
+                )
+                
+                # Streamed responses carry no usage; each content delta is about one token
+                completion_chunks = 0
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if completion_chunks == 0:
+                            stage_duration.observe(time.perf_counter() - start, stage="llm_first_token")
+                        completion_chunks += 1
+                        yield chunk.choices[0].delta.content
+                llm_tokens.inc(completion_chunks, kind="completion")
+        except Exception as e:
+            logger.error(f"Error streaming LLM response: {e}")
+            # Always the last item, so callers can tell a failed stream apart
+            yield ERROR_RESPONSE
+    
+    async def summarize_conversation(self, previous_summary: str, messages: List[Dict[str, str]]) -> str:
+        """Fold older conversation turns into a short running summary"""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        
+        prompt_messages = [
+            {
+                "role": "system",
+                "content": "You maintain a concise running summary of a conversation. Keep facts, names, numbers and open questions."
+            },
+            {
+                "role": "user",
+                "content": f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}\n\nWrite the updated summary."
+            }
+        ]
+        
+        with track("llm_summarize"):
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=prompt_messages,
+                temperature=0.3,
+                max_tokens=settings.session_summary_max_tokens
+            )
+        
+        return response.choices[0].message.content
+
+
+llm_service = LLMService()
+async_llm_service = AsyncLLMService()
\ No newline at end of file
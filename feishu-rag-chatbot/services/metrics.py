@@ -0,0 +1,342 @@
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator
+
+
+# Seconds; spans cache hits (sub-ms) to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric(ABC):
+    """Base class: a named family of samples keyed by label values
+    
+    snapshot() returns the current values as JSON-serializable (label values,
+    value) pairs; merge() combines snapshots taken in several worker
+    processes, and render() formats one.
+    """
+    
+    type_name = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+    
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    @abstractmethod
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        ...
+    
+    @abstractmethod
+    def samples(self, snapshot: List[Tuple[Tuple[str, ...], Any]]) -> Iterator[str]:
+        ...
+    
+    def merge(self, snapshots: List[List[Tuple[Tuple[str, ...], Any]]]) -> List[Tuple[Tuple[str, ...], Any]]:
+        """Add up the values of each label set"""
+        totals: Dict[Tuple[str, ...], float] = {}
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                key = tuple(key)
+                totals[key] = totals.get(key, 0.0) + value
+        return list(totals.items())
+    
+    def render(self, snapshot: Optional[List[Tuple[Tuple[str, ...], Any]]] = None) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples(self.snapshot() if snapshot is None else snapshot))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        # An unlabelled counter reports 0 before its first increment
+        self._values: Dict[Tuple[str, ...], float] = {} if labelnames else {(): 0.0}
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return list(self._values.items())
+    
+    def samples(self, snapshot: List[Tuple[Tuple[str, ...], Any]]) -> Iterator[str]:
+        for key, value in snapshot:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), aggregate: str = "sum"):
+        super().__init__(name, documentation, labelnames)
+        # How values of several worker processes are merged: "sum" or "mean"
+        self.aggregate = aggregate
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+    
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+    
+    def set_function(self, function: Callable[[], float], **labels):
+        """Read the value from a callback at scrape time"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+    
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                values[key] = float(function())
+            except Exception:
+                continue
+        return list(values.items())
+    
+    def merge(self, snapshots: List[List[Tuple[Tuple[str, ...], Any]]]) -> List[Tuple[Tuple[str, ...], Any]]:
+        totals = super().merge(snapshots)
+        if self.aggregate != "mean":
+            return totals
+        reporting: Dict[Tuple[str, ...], int] = {}
+        for snapshot in snapshots:
+            for key, _ in snapshot:
+                key = tuple(key)
+                reporting[key] = reporting.get(key, 0) + 1
+        return [(key, total / reporting[key]) for key, total in totals]
+    
+    def samples(self, snapshot: List[Tuple[Tuple[str, ...], Any]]) -> Iterator[str]:
+        for key, value in snapshot:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+    
+    def total(self, **labels) -> Tuple[float, int]:
+        """(sum, count) of the observations with these labels"""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            return (state[1], state[2]) if state else (0.0, 0)
+    
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return [(key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items()]
+    
+    def merge(self, snapshots: List[List[Tuple[Tuple[str, ...], Any]]]) -> List[Tuple[Tuple[str, ...], Any]]:
+        """Add up bucket counts, sums and counts of each label set"""
+        totals: Dict[Tuple[str, ...], List[Any]] = {}
+        for snapshot in snapshots:
+            for key, (counts, total, count) in snapshot:
+                key = tuple(key)
+                state = totals.get(key)
+                if state is None:
+                    totals[key] = [list(counts), total, count]
+                else:
+                    state[0] = [a + b for a, b in zip(state[0], counts)]
+                    state[1] += total
+                    state[2] += count
+        return list(totals.items())
+    
+    def samples(self, snapshot: List[Tuple[Tuple[str, ...], Any]]) -> Iterator[str]:
+        for key, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+class Registry:
+    """Metrics exposed on /metrics"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def snapshot(self) -> Dict[str, List[Tuple[Tuple[str, ...], Any]]]:
+        """Current values of every metric, JSON-serializable"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+    
+    def render(self, snapshots: Optional[List[Dict[str, Any]]] = None) -> str:
+        """Prometheus text exposition format (version 0.0.4)
+        
+        With snapshots (from snapshot(), one per worker process) the merged
+        values of all of them are rendered instead of this process's own.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        if snapshots is None:
+            return "\n".join(metric.render() for metric in metrics) + "\n"
+        return "\n".join(
+            metric.render(metric.merge([snapshot.get(metric.name, []) for snapshot in snapshots]))
+            for metric in metrics
+        ) + "\n"
+
+
+registry = Registry()
+
+stage_duration = registry.register(Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent per pipeline stage",
+    ("stage",)
+))
+stage_in_flight = registry.register(Gauge(
+    "rag_stage_in_flight",
+    "Operations currently running per pipeline stage",
+    ("stage",)
+))
+stage_errors = registry.register(Counter(
+    "rag_stage_errors_total",
+    "Failed operations per pipeline stage",
+    ("stage",)
+))
+llm_tokens = registry.register(Counter(
+    "rag_llm_tokens_total",
+    "LLM tokens by kind (prompt, completion, context, history)",
+    ("kind",)
+))
+cache_hit_rate = registry.register(Gauge(
+    "rag_cache_hit_rate",
+    "Hit rate per cache since start",
+    ("cache",),
+    aggregate="mean"
+))
+queue_depth = registry.register(Gauge(
+    "rag_queue_depth",
+    "Items waiting per background queue",
+    ("queue",)
+))
+coalesced_requests = registry.register(Counter(
+    "rag_coalesced_requests_total",
+    "Requests served by an identical request already in flight",
+    ("flight",)
+))
+coalesce_timeouts = registry.register(Counter(
+    "rag_coalesce_timeouts_total",
+    "Coalesced requests that stopped waiting and ran separately",
+    ("flight",)
+))
+feishu_retries = registry.register(Counter(
+    "rag_feishu_retries_total",
+    "Retried Feishu API calls by reason (rate_limited, server_error, connection)",
+    ("reason",)
+))
+ingested_chunks = registry.register(Counter(
+    "rag_ingested_chunks_total",
+    "Chunks written to the vector database"
+))
+
+
+@contextmanager
+def track(stage: str):
+    """Time a stage into the histogram, counting it as in flight and on failure as an error"""
+    stage_in_flight.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - start, stage=stage)
+        stage_in_flight.dec(stage=stage)
+
+
+def record_usage(usage: Optional[Dict[str, Any]]):
+    """Add the token counts of a prompt/answer usage dict"""
+    if not usage:
+        return
+    for kind, key in (
+        ("prompt", "prompt_tokens"),
+        ("completion", "completion_tokens"),
+        ("context", "context_tokens"),
+        ("history", "history_tokens"),
+    ):
+        if usage.get(key):
+            llm_tokens.inc(usage[key], kind=kind)
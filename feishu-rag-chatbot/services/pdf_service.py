@@ -1,16 +1,30 @@
 import os
 import hashlib
-from typing import List, Dict, Any
+import multiprocessing
+import threading
+import uuid
+import aiofiles
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Iterator, Tuple, AsyncIterator
 import PyPDF2
 import pdfplumber
 from loguru import logger
 from config.settings import settings
+from services.metrics import track
+
+
+class FileTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit"""
 
 
 class PDFService:
     def __init__(self):
         self.storage_path = settings.pdf_storage_path
+        self.upload_path = os.path.join(self.storage_path, ".uploads")
         os.makedirs(self.storage_path, exist_ok=True)
+        os.makedirs(self.upload_path, exist_ok=True)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
     
     def save_pdf(self, file_content: bytes, filename: str) -> str:
         """Save PDF file and return file ID"""
@@ -23,51 +37,119 @@ class PDFService:
         logger.info(f"Saved PDF: {filename} with ID: {file_id}")
         return file_id
     
+    async def save_pdf_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        max_bytes: int
+    ) -> Tuple[str, int]:
+        """Stream an upload to disk while hashing it; returns (file ID, size)
+        
+        Aborts with FileTooLargeError as soon as max_bytes is crossed, so the
+        full body is never held in memory.
+        """
+        tmp_path = os.path.join(self.upload_path, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.md5()
+        size = 0
+        
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise FileTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                    digest.update(chunk)
+                    await f.write(chunk)
+            
+            file_id = digest.hexdigest()
+            file_path = os.path.join(self.storage_path, f"{file_id}.pdf")
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        logger.info(f"Saved PDF: {filename} with ID: {file_id} ({size} bytes)")
+        return file_id, size
+    
+    def import_pdf(self, source, filename: str, max_bytes: int) -> Tuple[str, int]:
+        """Copy a local PDF (a path or an open binary file) into storage; returns (file ID, size)"""
+        tmp_path = os.path.join(self.upload_path, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.md5()
+        size = 0
+        
+        try:
+            with (open(source, "rb") if isinstance(source, str) else source) as src, open(tmp_path, "wb") as dst:
+                for block in iter(lambda: src.read(settings.upload_chunk_size_kb * 1024), b""):
+                    size += len(block)
+                    if size > max_bytes:
+                        raise FileTooLargeError(f"{filename} exceeds {max_bytes} bytes")
+                    digest.update(block)
+                    dst.write(block)
+            
+            file_id = digest.hexdigest()
+            os.replace(tmp_path, os.path.join(self.storage_path, f"{file_id}.pdf"))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        return file_id, size
+    
     def extract_text_from_pdf(self, file_id: str) -> List[Dict[str, Any]]:
         """Extract text from PDF file"""
+        chunks = list(self.iter_chunks(file_id))
+        logger.info(f"Extracted {len(chunks)} chunks from PDF: {file_id}")
+        return chunks
+    
+    def iter_chunks(
+        self,
+        file_id: str,
+        progress: Optional[Callable[[str, float], None]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield text chunks as pages are extracted"""
+        # Imported here so spawned extraction workers don't load tokenizers and indexes
+        from services.chunking import get_chunker
+        yield from get_chunker().chunk(self.iter_pages(file_id, progress=progress), file_id)
+    
+    def iter_pages(
+        self,
+        file_id: str,
+        progress: Optional[Callable[[str, float], None]] = None
+    ) -> Iterator[Tuple[int, str]]:
+        """Yield (page number, text) in page order, extracting page ranges in parallel"""
         file_path = os.path.join(self.storage_path, f"{file_id}.pdf")
         
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"PDF file not found: {file_id}")
         
-        chunks = []
+        num_pages = self._count_pages(file_path)
+        pages_per_task = max(1, settings.pdf_pages_per_task)
+        ranges = [
+            (start, min(start + pages_per_task, num_pages))
+            for start in range(0, num_pages, pages_per_task)
+        ]
         
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    text = page.extract_text()
-                    if text:
-                        # Split text into chunks (simple approach - you can improve this)
-                        chunk_size = 1000
-                        for i in range(0, len(text), chunk_size):
-                            chunk = text[i:i + chunk_size]
-                            chunks.append({
-                                "text": chunk,
-                                "page": page_num,
-                                "file_id": file_id,
-                                "chunk_id": f"{file_id}_p{page_num}_c{i//chunk_size}"
-                            })
-        except Exception as e:
-            logger.error(f"Error extracting text from PDF: {e}")
-            # Fallback to PyPDF2
-            with open(file_path, "rb") as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    if text:
-                        chunk_size = 1000
-                        for i in range(0, len(text), chunk_size):
-                            chunk = text[i:i + chunk_size]
-                            chunks.append({
-                                "text": chunk,
-                                "page": page_num + 1,
-                                "file_id": file_id,
-                                "chunk_id": f"{file_id}_p{page_num + 1}_c{i//chunk_size}"
-                            })
+        if settings.pdf_extract_workers > 1 and len(ranges) > 1:
+            # Submit every range up front, then consume them in page order
+            pool = self._get_pool()
+            futures = [pool.submit(_extract_page_range, file_path, start, end) for start, end in ranges]
+            pages = (future.result() for future in futures)
+        else:
+            pages = (_extract_page_range(file_path, start, end) for start, end in ranges)
         
-        logger.info(f"Extracted {len(chunks)} chunks from PDF: {file_id}")
-        return chunks
+        done = 0
+        pages = iter(pages)
+        while True:
+            # Only the wait for extraction is timed, not the consumer of the pages
+            with track("ingest_extract"):
+                page_texts = next(pages, None)
+            if page_texts is None:
+                break
+            for page_num, text in page_texts:
+                if text:
+                    yield page_num, text
+            done += len(page_texts)
+            if progress and num_pages:
+                progress("extract", done / num_pages)
     
     def get_pdf_info(self, file_id: str) -> Dict[str, Any]:
         """Get PDF file information"""
@@ -83,12 +165,74 @@ class PDFService:
         return {
             "file_id": file_id,
             "pages": num_pages,
-            "path": file_path
+            "path": file_path,
+            "size_bytes": os.path.getsize(file_path)
         }
     
     def _generate_file_id(self, content: bytes) -> str:
         """Generate unique file ID from content"""
         return hashlib.md5(content).hexdigest()
+    
+    def _count_pages(self, file_path: str) -> int:
+        with open(file_path, "rb") as f:
+            return len(PyPDF2.PdfReader(f).pages)
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Start the extraction process pool on first use"""
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn keeps workers clear of threads/model state in the parent
+                self._pool = ProcessPoolExecutor(
+                    max_workers=settings.pdf_extract_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                logger.info(f"Started PDF extraction pool with {settings.pdf_extract_workers} workers")
+        return self._pool
+    
+    def close(self):
+        """Shut down the extraction process pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract pages [start, end) with pdfplumber, falling back to PyPDF2 per page"""
+    pages = []
+    fallback_reader = None
+    fallback_file = None
+    
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            for index in range(start, end):
+                try:
+                    text = pdf.pages[index].extract_text() or ""
+                except Exception as e:
+                    logger.warning(f"pdfplumber failed on page {index + 1}, using PyPDF2: {e}")
+                    if fallback_reader is None:
+                        fallback_file = open(file_path, "rb")
+                        fallback_reader = PyPDF2.PdfReader(fallback_file)
+                    text = _extract_with_pypdf2(fallback_reader, index)
+                pages.append((index + 1, text))
+    except Exception as e:
+        # The file could not be opened by pdfplumber at all
+        logger.error(f"Error extracting text from PDF: {e}")
+        with open(file_path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            pages = [(index + 1, _extract_with_pypdf2(reader, index)) for index in range(start, end)]
+    finally:
+        if fallback_file is not None:
+            fallback_file.close()
+    
+    return pages
+
+
+def _extract_with_pypdf2(reader: PyPDF2.PdfReader, index: int) -> str:
+    try:
+        return reader.pages[index].extract_text() or ""
+    except Exception as e:
+        logger.error(f"PyPDF2 failed on page {index + 1}: {e}")
+        return ""
 
 
 pdf_service = PDFService()
\ No newline at end of file
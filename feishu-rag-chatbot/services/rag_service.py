@@ -1,99 +1,494 @@
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple, Callable, AsyncIterator
 from loguru import logger
 from services.vector_db_service import vector_db_service
-from services.llm_service import llm_service
+from services.llm_service import llm_service, async_llm_service, ERROR_RESPONSE
 from services.pdf_service import pdf_service
+from services.cache_service import answer_cache
+from services.rerank_service import rerank_service
+from services.catalog_service import document_catalog
+from services.shared_state import shared_state
+from services.single_flight import SingleFlight
+from config.settings import settings
+from services.metrics import track
+
+
+# Shared-state key bumped by the ingestion writer in multi-worker mode
+CORPUS_VERSION_KEY = "corpus_version"
 
 
 class RAGService:
     def __init__(self):
         self.vector_db = vector_db_service
         self.llm = llm_service
+        self.async_llm = async_llm_service
         self.pdf = pdf_service
+        self.answer_cache = answer_cache
+        self.reranker = rerank_service
+        self.catalog = document_catalog
+        self.corpus_version = 0
+        self._version_checked_at = 0.0
+        # Concurrent identical questions share one execution
+        self.query_flights = SingleFlight("answer", settings.coalesce_timeout_seconds)
+        self.stream_flights = SingleFlight("stream", settings.coalesce_timeout_seconds)
+        self.retrieval_flights = SingleFlight("retrieval", settings.coalesce_timeout_seconds)
+        self.embedding_flights = SingleFlight("embedding", settings.coalesce_timeout_seconds)
     
     def process_pdf(self, file_content: bytes, filename: str) -> Tuple[str, Dict[str, Any]]:
         """Process PDF file and store in vector database"""
         try:
             # Save PDF
             file_id = self.pdf.save_pdf(file_content, filename)
+            return self.ingest_pdf(file_id, filename)
+        except Exception as e:
+            logger.error(f"Error processing PDF: {e}")
+            raise
+    
+    def ingest_pdf(
+        self,
+        file_id: str,
+        filename: str,
+        progress: Optional[Callable[[str, float], None]] = None,
+        replaces: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Extract, embed, index and summarize an already saved PDF
+        
+        Re-ingesting a file id that is already indexed is a no-op. When
+        `replaces` names a previous revision, embeddings of unchanged chunks
+        are reused and the old revision is removed afterwards.
+        """
+        try:
+            # The file id is a content hash: identical uploads are already indexed
+            existing = self.catalog.get(file_id)
+            if existing:
+                logger.info(f"Skipping ingestion of {filename}: {file_id} is already indexed")
+                if replaces and replaces != file_id:
+                    self.delete_document(replaces)
+                return file_id, {
+                    "file_id": file_id,
+                    "filename": existing["filename"],
+                    "pages": existing["pages"],
+                    "chunks": existing["chunks"],
+                    "summary": existing["summary"],
+                    "skipped": True
+                }
             
-            # Extract text chunks
-            chunks = self.pdf.extract_text_from_pdf(file_id)
+            reuse_embeddings = None
+            if replaces and replaces != file_id:
+                reuse_embeddings = self.vector_db.get_embeddings_by_hash(replaces)
+                logger.info(f"Re-ingesting {filename} as a revision of {replaces} ({len(reuse_embeddings)} reusable chunks)")
             
-            # Add to vector database
-            self.vector_db.add_documents(chunks, file_id, filename)
+            # Stream chunks into the vector database while later pages are still extracting
+            chunk_count = 0
+            summary_texts = []
+            pending = []
+            extracted = {"fraction": 0.0}
+            
+            def on_extract(stage: str, fraction: float):
+                extracted["fraction"] = fraction
+                if progress:
+                    progress(stage, fraction)
+            
+            def write(batch: List[Dict[str, Any]]):
+                self.vector_db.add_documents(batch, file_id, filename, reuse_embeddings=reuse_embeddings)
+                if progress:
+                    # Embedding and indexing trail extraction by at most one batch
+                    progress("embed", extracted["fraction"])
+                    progress("index", extracted["fraction"])
+            
+            for chunk in self.pdf.iter_chunks(file_id, progress=on_extract):
+                chunk_count += 1
+                if len(summary_texts) < 5:
+                    summary_texts.append(chunk["text"])
+                pending.append(chunk)
+                if len(pending) >= settings.ingest_stream_batch_size:
+                    write(pending)
+                    pending = []
+            if pending:
+                write(pending)
+            if progress:
+                for stage in ("extract", "embed", "index"):
+                    progress(stage, 1.0)
+            
+            if reuse_embeddings is not None:
+                self.delete_document(replaces)
+            self._corpus_changed()
             
             # Get PDF info
             pdf_info = self.pdf.get_pdf_info(file_id)
             
             # Generate summary
-            chunk_texts = [chunk["text"] for chunk in chunks[:5]]
-            summary = self.llm.summarize_document(chunk_texts, filename)
+            if progress:
+                progress("summarize", 0.0)
+            with track("ingest_summarize"):
+                summary = self.llm.summarize_document(summary_texts, filename)
+            if progress:
+                progress("summarize", 1.0)
             
             result = {
                 "file_id": file_id,
                 "filename": filename,
                 "pages": pdf_info["pages"],
-                "chunks": len(chunks),
-                "summary": summary
+                "chunks": chunk_count,
+                "summary": summary,
+                "skipped": False
             }
             
+            self.catalog.upsert(
+                file_id=file_id,
+                filename=filename,
+                pages=pdf_info["pages"],
+                chunks=chunk_count,
+                summary=summary,
+                size_bytes=pdf_info["size_bytes"]
+            )
+            
             return file_id, result
         except Exception as e:
             logger.error(f"Error processing PDF: {e}")
             raise
     
-    def query(
+    async def query(
         self,
         query: str,
         file_ids: Optional[List[str]] = None,
         chat_history: Optional[List[Dict[str, str]]] = None,
         top_k: int = 5
     ) -> Dict[str, Any]:
-        """Query the RAG system"""
-        try:
-            # Search for relevant documents
-            search_results = self.vector_db.search(query, top_k=top_k, file_ids=file_ids)
-            
-            # Generate response using LLM
-            response = self.llm.generate_response(query, search_results, chat_history)
-            
-            # Format sources
-            sources = []
-            seen_sources = set()
-            for result in search_results:
-                metadata = result.get("metadata", {})
-                source_key = f"{metadata.get('filename')}_{metadata.get('page')}"
-                if source_key not in seen_sources:
-                    seen_sources.add(source_key)
-                    sources.append({
-                        "filename": metadata.get("filename"),
-                        "page": metadata.get("page"),
-                        "file_id": metadata.get("file_id")
-                    })
-            
-            return {
-                "response": response,
+        """Query the RAG system
+        
+        Concurrent identical questions (same normalized text, file_ids and
+        chat history) share one execution. Identical questions asked in
+        different conversations still share the query embedding and retrieval.
+        """
+        with track("query"):
+            try:
+                corpus_version = await self.current_corpus_version()
+                if not settings.coalesce_enabled:
+                    return await self._query(query, file_ids, chat_history, top_k, corpus_version)
+                return await self.query_flights.do(
+                    self._coalesce_key(query, file_ids, top_k, corpus_version, chat_history),
+                    lambda: self._query(query, file_ids, chat_history, top_k, corpus_version)
+                )
+            except Exception as e:
+                logger.error(f"Error querying RAG system: {e}")
+                raise
+    
+    async def _query(
+        self,
+        query: str,
+        file_ids: Optional[List[str]],
+        chat_history: Optional[List[Dict[str, str]]],
+        top_k: int,
+        corpus_version: int
+    ) -> Dict[str, Any]:
+        # Answers depend on the chat history, so it is part of the cache key
+        use_cache = settings.answer_cache_enabled
+        history = self.history_digest(chat_history)
+        query_embedding = await self._embed(query)
+        if use_cache:
+            cached = await self._cached_answer(query, file_ids, corpus_version, query_embedding, history)
+            if cached is not None:
+                return dict(cached, cached=True)
+        
+        search_results = await self._search(query, top_k, file_ids, query_embedding, corpus_version)
+        
+        # Pack context and history into the token budget, then generate
+        with track("prompt"):
+            prompt = self.async_llm.prepare_prompt(query, search_results, chat_history)
+        generated = await self.async_llm.generate(prompt)
+        
+        result = {
+            "response": generated["response"],
+            "sources": self._format_sources(prompt["context"]),
+            "context_used": len(prompt["context"]),
+            "usage": generated["usage"],
+            "error": bool(generated.get("error"))
+        }
+        
+        # A failed generation is an apology, not an answer worth reusing
+        if use_cache and not result["error"]:
+            await self._cache_answer(query, file_ids, corpus_version, result, query_embedding, history)
+        
+        return result
+    
+    async def stream_query(
+        self,
+        query: str,
+        file_ids: Optional[List[str]] = None,
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        top_k: int = 5
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Query the RAG system, yielding sources first and then answer tokens
+        
+        Concurrent identical questions with the same chat history share one
+        stream; a request that joins late first receives the events sent so far.
+        """
+        corpus_version = await self.current_corpus_version()
+        if not settings.coalesce_enabled:
+            async for event in self._stream_query(query, file_ids, chat_history, top_k, corpus_version):
+                yield event
+            return
+        async for event in self.stream_flights.stream(
+            self._coalesce_key(query, file_ids, top_k, corpus_version, chat_history),
+            lambda: self._stream_query(query, file_ids, chat_history, top_k, corpus_version)
+        ):
+            # Callers annotate events, so each gets its own copy
+            yield dict(event)
+    
+    async def _stream_query(
+        self,
+        query: str,
+        file_ids: Optional[List[str]],
+        chat_history: Optional[List[Dict[str, str]]],
+        top_k: int,
+        corpus_version: int
+    ) -> AsyncIterator[Dict[str, Any]]:
+        use_cache = settings.answer_cache_enabled
+        history = self.history_digest(chat_history)
+        query_embedding = await self._embed(query)
+        if use_cache:
+            cached = await self._cached_answer(query, file_ids, corpus_version, query_embedding, history)
+            if cached is not None:
+                yield {
+                    "type": "sources",
+                    "sources": cached["sources"],
+                    "context_used": cached["context_used"],
+                    "usage": cached.get("usage")
+                }
+                yield {"type": "token", "content": cached["response"]}
+                yield {"type": "done", "cached": True}
+                return
+        
+        search_results = await self._search(query, top_k, file_ids, query_embedding, corpus_version)
+        with track("prompt"):
+            prompt = self.async_llm.prepare_prompt(query, search_results, chat_history)
+        sources = self._format_sources(prompt["context"])
+        
+        yield {
+            "type": "sources",
+            "sources": sources,
+            "context_used": len(prompt["context"]),
+            "usage": prompt["usage"]
+        }
+        
+        answer = []
+        async for token in self.async_llm.stream_response(
+            query, search_results, chat_history, prompt=prompt
+        ):
+            answer.append(token)
+            yield {"type": "token", "content": token}
+        
+        failed = bool(answer) and answer[-1] == ERROR_RESPONSE
+        if use_cache and not failed:
+            await self._cache_answer(query, file_ids, corpus_version, {
+                "response": "".join(answer),
                 "sources": sources,
-                "context_used": len(search_results)
-            }
-        except Exception as e:
-            logger.error(f"Error querying RAG system: {e}")
-            raise
+                "context_used": len(prompt["context"]),
+                "usage": prompt["usage"]
+            }, query_embedding, history)
+        
+        yield {"type": "done", "error": failed}
+    
+    async def _cached_answer(self, *args) -> Optional[Dict[str, Any]]:
+        """answer_cache.get(), off the event loop when it reads the shared state"""
+        if settings.multi_worker:
+            return await asyncio.to_thread(self.answer_cache.get, *args)
+        return self.answer_cache.get(*args)
     
-    def list_documents(self) -> List[Dict[str, str]]:
-        """List all documents in the system"""
-        return self.vector_db.get_all_files()
+    async def _cache_answer(self, *args):
+        """answer_cache.set(), off the event loop when it writes the shared state"""
+        if settings.multi_worker:
+            await asyncio.to_thread(self.answer_cache.set, *args)
+        else:
+            self.answer_cache.set(*args)
+    
+    async def _embed(self, query: str) -> List[float]:
+        """Query embedding, shared between concurrent requests for the same text"""
+        with track("embed_query"):
+            if not settings.coalesce_enabled:
+                return await self.vector_db.aembed_query(query)
+            return await self.embedding_flights.do(query, lambda: self.vector_db.aembed_query(query))
+    
+    async def _search(
+        self,
+        query: str,
+        top_k: int,
+        file_ids: Optional[List[str]],
+        query_embedding: List[float],
+        corpus_version: int
+    ) -> List[Dict[str, Any]]:
+        """retrieve() off the event loop, shared between concurrent identical searches"""
+        def search():
+            return asyncio.to_thread(self.retrieve, query, top_k, file_ids, query_embedding)
+        
+        if not settings.coalesce_enabled:
+            return await search()
+        return await self.retrieval_flights.do(
+            self._coalesce_key(query, file_ids, top_k, corpus_version), search
+        )
+    
+    def _coalesce_key(
+        self,
+        query: str,
+        file_ids: Optional[List[str]],
+        top_k: int,
+        corpus_version: int,
+        chat_history: Optional[List[Dict[str, str]]] = None
+    ) -> Tuple:
+        return (
+            self.answer_cache.normalize_query(query),
+            tuple(sorted(file_ids)) if file_ids else (),
+            top_k,
+            corpus_version,
+            self.history_digest(chat_history)
+        )
+    
+    @staticmethod
+    def history_digest(chat_history: Optional[List[Dict[str, str]]]) -> str:
+        """Stable digest of a conversation, empty when there is none"""
+        if not chat_history:
+            return ""
+        encoded = json.dumps(chat_history, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        return hashlib.sha1(encoded).hexdigest()
+    
+    def coalesce_stats(self) -> Dict[str, Any]:
+        """Executions and coalesced requests per shared stage"""
+        return {
+            flights.name: flights.stats()
+            for flights in (self.query_flights, self.stream_flights, self.retrieval_flights, self.embedding_flights)
+        }
+    
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        file_ids: Optional[List[str]] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Search, over-fetching candidates for the cross-encoder when re-ranking is enabled"""
+        if not self.reranker.enabled:
+            return self.vector_db.search(query, top_k, file_ids, query_embedding)
+        
+        candidates = self.vector_db.search(
+            query, max(top_k, settings.rerank_candidates), file_ids, query_embedding
+        )
+        return self.reranker.rerank(query, candidates, top_k)
+    
+    def _format_sources(self, search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Deduplicate search results into (filename, page) sources"""
+        sources = []
+        seen_sources = set()
+        for result in search_results:
+            metadata = result.get("metadata", {})
+            page_end = metadata.get("page_end", metadata.get("page"))
+            source_key = f"{metadata.get('filename')}_{metadata.get('page')}_{page_end}"
+            if source_key not in seen_sources:
+                seen_sources.add(source_key)
+                sources.append({
+                    "filename": metadata.get("filename"),
+                    "page": metadata.get("page"),
+                    "page_end": page_end,
+                    "file_id": metadata.get("file_id")
+                })
+        return sources
+    
+    def list_documents(self, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """List documents from the catalog; returns (documents, total)"""
+        return self.catalog.list(offset=offset, limit=limit)
+    
+    def get_document(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a document by file id"""
+        return self.catalog.get(file_id)
+    
+    def find_documents(self, filename: str) -> List[Dict[str, Any]]:
+        """Look up documents by filename"""
+        return self.catalog.find_by_filename(filename)
+    
+    def resolve_documents(self, term: str) -> List[Dict[str, Any]]:
+        """Look up documents by filename, file id prefix or filename fragment"""
+        return self.catalog.resolve(term)
+    
+    def sync_catalog(self):
+        """Seed an empty catalog from the vector collection (one-time migration)"""
+        if self.catalog.count() > 0:
+            return
+        files = self.vector_db.get_all_files()
+        if not files:
+            return
+        for file in files:
+            try:
+                pdf_info = self.pdf.get_pdf_info(file["file_id"])
+                file["pages"] = pdf_info["pages"]
+                file["size_bytes"] = pdf_info["size_bytes"]
+            except FileNotFoundError:
+                pass
+        self.catalog.backfill(files)
+    
+    def register_documents(self, documents: List[Tuple[str, str, int]]):
+        """Catalog (file_id, filename, chunks) documents whose chunks are already indexed (bulk ingestion)
+        
+        The corpus version is bumped once for the whole set, so readers drop
+        their caches and reopen the store once per write batch, not per document.
+        """
+        for file_id, filename, chunks in documents:
+            pdf_info = self.pdf.get_pdf_info(file_id)
+            self.catalog.upsert(
+                file_id=file_id,
+                filename=filename,
+                pages=pdf_info["pages"],
+                chunks=chunks,
+                summary=None,
+                size_bytes=pdf_info["size_bytes"]
+            )
+        if documents:
+            self._corpus_changed()
     
     def delete_document(self, file_id: str):
         """Delete a document from the system"""
         self.vector_db.delete_by_file_id(file_id)
+        self.catalog.delete(file_id)
+        self._corpus_changed()
         # Optionally delete the PDF file
-        import os
         pdf_path = os.path.join(self.pdf.storage_path, f"{file_id}.pdf")
         if os.path.exists(pdf_path):
             os.remove(pdf_path)
         logger.info(f"Deleted document: {file_id}")
-
+    
+    def _corpus_changed(self):
+        """Bump the corpus version so cached answers are not reused"""
+        if settings.multi_worker:
+            self.corpus_version = shared_state.incr(CORPUS_VERSION_KEY)
+        else:
+            self.corpus_version += 1
+        self.answer_cache.invalidate()
+    
+    async def current_corpus_version(self) -> int:
+        """Corpus version; in multi-worker mode follows the ingestion writer's changes
+        
+        Readers poll the shared version at most every shared_state_poll_seconds
+        and, when it moved, drop cached answers and reopen the Chroma store.
+        The poll reads SQLite and the reopen can wait on the store's init lock,
+        so both run in a thread; requests meanwhile keep the current version.
+        """
+        if not settings.multi_worker:
+            return self.corpus_version
+        now = time.monotonic()
+        if now - self._version_checked_at >= settings.shared_state_poll_seconds:
+            # Claimed before awaiting, so concurrent requests do not poll too
+            self._version_checked_at = now
+            await asyncio.to_thread(self._poll_corpus_version)
+        return self.corpus_version
+    
+    def _poll_corpus_version(self):
+        version = shared_state.get(CORPUS_VERSION_KEY) or 0
+        if version != self.corpus_version:
+            self.answer_cache.invalidate()
+            self.vector_db.reload()
+            self.corpus_version = version
 
 rag_service = RAGService()
\ No newline at end of file
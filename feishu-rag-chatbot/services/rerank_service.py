@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from loguru import logger
+from config.settings import settings
+from services.cache_service import AnswerCache
+from services.metrics import track
+
+
+class RerankService:
+    """Re-scores retrieval candidates with a local cross-encoder"""
+
+    def __init__(self):
+        self.model_name = settings.rerank_model
+        self.batch_size = max(1, settings.rerank_batch_size)
+        self.latency_budget = settings.rerank_latency_budget_ms / 1000
+        self._model = None
+        self._model_lock = threading.Lock()
+
+        # (normalized query, chunk id, text hash) -> score
+        self._cache: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._cache_size = settings.rerank_cache_size
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # Running average cost of scoring one pair, used to predict overruns
+        self._seconds_per_pair: Optional[float] = None
+        self._reranked = 0
+        self._skipped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.rerank_enabled
+
+    @property
+    def model(self):
+        """Load the cross-encoder on first use"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    start = time.perf_counter()
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+                    logger.info(
+                        f"Loaded re-ranking model {self.model_name} "
+                        f"in {time.perf_counter() - start:.2f}s"
+                    )
+        return self._model
+
+    def rerank(self, query: str, results: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """Best top_k results by cross-encoder score
+
+        Falls back to the original order when scoring would exceed (or does
+        exceed) the latency budget.
+        """
+        if not results:
+            return results
+
+        normalized = AnswerCache.normalize_query(query)
+        keys = [self._key(normalized, result) for result in results]
+        scores = [self._cache_get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing:
+            model = self.model
+            if self._over_budget(len(missing)):
+                # Let the estimate decay so a transient slowdown does not disable re-ranking
+                self._seconds_per_pair *= 0.9
+                self._skipped += 1
+                logger.debug(f"Skipping re-ranking of {len(missing)} candidates: predicted over budget")
+                return results[:top_k]
+
+            with track("rerank"):
+                start = time.perf_counter()
+                for offset in range(0, len(missing), self.batch_size):
+                    batch = missing[offset:offset + self.batch_size]
+                    batch_scores = model.predict(
+                        [(query, results[i].get("text", "")) for i in batch],
+                        batch_size=self.batch_size,
+                        show_progress_bar=False
+                    )
+                    for i, score in zip(batch, batch_scores):
+                        scores[i] = float(score)
+                        self._cache_put(keys[i], scores[i])
+
+                    elapsed = time.perf_counter() - start
+                    self._record_cost(elapsed / (offset + len(batch)))
+                    if elapsed > self.latency_budget and offset + len(batch) < len(missing):
+                        # Scores computed so far stay cached for the next request
+                        self._skipped += 1
+                        logger.warning(
+                            f"Re-ranking exceeded its {self.latency_budget * 1000:.0f}ms budget; "
+                            f"using retrieval order"
+                        )
+                        return results[:top_k]
+
+        self._reranked += 1
+        ranked = sorted(zip(results, scores), key=lambda pair: pair[1], reverse=True)
+        return [dict(result, rerank_score=score) for result, score in ranked[:top_k]]
+
+    def load(self):
+        """Load the cross-encoder now instead of on the first query"""
+        self.model
+
+    def stats(self) -> Dict[str, Any]:
+        """Re-ranking and score cache counters"""
+        lookups = self._cache_hits + self._cache_misses
+        return {
+            "enabled": self.enabled,
+            "model_loaded": self._model is not None,
+            "reranked": self._reranked,
+            "skipped": self._skipped,
+            "cache_entries": len(self._cache),
+            "cache_hit_rate": self._cache_hits / lookups if lookups else 0.0,
+            "ms_per_pair": self._seconds_per_pair * 1000 if self._seconds_per_pair else None
+        }
+
+    @staticmethod
+    def _key(normalized_query: str, result: Dict[str, Any]) -> Tuple[str, str, str]:
+        metadata = result.get("metadata", {}) or {}
+        return normalized_query, result.get("id", ""), metadata.get("text_hash", "")
+
+    def _over_budget(self, pairs: int) -> bool:
+        if self._seconds_per_pair is None:
+            return False
+        return self._seconds_per_pair * pairs > self.latency_budget
+
+    def _record_cost(self, seconds_per_pair: float):
+        if self._seconds_per_pair is None:
+            self._seconds_per_pair = seconds_per_pair
+        else:
+            self._seconds_per_pair = 0.8 * self._seconds_per_pair + 0.2 * seconds_per_pair
+
+    def _cache_get(self, key: Tuple[str, str, str]) -> Optional[float]:
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is None:
+                self._cache_misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self._cache_hits += 1
+            return score
+
+    def _cache_put(self, key: Tuple[str, str, str], score: float):
+        if self._cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+
+rerank_service = RerankService()
@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+from loguru import logger
+from config.settings import settings
+from services.llm_service import async_llm_service
+
+
+# How often append_turn sweeps expired session files from disk
+SWEEP_INTERVAL_SECONDS = 600
+
+
+class SessionStore:
+    """Server-side conversation history with LRU eviction and rolling summaries"""
+
+    def __init__(self):
+        self.max_sessions = max(1, settings.session_max_sessions)
+        self.idle_ttl = settings.session_idle_ttl_seconds
+        self.max_recent_messages = max(2, settings.session_max_recent_messages)
+        self.storage_path = settings.session_storage_path if settings.session_persist else None
+        if self.storage_path:
+            os.makedirs(self.storage_path, exist_ok=True)
+        self.llm = async_llm_service
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Identity of the file each cached session was last read from or written to
+        self._file_versions: Dict[str, tuple] = {}
+        self._compacting = set()
+        self._tasks = set()
+        self._last_sweep = 0.0
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        """Chat history for a session: rolling summary followed by recent turns"""
+        session = self._get(session_id)
+        if session is None:
+            return []
+
+        history = []
+        if session["summary"]:
+            history.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {session['summary']}"
+            })
+        history.extend(session["messages"])
+        return history
+
+    def append_turn(self, session_id: str, user_message: str, assistant_message: str):
+        """Record a question/answer pair and compact old turns in the background"""
+        session = self._get(session_id) or self._new(session_id)
+
+        session["messages"].append({"role": "user", "content": user_message})
+        session["messages"].append({"role": "assistant", "content": assistant_message})
+        session["updated_at"] = time.time()
+        self._sessions.move_to_end(session_id)
+        self._evict()
+        self._persist(session)
+
+        if len(session["messages"]) > self.max_recent_messages and session_id not in self._compacting:
+            self._compacting.add(session_id)
+            self._spawn(self._compact(session_id))
+
+        if self.storage_path and self.idle_ttl > 0 and time.monotonic() - self._last_sweep >= SWEEP_INTERVAL_SECONDS:
+            self._last_sweep = time.monotonic()
+            self._spawn(asyncio.to_thread(self.sweep_expired))
+
+    def get_scope(self, session_id: str) -> List[Dict[str, str]]:
+        """Documents ({file_id, filename}) the session's questions are limited to; empty means all"""
+        session = self._get(session_id)
+        return list(session.get("scope", [])) if session else []
+
+    def set_scope(self, session_id: str, documents: List[Dict[str, str]]):
+        """Limit the session's questions to some documents (an empty list lifts the limit)"""
+        session = self._get(session_id) or self._new(session_id)
+        session["scope"] = list(documents)
+        session["updated_at"] = time.time()
+        self._persist(session)
+
+    def clear(self, session_id: str):
+        """Forget a session"""
+        self._sessions.pop(session_id, None)
+        self._file_versions.pop(session_id, None)
+        path = self._path(session_id)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def sweep_expired(self) -> int:
+        """Delete session files idle for longer than SESSION_IDLE_TTL_SECONDS; returns how many
+
+        Expired sessions that are asked for again are dropped by _get, but
+        files of sessions nobody returns to would otherwise stay forever.
+        """
+        if not self.storage_path or self.idle_ttl <= 0:
+            return 0
+        cutoff = time.time() - self.idle_ttl
+        removed = 0
+        try:
+            entries = list(os.scandir(self.storage_path))
+        except OSError as e:
+            logger.error(f"Error sweeping sessions: {e}")
+            return 0
+        for entry in entries:
+            if not entry.name.endswith((".json", ".tmp")):
+                continue
+            try:
+                # Every save rewrites the file, so its mtime is the session's last activity
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue  # removed meanwhile, e.g. by another worker's sweep
+        if removed:
+            logger.info(f"Removed {removed} expired session files")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "compacting": len(self._compacting)
+        }
+
+    async def _compact(self, session_id: str):
+        """Fold the oldest turns into the rolling summary"""
+        try:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            overflow = len(session["messages"]) - self.max_recent_messages
+            if overflow <= 0:
+                return
+            # Summarize whole question/answer pairs
+            overflow += overflow % 2
+            old_messages = session["messages"][:overflow]
+
+            summary = await self.llm.summarize_conversation(session["summary"], old_messages)
+
+            session["summary"] = summary
+            del session["messages"][:overflow]
+            self._persist(session)
+        except Exception as e:
+            logger.error(f"Error compacting session {session_id}: {e}")
+        finally:
+            self._compacting.discard(session_id)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self._sessions.get(session_id)
+        if session is None or (settings.multi_worker and self._changed_on_disk(session_id)):
+            # In multi-worker mode another process may have saved newer turns
+            loaded = self._load(session_id)
+            if loaded is not None and (session is None or loaded["updated_at"] > session["updated_at"]):
+                session = loaded
+            if session is None:
+                return None
+            self._sessions[session_id] = session
+            self._evict()
+
+        if self.idle_ttl > 0 and time.time() - session["updated_at"] > self.idle_ttl:
+            self.clear(session_id)
+            return None
+
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _new(self, session_id: str) -> Dict[str, Any]:
+        session = {"session_id": session_id, "summary": "", "messages": [], "scope": [], "updated_at": 0.0}
+        self._sessions[session_id] = session
+        self._evict()
+        return session
+
+    def _evict(self):
+        """Drop least recently used sessions from memory (they stay on disk)"""
+        while len(self._sessions) > self.max_sessions:
+            session_id, _ = self._sessions.popitem(last=False)
+            self._file_versions.pop(session_id, None)
+
+    def _path(self, session_id: str) -> Optional[str]:
+        if not self.storage_path:
+            return None
+        name = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.storage_path, f"{name}.json")
+
+    @staticmethod
+    def _file_version(path: str) -> Optional[tuple]:
+        """Changes on every save: _persist replaces the file, so it gets a new inode and mtime"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _changed_on_disk(self, session_id: str) -> bool:
+        """Whether another worker saved the session since this process last read or wrote it
+
+        A stat instead of reading and parsing the file on every request.
+        """
+        path = self._path(session_id)
+        if not path:
+            return False
+        version = self._file_version(path)
+        return version is not None and version != self._file_versions.get(session_id)
+
+    def _persist(self, session: Dict[str, Any]):
+        path = self._path(session["session_id"])
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(session, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._file_versions[session["session_id"]] = self._file_version(path)
+        except OSError as e:
+            logger.error(f"Error persisting session {session['session_id']}: {e}")
+
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(session_id)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            # Taken before reading, so a save racing with the read is picked up next time
+            version = self._file_version(path)
+            with open(path, "r", encoding="utf-8") as f:
+                session = json.load(f)
+            self._file_versions[session_id] = version
+            return session
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading session {session_id}: {e}")
+            return None
+
+
+session_store = SessionStore()
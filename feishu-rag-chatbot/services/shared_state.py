@@ -0,0 +1,198 @@
+import fcntl
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, List
+from loguru import logger
+from config.settings import settings
+
+
+class FileLock:
+    """Exclusive flock(2) lock shared by every process on the host
+
+    The kernel releases it when the holding process exits, so a crashed
+    holder never leaves a stale lock behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedState:
+    """Small key/value store with expiry in SQLite, visible to all worker processes
+
+    Connections are opened per operation, so the store is safe to use on
+    either side of a fork.
+    """
+
+    def __init__(self):
+        self.db_path = settings.shared_state_path
+        self.lock_dir = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_prefix(self, prefix: str) -> Dict[str, Any]:
+        """Every unexpired key starting with prefix, with its value"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, value FROM state WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (len(prefix), prefix, time.time())
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+
+    def add_all(self, keys: List[str], ttl: Optional[float] = None) -> bool:
+        """Set all keys unless one of them is already present; atomic across processes"""
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            placeholders = ",".join("?" * len(keys))
+            if keys and conn.execute(
+                f"SELECT 1 FROM state WHERE key IN ({placeholders}) LIMIT 1", keys
+            ).fetchone():
+                return False
+            conn.executemany(
+                "INSERT INTO state (key, value, expires_at) VALUES (?, 'true', ?)",
+                [(key, expires_at) for key in keys]
+            )
+        return True
+
+    def delete(self, *keys: str):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM state WHERE key = ?", [(key,) for key in keys])
+
+    def incr(self, key: str) -> int:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+            value = (json.loads(row[0]) if row else 0) + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, NULL)",
+                (key, json.dumps(value))
+            )
+        return value
+
+    def lock(self, name: str) -> FileLock:
+        """A named host-wide lock next to the state database"""
+        return FileLock(os.path.join(self.lock_dir, f"{name}.lock"))
+
+
+class WorkerRole:
+    """Decides whether this process owns writes to the vector store
+
+    Chroma's PersistentClient is not safe with several writers on one
+    directory, so in multi-worker mode exactly one process (the holder of
+    the writer lock) ingests and deletes; the rest only search.
+    """
+
+    def __init__(self, state: SharedState):
+        self.role = settings.ingestion_role if settings.multi_worker else "writer"
+        self._lock = state.lock("ingestion_writer")
+        self._refused = False
+
+    @property
+    def is_writer(self) -> bool:
+        return self.role != "reader" and self._lock.held
+
+    def try_acquire(self) -> bool:
+        """Take the writer role if no other process holds the writer lock
+
+        A fixed writer is no exception: while bulk_ingest.py or another
+        server holds the lock it stays out of the stores instead of
+        becoming a second Chroma writer, and keeps retrying.
+        """
+        if self.role == "reader":
+            return False
+        if self._lock.held:
+            return True
+        if self._lock.acquire(blocking=False):
+            self._refused = False
+            logger.info(f"Process {os.getpid()} is the ingestion writer")
+            return True
+        if self.role == "writer" and not self._refused:
+            self._refused = True
+            logger.error(
+                "Another process holds the ingestion writer lock; "
+                "not ingesting until it is released"
+            )
+        return False
+
+    def claim(self) -> bool:
+        """Take the writer lock for a standalone process; False while a server or another process holds it"""
+        return self._lock.acquire(blocking=False)
+
+    def release(self):
+        self._lock.release()
+
+
+shared_state = SharedState()
+worker_role = WorkerRole(shared_state)
@@ -0,0 +1,145 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+from loguru import logger
+from services import metrics
+
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """One shared execution and the callers waiting on it"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.events: List[Any] = []  # items produced so far (streams only)
+        self.changed = asyncio.Event()
+
+    def wake(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution
+
+    The first caller starts the work as its own task; callers arriving while
+    it runs wait for the same result instead of repeating it. A follower
+    waits at most `timeout` seconds and then runs the work itself. The
+    shared task is cancelled only when every waiter has gone away.
+
+    Not thread-safe: use it from the event loop only.
+    """
+
+    def __init__(self, name: str, timeout: float):
+        self.name = name
+        self.timeout = timeout
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._executions = 0
+        self._coalesced = 0
+        self._timeouts = 0
+
+    def _start(self, key: Hashable, work: Callable[[_Flight], Awaitable]) -> _Flight:
+        flight = _Flight()
+        flight.task = asyncio.ensure_future(work(flight))
+        self._flights[key] = flight
+        self._executions += 1
+
+        def done(task: asyncio.Task):
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if not task.cancelled():
+                task.exception()  # retrieved here so an unawaited failure is not logged as lost
+            flight.wake()
+
+        flight.task.add_done_callback(done)
+        return flight
+
+    def _join(self, key: Hashable) -> Optional[_Flight]:
+        flight = self._flights.get(key)
+        if flight is not None:
+            self._coalesced += 1
+            metrics.coalesced_requests.inc(flight=self.name)
+        return flight
+
+    def _leave(self, key: Hashable, flight: _Flight):
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # Nobody wants the result; later callers start afresh
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.task.cancel()
+
+    def _timed_out(self):
+        self._timeouts += 1
+        metrics.coalesce_timeouts.inc(flight=self.name)
+        logger.warning(f"Coalesced {self.name} call exceeded {self.timeout}s; running it separately")
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Return fn()'s result, sharing one execution among concurrent callers with the same key"""
+        flight = self._join(key)
+        leader = flight is None
+        if leader:
+            flight = self._start(key, lambda _: fn())
+        flight.waiters += 1
+        try:
+            if leader:
+                return await asyncio.shield(flight.task)
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight.task), self.timeout)
+            except asyncio.TimeoutError:
+                self._timed_out()
+        finally:
+            self._leave(key, flight)
+        return await fn()
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Yield fn()'s items, sharing one iteration among concurrent callers with the same key
+
+        Callers that join late first receive the items produced so far.
+        """
+        flight = self._join(key)
+        leader = flight is None
+        if leader:
+            async def pump(flight: _Flight):
+                async for item in fn():
+                    flight.events.append(item)
+                    flight.wake()
+
+            flight = self._start(key, pump)
+        flight.waiters += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.events):
+                    yield flight.events[index]
+                    index += 1
+                if flight.task.done():
+                    if flight.task.cancelled():
+                        raise asyncio.CancelledError()
+                    if flight.task.exception() is not None:
+                        raise flight.task.exception()
+                    return
+                changed = flight.changed
+                if leader or index > 0:
+                    await changed.wait()
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    # Nothing shared yet: stream separately instead of waiting longer
+                    self._timed_out()
+                    break
+        finally:
+            self._leave(key, flight)
+        async for item in fn():
+            yield item
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "executions": self._executions,
+            "coalesced": self._coalesced,
+            "timeouts": self._timeouts
+        }
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+from loguru import logger
+
+
+class TaskQueue:
+    """Bounded in-process queue that runs coroutines on a fixed number of workers"""
+
+    def __init__(self, name: str, workers: int, max_size: int):
+        self.name = name
+        self.num_workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def start(self):
+        """Start the worker tasks"""
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.num_workers)
+        ]
+        logger.info(f"Started task queue '{self.name}' with {self.num_workers} workers")
+
+    async def stop(self):
+        """Cancel workers; queued tasks are dropped"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, task: Callable[[], Awaitable[Any]]) -> bool:
+        """Queue a coroutine factory; returns False when the queue is full"""
+        if self._queue is None:
+            raise RuntimeError(f"Task queue '{self.name}' is not running")
+        try:
+            self._queue.put_nowait((time.monotonic(), task))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            logger.warning(f"Task queue '{self.name}' is full, rejecting task")
+            return False
+        self._submitted += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, concurrency and wait-time counters"""
+        started = self._completed + self._failed + self._in_flight
+        return {
+            "workers": self.num_workers,
+            "max_size": self.max_size,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_flight": self._in_flight,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "avg_wait_seconds": self._total_wait / started if started else 0.0,
+            "max_wait_seconds": self._max_wait
+        }
+
+    async def _worker(self):
+        while True:
+            enqueued_at, task = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._in_flight += 1
+            try:
+                await task()
+                self._completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                logger.error(f"Task in queue '{self.name}' failed: {e}")
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
@@ -1,86 +1,275 @@
-import chromadb
-from chromadb.config import Settings as ChromaSettings
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any, Optional
-import uuid
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import hashlib
+import math
+import threading
+import time
+import numpy as np
 from loguru import logger
 from config.settings import settings
+from services.metrics import track, ingested_chunks
+from services.embedding_service import embedding_service
+from services.lexical_index import lexical_index
+from services.compact_vector_store import CompactVectorStore
+
+
+def open_compact_store() -> CompactVectorStore:
+    return CompactVectorStore(
+        settings.compact_store_path,
+        dtype=settings.compact_store_dtype,
+        rescore=settings.compact_store_rescore,
+        rescore_candidates=settings.compact_store_rescore_candidates
+    )
 
 
 class VectorDBService:
     def __init__(self):
-        self.client = chromadb.PersistentClient(
-            path=settings.chroma_persist_directory,
-            settings=ChromaSettings(anonymized_telemetry=False)
-        )
-        self.embedding_model = SentenceTransformer(settings.embedding_model)
+        self.embedder = embedding_service
+        self.lexical = lexical_index
         self.collection_name = "pdf_documents"
-        self._init_collection()
+        self._client = None
+        self._collection = None
+        self._init_lock = threading.Lock()
+        
+        # file_id -> (chunk ids, unit-normalized embedding matrix) for exact scoped scans
+        self._scope_cache: "OrderedDict[str, Tuple[List[str], np.ndarray]]" = OrderedDict()
+        self._scope_lock = threading.Lock()
+        self._filter_counts = {"exact": 0, "post_filter": 0, "fallback": 0}
+        self._filter_counts_lock = threading.Lock()
+    
+    @property
+    def client(self):
+        if self._client is None:
+            self._init_collection()
+        return self._client
+    
+    @property
+    def collection(self):
+        """Open the Chroma store on first use (or during the startup warm-up)"""
+        if self._collection is None:
+            self._init_collection()
+        return self._collection
+    
+    def load(self):
+        """Open the Chroma store now instead of on the first request"""
+        self.collection
+    
+    def reload(self):
+        """Reopen the store on next use to see another process's writes"""
+        with self._init_lock:
+            if self._collection is None:
+                return
+            if self._client is not None:
+                from chromadb.api.client import SharedSystemClient
+                # Chroma caches one system per path; drop it so the segments are re-read from disk
+                SharedSystemClient.clear_system_cache()
+            self._client = None
+            self._collection = None
+        self._clear_scope_cache()
+        logger.info("Reopening Chroma store after a corpus change")
     
     def _init_collection(self):
         """Initialize or get collection"""
-        try:
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                metadata={"hnsw:space": "cosine"}
+        with self._init_lock:
+            if self._collection is not None:
+                return
+            if settings.vector_store == "compact":
+                self._collection = open_compact_store()
+                logger.info(f"Using compact vector store: {self._collection.stats()}")
+                return
+            import chromadb
+            from chromadb.config import Settings as ChromaSettings
+            start = time.perf_counter()
+            client = chromadb.PersistentClient(
+                path=settings.chroma_persist_directory,
+                settings=ChromaSettings(anonymized_telemetry=False)
             )
-            logger.info(f"Created new collection: {self.collection_name}")
-        except:
-            self.collection = self.client.get_collection(name=self.collection_name)
-            logger.info(f"Using existing collection: {self.collection_name}")
+            try:
+                collection = client.create_collection(
+                    name=self.collection_name,
+                    metadata={"hnsw:space": "cosine"}
+                )
+                logger.info(f"Created new collection: {self.collection_name}")
+            except:
+                collection = client.get_collection(name=self.collection_name)
+                logger.info(f"Using existing collection: {self.collection_name}")
+            self._client = client
+            self._collection = collection
+            logger.info(f"Opened Chroma store in {time.perf_counter() - start:.2f}s")
     
-    def add_documents(self, documents: List[Dict[str, Any]], file_id: str, filename: str):
-        """Add documents to vector database"""
+    def add_documents(
+        self,
+        documents: List[Dict[str, Any]],
+        file_id: Optional[str] = None,
+        filename: Optional[str] = None,
+        progress: Optional[Callable[[str, float], None]] = None,
+        reuse_embeddings: Optional[Dict[str, List[float]]] = None
+    ) -> Dict[str, Any]:
+        """Add documents to vector database using batched encoding and bulk writes
+        
+        Chunks are stored under their deterministic chunk_id, so re-adding a
+        document overwrites instead of duplicating. Chunks whose text hash is in
+        reuse_embeddings are not re-encoded. A chunk's own "file_id" and
+        "filename" keys override the arguments, so one call can write a batch
+        spanning several documents.
+        """
         if not documents:
-            return
+            return {"chunks": 0, "encoded": 0, "seconds": 0.0, "chunks_per_sec": 0.0}
+        
+        start = time.perf_counter()
+        file_ids = [doc.get("file_id") or file_id for doc in documents]
+        for doc_file_id in set(file_ids):
+            self._clear_scope_cache(doc_file_id)
+        
+        texts = [doc["text"] for doc in documents]
+        text_hashes = [self.text_hash(text) for text in texts]
+        
+        # Encode only chunks without a reusable embedding, in batches
+        reuse_embeddings = reuse_embeddings or {}
+        to_encode = [i for i, h in enumerate(text_hashes) if h not in reuse_embeddings]
+        with track("ingest_embed"):
+            encoded = self.encode_texts([texts[i] for i in to_encode], progress=progress) if to_encode else []
+        encoded_by_index = dict(zip(to_encode, encoded))
+        embeddings = [
+            encoded_by_index[i] if i in encoded_by_index else reuse_embeddings[h]
+            for i, h in enumerate(text_hashes)
+        ]
         
         # Prepare data for insertion
         ids = []
-        embeddings = []
         metadatas = []
-        documents_text = []
-        
-        for doc in documents:
-            doc_id = str(uuid.uuid4())
-            ids.append(doc_id)
-            
-            # Generate embedding
-            embedding = self.embedding_model.encode(doc["text"])
-            embeddings.append(embedding.tolist())
-            
-            # Prepare metadata
+        for doc, doc_file_id, text_hash in zip(documents, file_ids, text_hashes):
+            ids.append(doc["chunk_id"])
             metadata = {
-                "file_id": file_id,
-                "filename": filename,
+                "file_id": doc_file_id,
+                "filename": doc.get("filename") or filename,
                 "page": doc["page"],
-                "chunk_id": doc["chunk_id"]
+                "page_end": doc.get("page_end", doc["page"]),
+                "chunk_id": doc["chunk_id"],
+                "text_hash": text_hash
             }
+            if "chunk_index" in doc:
+                metadata["chunk_index"] = doc["chunk_index"]
             metadatas.append(metadata)
-            documents_text.append(doc["text"])
-        
-        # Add to collection
-        self.collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            metadatas=metadatas,
-            documents=documents_text
+        
+        # Upsert into collection in bulk slices
+        write_batch = max(1, settings.chroma_write_batch_size)
+        with track("ingest_index"):
+            for i in range(0, len(ids), write_batch):
+                self.collection.upsert(
+                    ids=ids[i:i + write_batch],
+                    embeddings=embeddings[i:i + write_batch],
+                    metadatas=metadatas[i:i + write_batch],
+                    documents=texts[i:i + write_batch]
+                )
+                if progress:
+                    progress("index", min(i + write_batch, len(ids)) / len(ids))
+            self.lexical.add(zip(ids, file_ids, texts))
+        ingested_chunks.inc(len(ids))
+        
+        elapsed = time.perf_counter() - start
+        chunks_per_sec = len(documents) / elapsed if elapsed > 0 else 0.0
+        target = f"file: {filename}" if filename else f"{len(set(file_ids))} files"
+        logger.info(
+            f"Added {len(documents)} documents ({len(to_encode)} encoded) to vector database "
+            f"for {target} in {elapsed:.2f}s ({chunks_per_sec:.1f} chunks/sec)"
         )
+        return {
+            "chunks": len(documents),
+            "encoded": len(to_encode),
+            "seconds": elapsed,
+            "chunks_per_sec": chunks_per_sec
+        }
+    
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Stable hash of chunk text, stored in metadata for incremental re-ingestion"""
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+    
+    def get_embeddings_by_hash(self, file_id: str) -> Dict[str, List[float]]:
+        """Map text hash -> stored embedding for every chunk of a file"""
+        result = self.collection.get(where={"file_id": file_id}, include=["embeddings", "metadatas"])
+        embeddings = {}
+        for metadata, embedding in zip(result["metadatas"] or [], result["embeddings"] or []):
+            text_hash = metadata.get("text_hash")
+            if text_hash and embedding is not None:
+                embeddings[text_hash] = list(embedding)
+        return embeddings
+    
+    def get_file_texts(self, file_id: str, limit: int) -> List[str]:
+        """The first chunks of a file in reading order"""
+        result = self.collection.get(where={"file_id": file_id}, include=["documents", "metadatas"])
+        chunks = sorted(
+            zip(result["metadatas"] or [], result["documents"] or []),
+            key=lambda item: (item[0].get("page", 0), item[0].get("chunk_index", 0), item[0].get("chunk_id", ""))
+        )
+        return [text for _, text in chunks[:limit]]
+    
+    def encode_texts(
+        self,
+        texts: List[str],
+        progress: Optional[Callable[[str, float], None]] = None
+    ) -> List[List[float]]:
+        """Encode document chunks through the shared embedding service"""
+        return self.embedder.encode_documents(texts, progress=progress)
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Encode a single query"""
+        return self.embedder.embed_query(query)
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """Encode a query via the micro-batching encoder"""
+        return await self.embedder.aembed_query(query)
+    
+    def close(self):
+        """Release embedding resources"""
+        self.embedder.close()
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        file_ids: Optional[List[str]] = None,
+        query_embedding: Optional[List[float]] = None,
+        mode: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Search for similar documents ("vector" or "hybrid" mode)"""
+        # Generate query embedding unless the caller already has one
+        if query_embedding is None:
+            with track("embed_query"):
+                query_embedding = self.embed_query(query)
         
-        logger.info(f"Added {len(documents)} documents to vector database for file: {filename}")
+        with track("search"):
+            if (mode or settings.search_mode) == "hybrid":
+                return self._hybrid_search(query, top_k, file_ids, query_embedding)
+            return self._vector_search(top_k, file_ids, query_embedding)
     
-    def search(self, query: str, top_k: int = 5, file_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
-        """Search for similar documents"""
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode(query)
+    def _vector_search(
+        self,
+        top_k: int,
+        file_ids: Optional[List[str]],
+        query_embedding: List[float]
+    ) -> List[Dict[str, Any]]:
+        """Dense retrieval from the Chroma collection (or the compact store)"""
+        # The compact store already scans only the scoped files' rows
+        if file_ids and settings.vector_store != "compact":
+            return self._filtered_vector_search(top_k, file_ids, query_embedding)
         
         # Prepare where clause for filtering
         where = None
         if file_ids:
             where = {"file_id": {"$in": file_ids}}
-        
+        return self._ann_search(top_k, where, query_embedding)
+    
+    def _ann_search(
+        self,
+        top_k: int,
+        where: Optional[Dict[str, Any]],
+        query_embedding: List[float]
+    ) -> List[Dict[str, Any]]:
         # Search in collection
         results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
+            query_embeddings=[query_embedding],
             n_results=top_k,
             where=where
         )
@@ -98,15 +287,201 @@ class VectorDBService:
         
         return formatted_results
     
+    def _filtered_vector_search(
+        self,
+        top_k: int,
+        file_ids: List[str],
+        query_embedding: List[float]
+    ) -> List[Dict[str, Any]]:
+        """Pick a strategy for a file_ids scope by its size and selectivity
+        
+        Chroma applies a where filter around the HNSW search, which is slow and
+        loses recall when the scope is a small slice of a large corpus. Small
+        scopes are scanned exactly instead; large ones use unfiltered ANN,
+        over-fetching by 1/selectivity until top_k results fall in scope.
+        """
+        scope = self.lexical.count_files(file_ids)
+        if scope == 0:
+            # The lexical index has not caught up with these files (warm-up or a partial sync)
+            self._count_filter("fallback")
+            return self._ann_search(top_k, {"file_id": {"$in": file_ids}}, query_embedding)
+        if scope <= settings.filter_exact_max_chunks:
+            self._count_filter("exact")
+            return self._exact_search(top_k, file_ids, query_embedding)
+        
+        total = max(self.lexical.count(), scope)
+        allowed = set(file_ids)
+        n_results = math.ceil(top_k * total / scope * settings.filter_overfetch_factor)
+        while True:
+            n_results = min(n_results, total, max(settings.filter_max_candidates, top_k))
+            hits = [
+                result for result in self._ann_search(n_results, None, query_embedding)
+                if result["metadata"].get("file_id") in allowed
+            ]
+            if len(hits) >= top_k or n_results >= total:
+                self._count_filter("post_filter")
+                return hits[:top_k]
+            if n_results >= settings.filter_max_candidates:
+                break
+            n_results *= 2
+        
+        # Still short of top_k within the budget: let Chroma filter
+        self._count_filter("fallback")
+        return self._ann_search(top_k, {"file_id": {"$in": file_ids}}, query_embedding)
+    
+    def _exact_search(
+        self,
+        top_k: int,
+        file_ids: List[str],
+        query_embedding: List[float]
+    ) -> List[Dict[str, Any]]:
+        """Brute-force cosine over only the scoped files' embeddings"""
+        ids: List[str] = []
+        matrices = []
+        for file_id in dict.fromkeys(file_ids):
+            file_chunk_ids, matrix = self._scope_vectors(file_id)
+            if file_chunk_ids:
+                ids.extend(file_chunk_ids)
+                matrices.append(matrix)
+        if not ids:
+            return []
+        
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = np.concatenate(matrices) @ query
+        k = min(top_k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+        top = top[np.argsort(-scores[top])]
+        
+        top_ids = [ids[i] for i in top]
+        fetched = self.collection.get(ids=top_ids, include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: (document, metadata)
+            for chunk_id, document, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])
+        }
+        return [
+            {
+                "id": ids[i],
+                "text": by_id[ids[i]][0],
+                "metadata": by_id[ids[i]][1],
+                "distance": 1.0 - float(scores[i])
+            }
+            for i in top if ids[i] in by_id
+        ]
+    
+    def _scope_vectors(self, file_id: str) -> Tuple[List[str], np.ndarray]:
+        """A file's chunk ids and normalized embeddings, looked up by id and cached"""
+        with self._scope_lock:
+            cached = self._scope_cache.get(file_id)
+            if cached is not None:
+                self._scope_cache.move_to_end(file_id)
+                return cached
+        
+        chunk_ids = self.lexical.chunk_ids([file_id])
+        result = self.collection.get(ids=chunk_ids, include=["embeddings"]) if chunk_ids else {"ids": []}
+        if result["ids"]:
+            matrix = np.asarray(result["embeddings"], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms > 0, norms, 1.0)
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+        entry = (list(result["ids"]), matrix)
+        
+        with self._scope_lock:
+            self._scope_cache[file_id] = entry
+            while len(self._scope_cache) > max(0, settings.filter_scope_cache_size):
+                self._scope_cache.popitem(last=False)
+        return entry
+    
+    def _clear_scope_cache(self, file_id: Optional[str] = None):
+        with self._scope_lock:
+            if file_id is None:
+                self._scope_cache.clear()
+            else:
+                self._scope_cache.pop(file_id, None)
+    
+    def _count_filter(self, strategy: str):
+        # Searches run in worker threads
+        with self._filter_counts_lock:
+            self._filter_counts[strategy] += 1
+    
+    def filter_stats(self) -> Dict[str, int]:
+        """How file_ids-scoped searches were served"""
+        with self._filter_counts_lock:
+            return dict(self._filter_counts)
+    
+    def _hybrid_search(
+        self,
+        query: str,
+        top_k: int,
+        file_ids: Optional[List[str]],
+        query_embedding: List[float]
+    ) -> List[Dict[str, Any]]:
+        """Fuse BM25 and vector rankings with reciprocal rank fusion"""
+        candidates = max(top_k, settings.hybrid_candidates)
+        dense = self._vector_search(candidates, file_ids, query_embedding)
+        lexical = self.lexical.search(query, top_k=candidates, file_ids=file_ids)
+        
+        fused: Dict[str, float] = {}
+        for rank, result in enumerate(dense):
+            fused[result["id"]] = fused.get(result["id"], 0.0) + 1.0 / (settings.rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (settings.rrf_k + rank + 1)
+        
+        ranked_ids = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        
+        # Lexical-only hits still need their text and metadata
+        by_id = {result["id"]: result for result in dense}
+        missing = [chunk_id for chunk_id in ranked_ids if chunk_id not in by_id]
+        if missing:
+            fetched = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for i, chunk_id in enumerate(fetched["ids"]):
+                by_id[chunk_id] = {
+                    "id": chunk_id,
+                    "text": fetched["documents"][i],
+                    "metadata": fetched["metadatas"][i],
+                    "distance": None
+                }
+        
+        results = []
+        for chunk_id in ranked_ids:
+            if chunk_id in by_id:
+                results.append(dict(by_id[chunk_id], score=fused[chunk_id]))
+        return results
+    
+    def sync_lexical_index(self):
+        """Build the lexical index from the collection if it is empty (one-time migration)"""
+        if self.lexical.count() > 0 or self.collection.count() == 0:
+            return
+        
+        page_size = max(1, settings.chroma_write_batch_size)
+        offset = 0
+        while True:
+            page = self.collection.get(
+                include=["documents", "metadatas"], limit=page_size, offset=offset
+            )
+            if not page["ids"]:
+                break
+            self.lexical.add(
+                (chunk_id, metadata.get("file_id", ""), text or "")
+                for chunk_id, metadata, text in zip(page["ids"], page["metadatas"], page["documents"])
+            )
+            offset += len(page["ids"])
+        logger.info(f"Built lexical index for {offset} existing chunks")
+    
     def delete_by_file_id(self, file_id: str):
         """Delete all documents for a specific file"""
         self.collection.delete(where={"file_id": file_id})
+        self.lexical.delete_file(file_id)
+        self._clear_scope_cache(file_id)
         logger.info(f"Deleted all documents for file: {file_id}")
     
-    def get_all_files(self) -> List[Dict[str, str]]:
-        """Get all unique files in the database"""
-        # Get all documents
-        all_docs = self.collection.get()
+    def get_all_files(self) -> List[Dict[str, Any]]:
+        """Get all unique files in the database
+        
+        Scans every chunk's metadata; only used to seed the document catalog.
+        """
+        all_docs = self.collection.get(include=["metadatas"])
         
         # Extract unique files
         files = {}
@@ -114,10 +489,12 @@ class VectorDBService:
             for metadata in all_docs["metadatas"]:
                 file_id = metadata.get("file_id")
                 filename = metadata.get("filename")
-                if file_id and filename and file_id not in files:
-                    files[file_id] = filename
+                if not (file_id and filename):
+                    continue
+                if file_id not in files:
+                    files[file_id] = {"file_id": file_id, "filename": filename, "chunks": 0}
+                files[file_id]["chunks"] += 1
         
-        return [{"file_id": k, "filename": v} for k, v in files.items()]
-
+        return list(files.values())
 
 vector_db_service = VectorDBService()
\ No newline at end of file
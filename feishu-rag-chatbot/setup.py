@@ -12,6 +12,8 @@ def create_directories():
     directories = [
         "logs",
         "storage/pdfs", 
+        "storage/jobs",
+        "storage/import",
         "storage/vectordb"
     ]
     
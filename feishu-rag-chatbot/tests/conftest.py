@@ -0,0 +1,12 @@
+"""
+Shared test setup
+
+Settings are read when config.settings is first imported, so the required
+variables get placeholder values here, before any test module imports it.
+"""
+import os
+
+os.environ.setdefault("FEISHU_APP_ID", "test-app-id")
+os.environ.setdefault("FEISHU_APP_SECRET", "test-app-secret")
+os.environ.setdefault("FEISHU_VERIFICATION_TOKEN", "test-verification-token")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
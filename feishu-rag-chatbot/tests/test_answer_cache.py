@@ -0,0 +1,93 @@
+import time
+import pytest
+from config.settings import settings
+from services import cache_service
+from services.cache_service import AnswerCache
+from services.shared_state import SharedState
+
+
+ANSWER = {"response": "42", "sources": [], "context_used": 1}
+
+
+def make_cache(**overrides) -> AnswerCache:
+    options = {"max_entries": 10, "ttl_seconds": 60, "semantic_threshold": 0.9}
+    options.update(overrides)
+    return AnswerCache(**options)
+
+
+@pytest.fixture(autouse=True)
+def single_worker(monkeypatch):
+    monkeypatch.setattr(settings, "multi_worker", False)
+
+
+def test_exact_hit_ignores_case_whitespace_and_trailing_punctuation():
+    cache = make_cache()
+    cache.set("What is the answer?", ["b", "a"], 1, ANSWER)
+    
+    assert cache.get("  what is   the ANSWER ", ["a", "b"], 1) == ANSWER
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_scope_separates_files_corpus_versions_and_histories():
+    cache = make_cache()
+    cache.set("question", ["a"], 1, ANSWER, history="conversation-1")
+    
+    assert cache.get("question", ["b"], 1, history="conversation-1") is None
+    assert cache.get("question", ["a"], 2, history="conversation-1") is None
+    assert cache.get("question", ["a"], 1, history="conversation-2") is None
+    assert cache.get("question", ["a"], 1) is None
+    assert cache.get("question", ["a"], 1, history="conversation-1") == ANSWER
+
+
+def test_semantic_hit_needs_the_threshold_and_the_same_history():
+    cache = make_cache()
+    cache.set("how tall is the tower", None, 1, ANSWER, query_embedding=[1.0, 0.0])
+    
+    # cosine 0.995 and 0.707 against the cached question
+    assert cache.get("tower height", None, 1, query_embedding=[1.0, 0.1]) == ANSWER
+    assert cache.get("tower width", None, 1, query_embedding=[1.0, 1.0]) is None
+    assert cache.get("tower height", None, 1, query_embedding=[1.0, 0.1], history="other") is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_expired_entries_are_dropped():
+    cache = make_cache(ttl_seconds=0.05)
+    cache.set("question", None, 1, ANSWER)
+    time.sleep(0.1)
+    
+    assert cache.get("question", None, 1) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = make_cache(max_entries=2)
+    cache.set("first", None, 1, ANSWER)
+    cache.set("second", None, 1, ANSWER)
+    cache.get("first", None, 1)
+    cache.set("third", None, 1, ANSWER)
+    
+    assert cache.get("second", None, 1) is None
+    assert cache.get("first", None, 1) == ANSWER
+    assert cache.get("third", None, 1) == ANSWER
+
+
+def test_invalidate_drops_every_entry():
+    cache = make_cache()
+    cache.set("question", None, 1, ANSWER)
+    cache.invalidate()
+    
+    assert cache.get("question", None, 1) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_workers_share_exact_answers(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "multi_worker", True)
+    monkeypatch.setattr(settings, "shared_state_path", str(tmp_path / "shared_state.db"))
+    monkeypatch.setattr(cache_service, "shared_state", SharedState())
+    # Two caches stand in for the answer caches of two worker processes
+    writer, reader = make_cache(), make_cache()
+    writer.set("question", ["a"], 1, ANSWER, history="conversation")
+    
+    assert reader.get("question", ["a"], 1, history="conversation") == ANSWER
+    assert reader.get("question", ["a"], 2, history="conversation") is None
+    assert reader.stats()["shared_hits"] == 1
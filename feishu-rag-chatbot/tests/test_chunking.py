@@ -0,0 +1,24 @@
+from services.chunking import SentenceChunker
+
+
+# No punctuation, so the whole text is one sentence far over max_tokens
+CJK_SENTENCE = "这是一个非常长的中文句子没有任何标点符号用来测试分块器是否会在字符中间切断从而产生替换字符" * 5
+
+
+def test_oversized_cjk_sentence_is_cut_on_character_boundaries():
+    chunker = SentenceChunker(max_tokens=16, overlap_tokens=0)
+    pieces = chunker._split_oversized(CJK_SENTENCE)
+    
+    assert len(pieces) > 1
+    assert all("�" not in text for text, _ in pieces)
+    assert "".join(text for text, _ in pieces) == CJK_SENTENCE
+    assert all(tokens <= 16 for _, tokens in pieces)
+
+
+def test_cjk_chunks_stay_within_budget_and_keep_the_text():
+    chunker = SentenceChunker(max_tokens=32, overlap_tokens=0)
+    chunks = list(chunker.chunk([(1, CJK_SENTENCE + "。第二句。")], "doc"))
+    
+    assert len(chunks) > 1
+    assert all("�" not in chunk["text"] for chunk in chunks)
+    assert "".join(chunk["text"] for chunk in chunks) == CJK_SENTENCE + "。第二句。"
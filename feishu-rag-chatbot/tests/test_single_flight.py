@@ -0,0 +1,152 @@
+import asyncio
+import pytest
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = 0
+    
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "answer"
+    
+    async def run():
+        flights = SingleFlight("test", timeout=5)
+        results = await asyncio.gather(*[flights.do("key", work) for _ in range(5)])
+        return results, flights.stats()
+    
+    results, stats = asyncio.run(run())
+    
+    assert results == ["answer"] * 5
+    assert calls == 1
+    assert stats == {"in_flight": 0, "executions": 1, "coalesced": 4, "timeouts": 0}
+
+
+def test_different_keys_run_separately():
+    async def run():
+        flights = SingleFlight("test", timeout=5)
+        
+        async def work(value):
+            await asyncio.sleep(0.01)
+            return value
+        
+        results = await asyncio.gather(flights.do("a", lambda: work(1)), flights.do("b", lambda: work(2)))
+        return results, flights.stats()
+    
+    results, stats = asyncio.run(run())
+    
+    assert results == [1, 2]
+    assert stats["executions"] == 2 and stats["coalesced"] == 0
+
+
+def test_failure_reaches_every_waiter_and_is_not_reused():
+    calls = 0
+    
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+    
+    async def run():
+        flights = SingleFlight("test", timeout=5)
+        results = await asyncio.gather(*[flights.do("key", work) for _ in range(3)], return_exceptions=True)
+        # The failed flight is gone, so the next call runs again
+        with pytest.raises(RuntimeError):
+            await flights.do("key", work)
+        return results
+    
+    results = asyncio.run(run())
+    
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert calls == 2
+
+
+def test_follower_runs_the_work_itself_after_the_timeout():
+    async def run():
+        flights = SingleFlight("test", timeout=0.05)
+        release = asyncio.Event()
+        
+        async def slow():
+            await release.wait()
+            return "slow"
+        
+        async def fast():
+            return "fast"
+        
+        leader = asyncio.ensure_future(flights.do("key", slow))
+        await asyncio.sleep(0)
+        follower = await flights.do("key", fast)
+        release.set()
+        return await leader, follower, flights.stats()
+    
+    leader, follower, stats = asyncio.run(run())
+    
+    assert (leader, follower) == ("slow", "fast")
+    assert stats["timeouts"] == 1
+
+
+def test_shared_work_is_cancelled_only_when_every_waiter_left():
+    started = 0
+    cancelled = 0
+    
+    async def work():
+        nonlocal started, cancelled
+        started += 1
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled += 1
+            raise
+    
+    async def run():
+        flights = SingleFlight("test", timeout=5)
+        first = asyncio.ensure_future(flights.do("key", work))
+        second = asyncio.ensure_future(flights.do("key", work))
+        await asyncio.sleep(0.01)
+        
+        first.cancel()
+        await asyncio.sleep(0.01)
+        still_running = cancelled == 0
+        
+        second.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+        await asyncio.sleep(0)
+        return still_running, flights.stats()
+    
+    still_running, stats = asyncio.run(run())
+    
+    assert still_running
+    assert started == 1 and cancelled == 1
+    assert stats["in_flight"] == 0
+
+
+def test_late_stream_follower_replays_earlier_items():
+    async def run():
+        flights = SingleFlight("test", timeout=5)
+        produced = asyncio.Event()
+        release = asyncio.Event()
+        
+        async def tokens():
+            yield "a"
+            produced.set()
+            await release.wait()
+            yield "b"
+            yield "c"
+        
+        async def collect():
+            return [item async for item in flights.stream("key", tokens)]
+        
+        leader = asyncio.ensure_future(collect())
+        await produced.wait()
+        follower = asyncio.ensure_future(collect())
+        await asyncio.sleep(0.01)
+        release.set()
+        return await leader, await follower, flights.stats()
+    
+    leader, follower, stats = asyncio.run(run())
+    
+    assert leader == follower == ["a", "b", "c"]
+    assert stats["executions"] == 1 and stats["coalesced"] == 1
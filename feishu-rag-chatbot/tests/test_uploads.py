@@ -0,0 +1,95 @@
+import asyncio
+from typing import List
+import pytest
+from starlette.requests import Request
+from app.uploads import MultipartUpload
+from services.pdf_service import FileTooLargeError
+
+
+BOUNDARY = "test-boundary"
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 40 + b"\n%%EOF"
+
+
+def multipart_body(file_content: bytes) -> bytes:
+    """A form with one field before the file and one after it"""
+    return b"".join([
+        f"--{BOUNDARY}\r\n".encode(),
+        b'Content-Disposition: form-data; name="description"\r\n\r\nquarterly report\r\n',
+        f"--{BOUNDARY}\r\n".encode(),
+        b'Content-Disposition: form-data; name="file"; filename="report.pdf"\r\n',
+        b"Content-Type: application/pdf\r\n\r\n",
+        file_content,
+        b"\r\n",
+        f"--{BOUNDARY}\r\n".encode(),
+        b'Content-Disposition: form-data; name="replaces"\r\n\r\nold-file-id\r\n',
+        f"--{BOUNDARY}--\r\n".encode()
+    ])
+
+
+def streamed_request(body: bytes, chunk_size: int, sent: List[int]) -> Request:
+    """A request whose body arrives in chunks, without a Content-Length; sent counts the chunks read"""
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    
+    async def receive():
+        index = len(sent)
+        sent.append(index)
+        return {"type": "http.request", "body": chunks[index], "more_body": index + 1 < len(chunks)}
+    
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/upload_pdf",
+        "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    }
+    return Request(scope, receive)
+
+
+async def read_upload(upload: MultipartUpload):
+    filename = await upload.open_file("file")
+    fields_before = dict(upload.fields)
+    content = b"".join([chunk async for chunk in upload.file_chunks()])
+    return filename, fields_before, content, await upload.finish()
+
+
+def test_file_and_fields_are_parsed_as_the_body_arrives():
+    body = multipart_body(PDF)
+    upload = MultipartUpload(streamed_request(body, 100, []), max_bytes=len(body))
+    
+    filename, fields_before, content, fields = asyncio.run(read_upload(upload))
+    
+    assert filename == "report.pdf"
+    assert content == PDF
+    assert fields_before == {"description": "quarterly report"}
+    assert fields == {"description": "quarterly report", "replaces": "old-file-id"}
+
+
+def test_body_over_the_limit_is_cut_off_while_streaming():
+    body = multipart_body(PDF * 10)
+    sent = []
+    upload = MultipartUpload(streamed_request(body, 1000, sent), max_bytes=5000)
+    
+    with pytest.raises(FileTooLargeError):
+        asyncio.run(read_upload(upload))
+    # Reading stopped at the sixth chunk, the first to take the body past 5000 bytes
+    assert len(sent) == 6
+
+
+def test_missing_file_part_returns_none():
+    body = b"".join([
+        f"--{BOUNDARY}\r\n".encode(),
+        b'Content-Disposition: form-data; name="description"\r\n\r\nno file\r\n',
+        f"--{BOUNDARY}--\r\n".encode()
+    ])
+    upload = MultipartUpload(streamed_request(body, 16, []), max_bytes=len(body))
+    
+    async def run():
+        return await upload.open_file("file"), await upload.finish()
+    
+    assert asyncio.run(run()) == (None, {"description": "no file"})
+
+
+def test_non_multipart_request_is_rejected():
+    request = Request({"type": "http", "method": "POST", "path": "/", "headers": [(b"content-type", b"application/json")]})
+    
+    with pytest.raises(ValueError):
+        MultipartUpload(request, max_bytes=1000)